@@ -1,38 +1,299 @@
-from flask import Flask, render_template, redirect, url_for, jsonify, request, session, g
+from flask import Flask, render_template, redirect, url_for, jsonify, request, session, g, Response, stream_with_context
 import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
-import recommender.model as model
-import recommender.preprocessing as pp
-import pandas as pd
+from recommender.cache import RecommendationCache, MemoryBackend, SQLiteBackend
+import database.ratings as ratings_db
+import database.schema as schema
+from database.pool import ConnectionPool
+from database.title_search import RefreshingTitleSearchIndex
+from database.write_queue import RatingWriteQueue
+import instrumentation
+from instrumentation import timer
 from dotenv import load_dotenv
+# pandas, scipy and the recommender modules are imported where they are first needed, so a worker
+# can serve /login and /search without paying for the scientific stack (see warm_up)
 from functools import wraps
+import atexit
 import datetime     # for adding timestamp data
-import os, sys
+import json
+import threading
+import os
 
 app = Flask(__name__)
 
 load_dotenv()
 app.secret_key = os.environ["FLASK_SECRET_KEY"]
 
-def get_db():
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    sys.path.append(os.path.join(BASE_DIR, '..'))
-
-    db_path = os.path.join(BASE_DIR, 'db', 'movies.db')
+# MOVIES_DB_PATH and ARTIFACTS_DIR point the app at another database and artifact directory, e.g. for benchmarks
+DB_PATH = os.environ.get("MOVIES_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db', 'movies.db'))
+ARTIFACTS_DIR = os.environ.get("ARTIFACTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifacts'))
+DATASET_CACHE_DIR = os.path.join(ARTIFACTS_DIR, 'dataset')
+
+MODEL_ARTIFACT_PATH = os.path.join(ARTIFACTS_DIR, 'model.npz')
+_model_artifact = None
+_model_artifact_lock = threading.Lock()
+_model_artifact_build_thread = None
+_model_artifact_build_lock = threading.Lock()
+
+PROFILE_STORE_PATH = os.path.join(ARTIFACTS_DIR, 'profile_store.npz')
+PROFILE_JOURNAL_PATH = os.path.join(ARTIFACTS_DIR, 'profile_store.journal')
+_profile_store = None
+_profile_store_lock = threading.Lock()
+
+# Journals are folded into their snapshots once they grow past this many bytes
+JOURNAL_COMPACT_BYTES = int(os.environ.get("JOURNAL_COMPACT_BYTES", 1 << 20))
+_compaction_lock = threading.Lock()
+
+POPULARITY_INDEX_PATH = os.path.join(ARTIFACTS_DIR, 'popularity.npz')
+POPULARITY_JOURNAL_PATH = os.path.join(ARTIFACTS_DIR, 'popularity.journal')
+_popularity_index = None
+_popularity_index_lock = threading.Lock()
+_popularity_index_build_thread = None
+_popularity_index_build_lock = threading.Lock()
+
+# Set RECOMMENDATION_CACHE_PATH to share the cache between workers through a file (e.g. under /dev/shm), which
+# gunicorn.conf.py does when it runs several workers. Entries expire after RECOMMENDATION_CACHE_TTL seconds either way.
+if os.environ.get("RECOMMENDATION_CACHE_PATH"):
+    _recommendation_cache_backend = SQLiteBackend(os.environ["RECOMMENDATION_CACHE_PATH"])
+else:
+    _recommendation_cache_backend = MemoryBackend()
+
+recommendation_cache = RecommendationCache(backend=_recommendation_cache_backend,
+                                           max_entries=int(os.environ.get("RECOMMENDATION_CACHE_SIZE", 10000)),
+                                           ttl=float(os.environ.get("RECOMMENDATION_CACHE_TTL", 300)))
+
+# Every thread keeps its connections, configured once, for as long as the process runs
+db_pool = ConnectionPool(DB_PATH, configure=instrumentation.trace_queries)
+read_db_pool = ConnectionPool(DB_PATH, read_only=True, configure=instrumentation.trace_queries)
+
+title_search_index = RefreshingTitleSearchIndex(refresh_interval=60)
+
+# Rating writes from every request of this process are group-committed by one background writer
+rating_write_queue = RatingWriteQueue(DB_PATH,
+                                      max_batch_size=int(os.environ.get("RATING_WRITE_BATCH_SIZE", 256)),
+                                      max_delay=float(os.environ.get("RATING_WRITE_DELAY", 0.005)))
+atexit.register(rating_write_queue.close)
+
+# The batch API is disabled unless API_TOKEN is set, clients send it as "Authorization: Bearer <token>"
+API_TOKEN = os.environ.get("API_TOKEN")
+API_MAX_K = 100
+API_BATCH_SIZE = 256
+_api_semaphore = threading.BoundedSemaphore(int(os.environ.get("API_MAX_CONCURRENT_REQUESTS", 2)))
+
+# /metrics and /cache_stats are disabled unless METRICS_TOKEN is set, scrapers send it as "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Set PROFILE_DIR to allow profiling single requests with the "X-Profile: 1" header
+instrumentation.init_app(app, profile_dir=os.environ.get("PROFILE_DIR"), metrics_token=METRICS_TOKEN)
+
+def _recommendation_cache_metrics():
+    stats = recommendation_cache.stats()
+    return [('recommendation_cache_hits_total', 'counter', 'Recommendation cache hits in this process.', stats['hits']),
+            ('recommendation_cache_misses_total', 'counter', 'Recommendation cache misses in this process.', stats['misses']),
+            ('recommendation_cache_evictions_total', 'counter', 'Recommendation cache evictions in this process.', stats['evictions']),
+            ('recommendation_cache_hit_ratio', 'gauge', 'Share of recommendation cache lookups that were hits.', stats['hit_ratio']),
+            ('recommendation_cache_size', 'gauge', 'Number of cached users.', stats['size'])]
+
+instrumentation.metrics.add_collector(_recommendation_cache_metrics)
+
+def _rating_write_queue_metrics():
+    stats = rating_write_queue.stats()
+    return [('rating_write_batches_total', 'counter', 'Transactions committed by the rating writer.', stats['batches']),
+            ('rating_writes_total', 'counter', 'Rating writes committed by the rating writer.', stats['writes']),
+            ('rating_writes_failed_total', 'counter', 'Rating writes that failed.', stats['failed']),
+            ('rating_write_queue_depth', 'gauge', 'Rating writes waiting for the writer.', stats['queued'])]
+
+instrumentation.metrics.add_collector(_rating_write_queue_metrics)
+
+def _connection_pool_metrics():
+    metrics = []
+    for mode, pool in (('read_write', db_pool), ('read_only', read_db_pool)):
+        stats = pool.stats()
+        metrics += [(f'db_{mode}_connections_opened_total', 'counter', f'SQLite {mode} connections opened by this process.', stats['opened']),
+                    (f'db_{mode}_connections', 'gauge', f'Open SQLite {mode} connections of this process.', stats['connections'])]
+    return metrics
+
+instrumentation.metrics.add_collector(_connection_pool_metrics)
 
+def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(db_path)
-        g.db.row_factory = sqlite3.Row
+        g.db = db_pool.connection()
     return g.db
 
+def get_read_db():
+    # Read-only connection for the routes that never write
+    if "read_db" not in g:
+        g.read_db = read_db_pool.connection()
+    return g.read_db
+
+def get_model_artifact(wait=True):
+    # The artifact is loaded once per process and shared by every request
+    global _model_artifact
+    if _model_artifact is None and not wait and not os.path.exists(MODEL_ARTIFACT_PATH):
+        # Building takes a while, so it runs in the background and the caller falls back to popular movies
+        _start_model_artifact_build()
+        return _model_artifact
+    if _model_artifact is None:
+        with _model_artifact_lock:
+            if _model_artifact is None:
+                import recommender.artifact as artifact
+                import recommender.snapshot as snapshot
+                from recommender.journal import file_lock
+                if not os.path.exists(MODEL_ARTIFACT_PATH):
+                    # No artifact has been built yet, so build one from the database once. The lock makes the
+                    # other workers wait for it and load it below, instead of each building their own.
+                    with file_lock(MODEL_ARTIFACT_PATH + '.lock', exclusive=True):
+                        if not os.path.exists(MODEL_ARTIFACT_PATH):
+                            df_movies, _, _ = snapshot.load_clean_data_from_db(DB_PATH, DATASET_CACHE_DIR)
+                            with timer('build_model_artifact'):
+                                _model_artifact = artifact.build_artifact(df_movies=df_movies)
+                            artifact.save_artifact(_model_artifact, MODEL_ARTIFACT_PATH)
+                if _model_artifact is None:
+                    with timer('load_model_artifact'):
+                        _model_artifact = artifact.load_artifact(MODEL_ARTIFACT_PATH)
+                # Set RETRIEVAL_BACKEND (exact, lsh or ivf) to serve recommendations from a retrieval index
+                if os.environ.get("RETRIEVAL_BACKEND"):
+                    _model_artifact.build_retrieval_index(backend=os.environ["RETRIEVAL_BACKEND"])
+    return _model_artifact
+
+def _start_model_artifact_build():
+    global _model_artifact_build_thread
+    with _model_artifact_build_lock:
+        if _model_artifact_build_thread is None or not _model_artifact_build_thread.is_alive():
+            _model_artifact_build_thread = threading.Thread(target=_build_model_artifact, daemon=True)
+            _model_artifact_build_thread.start()
+
+def _build_model_artifact():
+    try:
+        get_model_artifact()
+    except Exception:
+        app.logger.exception("Building the model artifact failed")
+
+def get_profile_store():
+    # User profiles are kept up to date incrementally as ratings are added and deleted
+    global _profile_store
+    if _profile_store is None:
+        with _profile_store_lock:
+            if _profile_store is None:
+                import recommender.snapshot as snapshot
+                from recommender.profile_store import ProfileStore
+                model_artifact = get_model_artifact()
+                store = ProfileStore(model_artifact.genre_matrix, model_artifact.movie_ids, model_artifact.genres,
+                                     journal_path=PROFILE_JOURNAL_PATH)
+                try:
+                    store.load(PROFILE_STORE_PATH)
+                    # Writes that never reached the journal, e.g. a fresh ingestion, leave the store behind the database
+                    if store.data_version != snapshot.database_version(DB_PATH):
+                        raise ValueError("Profile store is stale.")
+                except (FileNotFoundError, ValueError):
+                    # The journal position is taken first, so ratings written while the table is read aren't lost
+                    store.journal_position()
+                    _, df_ratings, _, data_version = snapshot.load_versioned_data_from_db(DB_PATH, DATASET_CACHE_DIR)
+                    with timer('rebuild_profile_store'):
+                        store.rebuild(df_ratings, data_version=data_version)
+                    store.compact(PROFILE_STORE_PATH)
+                _profile_store = store
+    return _profile_store
+
+def _compact_journals():
+    # Runs off the writer thread, so rating writes don't wait for the snapshots to be written
+    if not _compaction_lock.acquire(blocking=False):
+        return
+    try:
+        for name, state, path in (('profile_store', _profile_store, PROFILE_STORE_PATH),
+                                  ('popularity_index', _popularity_index, POPULARITY_INDEX_PATH)):
+            if state is None:
+                continue
+            try:
+                with timer(f'compact_{name}'):
+                    state.compact(path, min_journal_size=JOURNAL_COMPACT_BYTES)
+            except Exception:
+                app.logger.exception("Compacting the %s journal failed", name)
+    finally:
+        _compaction_lock.release()
+
+def get_popularity_index(wait=True):
+    # Popular movies don't depend on the model artifact, so they can be served before it is ready
+    global _popularity_index
+    if _popularity_index is None:
+        # A request doesn't wait for another thread to load the index, it goes without popular movies meanwhile
+        if not _popularity_index_lock.acquire(blocking=wait):
+            return None
+        try:
+            if _popularity_index is None:
+                index = _load_popularity_index()
+                if index is None and not wait:
+                    # Rebuilding reads the whole ratings table, so it runs in the background
+                    _start_popularity_index_build()
+                    return None
+                _popularity_index = index if index is not None else _rebuild_popularity_index()
+        finally:
+            _popularity_index_lock.release()
+    return _popularity_index
+
+def _load_popularity_index():
+    # The saved index holds its own movies and genres, so neither the dataset nor the ratings are read
+    import recommender.popularity as popularity
+    import recommender.snapshot as snapshot
+    try:
+        with timer('load_popularity_index'):
+            index = popularity.load_popularity_index(POPULARITY_INDEX_PATH, journal_path=POPULARITY_JOURNAL_PATH)
+    except (FileNotFoundError, ValueError):
+        return None
+    # Writes that never reached the journal, e.g. a fresh ingestion, leave the index behind the database
+    if index.data_version != snapshot.database_version(DB_PATH):
+        return None
+    return index
+
+def _rebuild_popularity_index():
+    import recommender.popularity as popularity
+    import recommender.snapshot as snapshot
+    from recommender.journal import Journal
+    journal = Journal(POPULARITY_JOURNAL_PATH)
+    # The journal position is taken first, so ratings written while the table is read aren't lost
+    journal.seek_end()
+    df_movies, df_ratings, genre_encoding, data_version = snapshot.load_versioned_data_from_db(DB_PATH, DATASET_CACHE_DIR)
+    with timer('rebuild_popularity_index'):
+        index = popularity.build_popularity_index(df_movies, df_ratings, genre_encoding,
+                                                  data_version=data_version, journal=journal)
+    index.compact(POPULARITY_INDEX_PATH)
+    return index
+
+def _start_popularity_index_build():
+    global _popularity_index_build_thread
+    with _popularity_index_build_lock:
+        if _popularity_index_build_thread is None or not _popularity_index_build_thread.is_alive():
+            _popularity_index_build_thread = threading.Thread(target=_build_popularity_index, daemon=True)
+            _popularity_index_build_thread.start()
+
+def _build_popularity_index():
+    try:
+        get_popularity_index()
+    except Exception:
+        app.logger.exception("Building the popularity index failed")
+
+def get_popular_titles(num_movies=10):
+    # Recent favourites are shown when there are enough of them, the all-time ones otherwise. None are
+    # shown while the index is rebuilt in the background.
+    popularity_index = get_popularity_index(wait=False)
+    if popularity_index is None:
+        return []
+    popular = popularity_index.top(num_movies, window='recent')
+    if len(popular) < num_movies:
+        popular = popularity_index.top(num_movies, window='all')
+    return popular['title'].tolist()
+
 @app.teardown_appcontext
 def close_db(exception):
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
+    read_db = g.pop("read_db", None)
+    if read_db is not None:
+        read_db_pool.release(read_db)
 
 def user_has_ratings(user_id):
-    db = get_db()
+    db = get_read_db()
     cur = db.execute("""
         SELECT EXISTS(
             SELECT 1 FROM ratings WHERE userId = ?
@@ -64,58 +325,41 @@ def get_movie_id_from_title(title):
     
     return selected_movieId[0]
 
-def get_movie_title_from_id(movieId):
-    conn = get_db()
-    cur = conn.cursor()
-
-    selected_movie_title = cur.execute(
-        "SELECT title FROM movies WHERE movieId = ?",
-        (movieId,)
-    ).fetchone()
-
-    if selected_movie_title is None:
-        return "Movie Title not found", 404
-    
-    return selected_movie_title[0]
-
-def get_user_ratings():
-    conn = get_db()
-    cur = conn.cursor()
-
-    userId = session["user_id"]
-
-    cur.execute(
-        "SELECT movieId, rating, timestamp FROM ratings WHERE userId = ? ORDER BY timestamp DESC",
-        (userId,)
-    )
-
-    user_ratings = cur.fetchall()
-
-    return user_ratings
-
-
+def apply_rating_changes(changes):
+    # Called by the rating writer after every committed batch, so in-memory state follows the database.
+    # This runs on the writer thread, so nothing is loaded or built here: a profile store or popularity index
+    # that isn't ready only gets the changes journaled, and replays them when it is loaded.
+    profile_store = _profile_store
+    if profile_store is not None:
+        profile_store.apply_rating_changes(changes)
+    else:
+        from recommender.profile_store import journal_rating_changes
+        journal_rating_changes(PROFILE_JOURNAL_PATH, changes)
+
+    popularity_index = _popularity_index
+    if popularity_index is not None:
+        popularity_index.apply_rating_changes(changes)
+    else:
+        import recommender.popularity as popularity
+        popularity.journal_rating_changes(POPULARITY_JOURNAL_PATH, changes)
+
+    for user_id in {change.user_id for change in changes}:
+        recommendation_cache.invalidate(user_id)
+
+    journaled = [state for state in (profile_store, popularity_index) if state is not None]
+    if any(state.journal_size() >= JOURNAL_COMPACT_BYTES for state in journaled) and not _compaction_lock.locked():
+        threading.Thread(target=_compact_journals, daemon=True).start()
+
+rating_write_queue.add_listener(apply_rating_changes)
+
+@instrumentation.timed('add_rating')
 def add_user_rating(user_id, movieId, rating, unix_timestamp):
-    rating = float(rating)
-
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        "INSERT INTO ratings (userId, movieId, rating, timestamp) VALUES (?, ?, ?, ?)",
-        (user_id, movieId, rating, unix_timestamp)
-    )
-    conn.commit()
+    # Rating a movie again updates the existing rating. Returns once the rating is committed and applied.
+    return rating_write_queue.upsert(user_id, movieId, rating, unix_timestamp).result()
 
+@instrumentation.timed('delete_rating')
 def delete_user_rating(user_id, movieId):
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        "DELETE FROM ratings WHERE userId = ? AND movieId = ?",
-        (user_id, movieId)
-    )
-
-    conn.commit()
+    return rating_write_queue.delete(user_id, movieId).result()
 
 # -=| Routes |=- #
 @app.route('/')
@@ -157,7 +401,17 @@ def login():
             SELECT * FROM users WHERE username = ?
         """, (username,)).fetchone()
 
-        if user and check_password_hash(user["password_hash"], password):
+        if user and user["password_hash"] is None:
+            # Dataset accounts are seeded without a hash, it is computed on their first login
+            valid = bool(user["is_dataset_user"]) and password == username
+            if valid:
+                db.execute("UPDATE users SET password_hash = ? WHERE user_id = ?",
+                           (generate_password_hash(password), user["user_id"]))
+                db.commit()
+        else:
+            valid = user is not None and check_password_hash(user["password_hash"], password)
+
+        if valid:
             session.clear()
             session["user_id"] = user["user_id"]
             session["username"] = username
@@ -196,38 +450,51 @@ def recommendations():
             return redirect(url_for("recommendations"))
 
     recommendations = None
-    popular_movies = None
+    with timer('popular'):
+        popular_movies = get_popular_titles(num_movies=10)
 
     user_id = session["user_id"]
     if user_has_ratings(user_id) == 0:
         return render_template('recommendations.html', 
                                recommendations=recommendations, 
+                               popular_movies=popular_movies,
                                username=session["username"]
                             )
 
-    db = get_db()
-
-    df_movies = pd.read_sql_query("SELECT * FROM movies", db)
-    df_ratings = pd.read_sql_query("SELECT * FROM ratings", db)
-
-    df_genres = pp.encode_genres(df_movies=df_movies)
-    user_profiles = model.create_user_profiles(df_ratings=df_ratings, df_movies=df_movies, df_genres=df_genres)
-    df_user_movie_similarities = model.compute_similarity_matrix(user_profiles=user_profiles, df_genres=df_genres)
-
-    
     try:
         user_id = int(user_id)
     except (ValueError, TypeError):
         print("Something went wrong. Invalid user_id.")
 
-    recommendations = model.recommend_movies(user_id=user_id, 
-                                                df_user_movie_similarities=df_user_movie_similarities, 
-                                                df_ratings=df_ratings,
-                                                df_movies=df_movies,
-                                                num_recommendations=10)
-    recommendations = recommendations['title'].tolist()
-
-    return render_template('recommendations.html', recommendations=recommendations, popular_movies=popular_movies, username=session["username"])
+    with timer('cache_lookup'):
+        recommendations, cache_version = recommendation_cache.get(user_id)
+    if recommendations is None:
+        # Only the logged-in user is scored, against the shared model artifact
+        db = get_read_db()
+        with timer('rated_movies_query'):
+            rated_movie_ids = [row["movieId"] for row in db.execute(
+                "SELECT movieId FROM ratings WHERE userId = ?",
+                (user_id,)
+            ).fetchall()]
+
+        model_artifact = get_model_artifact(wait=False)
+        if model_artifact is None:
+            # Until the artifact is built the user gets the popular movies they haven't rated, uncached
+            with timer('popular_fallback'):
+                popularity_index = get_popularity_index(wait=False)
+                recommendations = [] if popularity_index is None else popularity_index.top(10, exclude_ids=rated_movie_ids)['title'].tolist()
+        else:
+            with timer('profile'):
+                profile = get_profile_store().profile(user_id)
+            with timer('score'):
+                recommendations = model_artifact.recommend_for_profile(profile,
+                                                                       exclude_ids=rated_movie_ids,
+                                                                       num_recommendations=10)
+            recommendations = recommendations['title'].tolist()
+            recommendation_cache.set(user_id, recommendations, cache_version)
+
+    with timer('render'):
+        return render_template('recommendations.html', recommendations=recommendations, popular_movies=popular_movies, username=session["username"])
 
 @app.route("/manage_ratings", methods=["GET", "POST"])
 @login_required
@@ -236,13 +503,15 @@ def manage_ratings():
         # Add new rating
         pass
     
-    user_ratings = []
-    raw_user_ratings = get_user_ratings()
-    for movieId, rating, timestamp in raw_user_ratings:
-        movie_title = get_movie_title_from_id(movieId)
-        user_ratings.append((movie_title, rating))
+    cursor = request.args.get("cursor")
+    rows, next_cursor = ratings_db.get_user_ratings_page(get_read_db(), session["user_id"], cursor=cursor)
+    user_ratings = [(title, rating) for title, rating, timestamp, movieId in rows]
 
-    return render_template('manage_ratings.html', user_ratings=user_ratings, username=session["username"])
+    return render_template('manage_ratings.html', 
+                           user_ratings=user_ratings, 
+                           next_cursor=next_cursor, 
+                           is_first_page=cursor is None, 
+                           username=session["username"])
 
 @app.route("/add_rating", methods=["GET", "POST"])
 # @login_required
@@ -271,26 +540,157 @@ def delete_rating():
     return redirect(url_for("manage_ratings"))
 
 
+@app.route("/api/recommendations", methods=["POST"])
+def api_recommendations():
+    # Takes {"user_ids": [...]} as JSON, or one user id (or {"user_id": ...}) per line as application/x-ndjson,
+    # and streams back one {"user_id", "movie_ids", "scores"} line per user
+    if not API_TOKEN:
+        return jsonify(error="The recommendations API is disabled."), 503
+    if not instrumentation.has_bearer_token(API_TOKEN):
+        return jsonify(error="Invalid API token."), 401
+
+    try:
+        k = int(request.args.get("k", 10))
+    except ValueError:
+        return jsonify(error="k must be an integer."), 400
+    if not 1 <= k <= API_MAX_K:
+        return jsonify(error=f"k must be between 1 and {API_MAX_K}."), 400
+
+    if request.mimetype == "application/x-ndjson":
+        user_ids = _read_ndjson_user_ids()
+    else:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get("user_ids"), list):
+            return jsonify(error='Expected a JSON body like {"user_ids": [1, 2, 3]} or an NDJSON body.'), 400
+        user_ids = body["user_ids"]
+
+    # Scoring is CPU-bound, so only a few batch requests run at once and the rest are turned away
+    if not _api_semaphore.acquire(blocking=False):
+        return jsonify(error="Too many concurrent batch requests, retry later."), 429, {"Retry-After": "1"}
+    try:
+        response = Response(stream_with_context(_stream_recommendations(user_ids, k)), mimetype="application/x-ndjson")
+    except Exception:
+        _api_semaphore.release()
+        raise
+    response.call_on_close(_api_semaphore.release)
+    return response
+
+def _read_ndjson_user_ids():
+    for line in request.stream:
+        line = line.strip()
+        if line:
+            value = json.loads(line)
+            yield value["user_id"] if isinstance(value, dict) else value
+
+def _stream_recommendations(user_ids, k):
+    model_artifact = get_model_artifact()
+    profile_store = get_profile_store()
+    db = get_read_db()
+
+    batch = []
+    try:
+        for user_id in user_ids:
+            batch.append(int(user_id))
+            if len(batch) == API_BATCH_SIZE:
+                yield from _score_api_batch(db, model_artifact, profile_store, batch, k)
+                batch = []
+    except (ValueError, TypeError, KeyError) as e:
+        # The status line has already been sent, so a malformed line ends the stream with an error line
+        yield from _score_api_batch(db, model_artifact, profile_store, batch, k)
+        yield json.dumps({"error": f"Invalid user id: {e}"}) + "\n"
+        return
+    yield from _score_api_batch(db, model_artifact, profile_store, batch, k)
+
+def _score_api_batch(db, model_artifact, profile_store, batch, k):
+    if not batch:
+        return
+    import pandas as pd
+    import recommender.model as model
+    user_ids = pd.Index(batch).unique()
+
+    with timer("api_rated_movies_query"):
+        rows = db.execute(
+            "SELECT userId, movieId FROM ratings WHERE userId IN (SELECT value FROM json_each(?))",
+            (json.dumps(user_ids.tolist()),)
+        ).fetchall()
+    df_rated = pd.DataFrame([tuple(row) for row in rows], columns=["userId", "movieId"])
+
+    with timer("api_score"):
+        profiles, has_ratings = profile_store.profile_matrix(user_ids)
+        rated_matrix = model.build_rated_matrix(df_rated, user_ids, model_artifact.movie_index)
+        movie_ids, scores = model_artifact.recommend_for_profiles(profiles, rated_matrix, num_recommendations=k)
+
+    lines = []
+    for user_id, user_has_profile, user_movie_ids, user_scores in zip(user_ids, has_ratings, movie_ids, scores):
+        found = (user_movie_ids >= 0) & user_has_profile
+        lines.append(json.dumps({"user_id": int(user_id),
+                                 "movie_ids": user_movie_ids[found].tolist(),
+                                 "scores": [round(float(score), 6) for score in user_scores[found]]}) + "\n")
+    yield "".join(lines)
+
+@app.route("/popular")
+def popular():
+    # Takes optional genre, window ("all" or "recent") and k query parameters
+    try:
+        k = int(request.args.get("k", 10))
+    except ValueError:
+        return jsonify(error="k must be an integer."), 400
+    if not 1 <= k <= API_MAX_K:
+        return jsonify(error=f"k must be between 1 and {API_MAX_K}."), 400
+
+    popularity_index = get_popularity_index(wait=False)
+    if popularity_index is None:
+        return jsonify(error="Popular movies are still being computed, retry later."), 503, {"Retry-After": "5"}
+    try:
+        movies = popularity_index.top(k, genre=request.args.get("genre"), window=request.args.get("window", "all"))
+    except KeyError as e:
+        return jsonify(error=e.args[0]), 400
+    return jsonify(movies.to_dict(orient="records"))
+
+@app.route("/cache_stats")
+def cache_stats():
+    if not METRICS_TOKEN:
+        return jsonify(error="Cache stats are disabled."), 503
+    if not instrumentation.has_bearer_token(METRICS_TOKEN):
+        return jsonify(error="Invalid metrics token."), 401
+    return jsonify(recommendation_cache.stats())
+
 @app.route("/search")
 def search():
     query = request.args.get("q", "")
     if not query:
         return jsonify([])
     
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT title 
-        FROM movies
-        WHERE title LIKE ? 
-        ORDER BY title
-        LIMIT 10
-    """, (query + "%",))
-
-    results = [row["title"] for row in cur.fetchall()]
+    with timer('title_search'):
+        results = title_search_index.get(get_read_db()).search(query, limit=10)
 
     return jsonify(results)
 
+def migrate_db():
+    # Importing the app never touches the database. The schema is brought up to date once, before any
+    # worker starts: by data_ingestion/migrate_db.py, the gunicorn.conf.py pre-fork hook or app.run below.
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        schema.apply_pragmas(conn)
+        schema.migrate(conn)
+    finally:
+        conn.close()
+
+def warm_up():
+    # Loads the title index, the scientific stack, the model artifact, the profile store and the popular movies
+    # ahead of the first request. gunicorn.conf.py runs this in the master before it forks, so every worker shares them.
+    # A missing artifact isn't built here, the workers build it in the background while serving popular movies.
+    with app.app_context():
+        title_search_index.get(get_read_db())
+    if os.path.exists(MODEL_ARTIFACT_PATH):
+        get_model_artifact()
+        get_profile_store()
+    get_popularity_index()
+    # Request threads open their own connections, and a forked worker must not inherit these
+    db_pool.close_all()
+    read_db_pool.close_all()
 
 if __name__ == '__main__':
+    migrate_db()
+    warm_up()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,264 @@
+import argparse
+import json
+import platform
+import resource
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+import sys, os
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '..'))
+import recommender.preprocessing as pp
+import recommender.model as model
+import recommender.evaluation as eval
+import recommender.item_cf as item_cf
+import database.schema as schema
+from benchmarks.synthetic import make_dataset
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+def measure(func, repeat=1, **kwargs):
+    """
+    Times a pipeline stage and profiles its memory. The first run is traced with tracemalloc, which slows it
+    down, so the reported times come from untraced runs when repeat is greater than one.
+
+    Args:
+        func (callable): The stage to run.
+        repeat (int): Number of times the stage is run.
+        **kwargs: Arguments of func.
+
+    Returns:
+        The result of func.
+        dict: The best and median wall time in seconds, the peak traced allocation of the stage and the
+            peak RSS of the process after the stage, both in MB.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(**kwargs)
+    seconds = [time.perf_counter() - start]
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if repeat > 1:
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(**kwargs)
+            seconds.append(time.perf_counter() - start)
+
+    return result, {'seconds': min(seconds),
+                    'median_seconds': statistics.median(seconds),
+                    'peak_traced_mb': peak_traced / 1024 ** 2,
+                    'peak_rss_mb': _peak_rss_mb()}
+
+def bench_stages(df_movies, df_ratings, repeat=1, include_reference=True):
+    """
+    Benchmarks every stage of the offline pipeline on one dataset.
+
+    Args:
+        df_movies (pd.Dataframe): Movie data, as in movies.csv.
+        df_ratings (pd.Dataframe): Rating data, as in ratings.csv.
+        repeat (int): Number of timed runs per stage.
+        include_reference (bool): Also run the unvectorized create_user_profiles and compute_similarity_matrix,
+            which build every user's profile with groupby().apply and a dense users x movies matrix.
+
+    Returns:
+        dict: The measurements of every stage, keyed by stage name.
+    """
+    results = {}
+
+    df_movies, results['clean_movies'] = measure(pp.clean_movies, repeat, df_movies=df_movies.copy())
+    (df_ratings, df_movies), results['filter_less_active_data'] = measure(pp.filter_less_active_data, repeat, df_ratings=df_ratings, df_movies=df_movies)
+    (df_train, df_test), results['user_rating_train_test_split'] = measure(pp.user_rating_train_test_split, repeat, df_ratings=df_ratings)
+
+    df_genres, results['encode_genres'] = measure(pp.encode_genres, repeat, df_movies=df_movies)
+    genre_encoding, results['encode_genres_sparse'] = measure(pp.encode_genres, repeat, df_movies=df_movies, sparse=True)
+
+    if include_reference:
+        _, results['create_user_profiles'] = measure(model.create_user_profiles, repeat, df_ratings=df_train, df_movies=df_movies, df_genres=df_genres)
+    user_profiles, results['create_user_profiles_sparse'] = measure(model.create_user_profiles_sparse, repeat, df_ratings=df_train, df_movies=df_movies, df_genres=genre_encoding)
+
+    if include_reference:
+        similarities, results['compute_similarity_matrix'] = measure(model.compute_similarity_matrix, repeat, user_profiles=user_profiles, df_genres=genre_encoding)
+        _, results['recommend_movies'] = measure(model.recommend_movies, repeat, user_id=user_profiles.index[0],
+                                                 df_user_movie_similarities=similarities, df_ratings=df_train,
+                                                 df_movies=df_movies, num_recommendations=10)
+        del similarities
+
+    (user_ids, recommendations, movie_ids), results['top_k_movies'] = measure(model.top_k_movies, repeat, user_profiles=user_profiles, df_genres=genre_encoding, df_ratings=df_train, num_recommendations=10)
+    ground_truth = eval.ground_truth_matrix(df_test, user_ids, movie_ids)
+    _, results['evaluate'] = measure(eval.evaluate, repeat, recommendations=recommendations, ground_truth=ground_truth, ks=(5, 10))
+
+    neighbours, results['compute_item_neighbours'] = measure(item_cf.compute_item_neighbours, repeat, df_ratings=df_train, movie_ids=movie_ids)
+    _, results['item_cf_top_k_movies'] = measure(item_cf.top_k_movies, repeat, neighbours=neighbours, df_ratings=df_train, num_recommendations=10)
+
+    return results
+
+def _write_database(db_path, df_movies, df_ratings):
+    conn = sqlite3.connect(db_path)
+    try:
+        schema.apply_pragmas(conn)
+        schema.create_schema(conn)
+        columns = ['movieId', 'title', 'genres', 'year', 'normalized_year']
+        conn.executemany("INSERT INTO movies (movieId, title, genres, year, normalized_year) VALUES (?, ?, ?, ?, ?)",
+                         df_movies[columns].astype(object).where(df_movies[columns].notna(), None).itertuples(index=False, name=None))
+        conn.executemany("INSERT INTO ratings (userId, movieId, rating, timestamp) VALUES (?, ?, ?, ?)",
+                         df_ratings[['userId', 'movieId', 'rating', 'timestamp']].astype(object).itertuples(index=False, name=None))
+        conn.executemany("INSERT INTO users (user_id, username, password_hash, is_dataset_user) VALUES (?, ?, NULL, 1)",
+                         ((int(user_id), f"user{user_id}") for user_id in df_ratings['userId'].unique()))
+        conn.commit()
+    finally:
+        conn.close()
+
+def bench_app(df_movies, df_ratings, num_requests=50):
+    """
+    Benchmarks the end-to-end /recommendations request through Flask's test client, against a temporary
+    database and artifact directory filled with the given dataset. The model artifact, profile store and
+    popularity index are built before the requests are timed, so they measure the recommender rather than
+    the popular movies it falls back to while those are built in the background.
+
+    Args:
+        df_movies (pd.Dataframe): Movie data, as in movies.csv.
+        df_ratings (pd.Dataframe): Rating data, as in ratings.csv.
+        num_requests (int): Number of timed requests for each of the cache miss and cache hit cases.
+
+    Returns:
+        dict: The measurements of app startup, the artifact builds, the first request and the steady-state requests.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='bench_app_')
+    os.environ['MOVIES_DB_PATH'] = os.path.join(tmp_dir, 'movies.db')
+    os.environ['ARTIFACTS_DIR'] = os.path.join(tmp_dir, 'artifacts')
+    os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+    results = {}
+    try:
+        _write_database(os.environ['MOVIES_DB_PATH'], pp.clean_movies(df_movies.copy()), df_ratings)
+        app_module, results['app_import'] = measure(__import__, name='app')
+        _, results['app_build_artifacts'] = measure(_build_app_artifacts, app_module=app_module)
+        client = app_module.app.test_client()
+
+        user_ids = df_ratings['userId'].value_counts().index[:num_requests].tolist()
+        _, results['recommendations_first_request'] = measure(_get_recommendations, client=client, app_module=app_module, user_id=user_ids[0])
+
+        latencies = {'miss': [], 'hit': []}
+        for user_id in user_ids:
+            for case in ('miss', 'hit'):
+                start = time.perf_counter()
+                _get_recommendations(client, app_module, user_id, invalidate=(case == 'miss'))
+                latencies[case].append(time.perf_counter() - start)
+
+        for case, seconds in latencies.items():
+            results[f'recommendations_request_{case}'] = {'seconds': statistics.median(seconds),
+                                                           'p95_seconds': float(np.percentile(seconds, 95)),
+                                                           'peak_rss_mb': _peak_rss_mb()}
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+def _build_app_artifacts(app_module):
+    app_module.get_model_artifact()
+    app_module.get_profile_store()
+    app_module.get_popularity_index()
+
+def _get_recommendations(client, app_module, user_id, invalidate=False):
+    with client.session_transaction() as session:
+        session['user_id'] = int(user_id)
+        session['username'] = f"user{user_id}"
+    if invalidate:
+        app_module.recommendation_cache.invalidate(int(user_id))
+    response = client.get('/recommendations')
+    if response.status_code != 200:
+        raise RuntimeError(f"/recommendations returned {response.status_code} for user {user_id}")
+    # Only the model's recommendations are cached, the popular movies fallback isn't
+    if app_module.recommendation_cache.get(int(user_id))[0] is None:
+        raise RuntimeError(f"/recommendations served the popular movies fallback to user {user_id}")
+    return response
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares the stage times of a run against a baseline run.
+
+    Args:
+        results (dict): The current run, as written by this script.
+        baseline (dict): The baseline run, as written by this script.
+        tolerance (float): Relative slowdown that still counts as noise.
+
+    Returns:
+        list: The names of the stages that got slower than the tolerance allows.
+    """
+    regressions = []
+    print(f"{'stage':36} {'baseline':>10} {'current':>10} {'change':>8}")
+    for stage, current in results['stages'].items():
+        previous = baseline['stages'].get(stage)
+        if previous is None:
+            print(f"{stage:36} {'-':>10} {current['seconds']:10.4f} {'new':>8}")
+            continue
+        change = current['seconds'] / previous['seconds'] - 1 if previous['seconds'] else 0.0
+        flag = ''
+        if change > tolerance:
+            regressions.append(stage)
+            flag = '  REGRESSION'
+        print(f"{stage:36} {previous['seconds']:10.4f} {current['seconds']:10.4f} {change:+8.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation pipeline on synthetic MovieLens-shaped data.")
+    parser.add_argument('--users', type=int, default=610, help="Number of users.")
+    parser.add_argument('--movies', type=int, default=9700, help="Number of movies.")
+    parser.add_argument('--ratings', type=int, default=100000, help="Target number of ratings.")
+    parser.add_argument('--genres', type=int, default=19, help="Size of the genre vocabulary.")
+    parser.add_argument('--seed', type=int, default=24, help="Seed of the data generator.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of timed runs per stage.")
+    parser.add_argument('--requests', type=int, default=50, help="Number of timed /recommendations requests per case.")
+    parser.add_argument('--skip-reference', action='store_true',
+                        help="Skip create_user_profiles, compute_similarity_matrix and recommend_movies, which don't scale.")
+    parser.add_argument('--skip-app', action='store_true', help="Skip the end-to-end Flask benchmark.")
+    parser.add_argument('--output', help="Write the results to this JSON file.")
+    parser.add_argument('--baseline', help="Compare against the results in this JSON file and exit with 1 on a regression.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Relative slowdown that still counts as noise.")
+    args = parser.parse_args()
+
+    config = {'num_users': args.users, 'num_movies': args.movies, 'num_ratings': args.ratings,
+              'num_genres': args.genres, 'seed': args.seed}
+    df_movies, df_ratings = make_dataset(**config)
+
+    stages = bench_stages(df_movies, df_ratings, repeat=args.repeat, include_reference=not args.skip_reference)
+    if not args.skip_app:
+        stages.update(bench_app(df_movies, df_ratings, num_requests=args.requests))
+
+    results = {'config': {**config, 'num_generated_ratings': len(df_ratings)},
+               'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                               'pandas': pd.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count()},
+               'created_at': time.time(),
+               'stages': stages}
+
+    for stage, measurements in stages.items():
+        details = ', '.join(f"{key}={value:.4f}" for key, value in measurements.items() if key != 'seconds')
+        print(f"{stage:36} {measurements['seconds']:10.4f}s  ({details})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['config'] != results['config']:
+            print("Warning: the baseline was run on a different dataset configuration.")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
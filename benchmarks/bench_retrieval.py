@@ -0,0 +1,88 @@
+import time
+import sys, os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '..'))
+import recommender.preprocessing as pp
+import recommender.retrieval as retrieval
+from benchmarks.synthetic import make_dataset
+
+CONFIGS = [
+    ('exact', {}),
+    ('lsh', dict(num_tables=4, num_bits=12, probe_radius=0)),
+    ('lsh', dict(num_tables=8, num_bits=12, probe_radius=1)),
+    ('lsh', dict(num_tables=16, num_bits=10, probe_radius=1)),
+    ('ivf', dict(num_probes=2)),
+    ('ivf', dict(num_probes=8)),
+    ('ivf', dict(num_probes=32)),
+]
+
+def recall_against_exact(approximate, exact):
+    """
+    Fraction of the exact top-k that the approximate top-k recovers. Many movies share a score (e.g. the same
+    genres), so a result counts as recovered if its score reaches the exact k-th score rather than by movieId.
+    """
+    if len(exact) == 0:
+        return 1.0
+    threshold = exact['score'].min() - 1e-6
+    return min((approximate['score'] >= threshold).sum(), len(exact)) / len(exact)
+
+def make_features(num_movies, embedding_dim, seed=24):
+    """
+    Movie features made of the multi-hot genres and the normalized year, plus an optional random
+    embedding that stands in for richer features such as tags.
+    """
+    df_movies, df_ratings = make_dataset(num_users=2000, num_movies=num_movies, num_ratings=40 * 2000, seed=seed)
+    df_movies = pp.clean_movies(df_movies)
+    genre_encoding = pp.encode_genres(df_movies, sparse=True)
+    features = np.hstack([genre_encoding.matrix.toarray(), df_movies[['normalized_year']].to_numpy()]).astype(np.float32)
+
+    if embedding_dim:
+        rng = np.random.default_rng(seed)
+        clusters = rng.standard_normal((64, embedding_dim))
+        embeddings = clusters[rng.integers(0, 64, len(features))] + 0.5 * rng.standard_normal((len(features), embedding_dim))
+        features = np.hstack([features, embeddings.astype(np.float32)])
+
+    # Queries are rating-weighted averages of the rated movies' features, like user profiles
+    movie_rows = genre_encoding.movie_index.get_indexer(df_ratings['movieId'])
+    df_ratings = df_ratings[movie_rows >= 0]
+    movie_rows = movie_rows[movie_rows >= 0]
+    user_rows, _ = pd.factorize(df_ratings['userId'], sort=True)
+    rating_matrix = sparse.csr_matrix((df_ratings['rating'].to_numpy(dtype=np.float32), (user_rows, movie_rows)),
+                                      shape=(user_rows.max() + 1, len(features)))
+    queries = rating_matrix @ features
+
+    rated = df_ratings.groupby('userId')['movieId'].apply(np.asarray).tolist()
+    return features, genre_encoding.movie_index, queries, rated
+
+def bench_retrieval(num_movies=60000, embedding_dim=32, num_queries=500, k=10):
+    features, movie_ids, queries, rated = make_features(num_movies, embedding_dim)
+    queries, rated = queries[:num_queries], rated[:num_queries]
+    print(f"{num_movies} movies, {features.shape[1]} features, {len(queries)} queries, k={k}")
+
+    exact_index = retrieval.build_index(features, movie_ids, backend='exact')
+    exact_results = [exact_index.search(query, k=k, exclude_ids=exclude) for query, exclude in zip(queries, rated)]
+
+    for backend, params in CONFIGS:
+        start = time.perf_counter()
+        index = retrieval.build_index(features, movie_ids, backend=backend, **params)
+        build_seconds = time.perf_counter() - start
+
+        latencies, recalls = [], []
+        for query, exclude, exact in zip(queries, rated, exact_results):
+            start = time.perf_counter()
+            result = index.search(query, k=k, exclude_ids=exclude)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(recall_against_exact(result, exact))
+
+        latencies = np.array(latencies) * 1000
+        label = backend + ''.join(f' {name}={value}' for name, value in params.items())
+        print(f"    {label:<45} recall@{k} {np.mean(recalls):.3f}   "
+              f"p50 {np.percentile(latencies, 50):7.3f}ms   p99 {np.percentile(latencies, 99):7.3f}ms   build {build_seconds:6.2f}s")
+
+if __name__ == "__main__":
+    bench_retrieval()
@@ -0,0 +1,35 @@
+import time
+import sys, os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '..'))
+import recommender.preprocessing as pp
+import recommender.model as model
+from benchmarks.synthetic import make_dataset
+
+SCALES = {
+    'movielens-small': dict(num_users=610, num_movies=9700, num_ratings=100000),
+    'movielens-small-10x': dict(num_users=6100, num_movies=97000, num_ratings=1000000),
+}
+
+def time_call(func, **kwargs):
+    start = time.perf_counter()
+    result = func(**kwargs)
+    return result, time.perf_counter() - start
+
+def bench_user_profiles():
+    for name, scale in SCALES.items():
+        df_movies, df_ratings = make_dataset(**scale)
+        df_movies = pp.clean_movies(df_movies)
+        df_genres = pp.encode_genres(df_movies=df_movies)
+
+        # This only times the two, tests/test_model.py checks that their results match
+        profiles, apply_seconds = time_call(model.create_user_profiles, df_ratings=df_ratings, df_movies=df_movies, df_genres=df_genres)
+        _, sparse_seconds = time_call(model.create_user_profiles_sparse, df_ratings=df_ratings, df_movies=df_movies, df_genres=df_genres)
+
+        print(f"{name}: {len(df_ratings)} ratings, {len(profiles)} users")
+        print(f"    create_user_profiles:        {apply_seconds:8.3f}s")
+        print(f"    create_user_profiles_sparse: {sparse_seconds:8.3f}s ({apply_seconds / sparse_seconds:.1f}x faster)")
+
+if __name__ == "__main__":
+    bench_user_profiles()
@@ -0,0 +1,120 @@
+import argparse
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import sys, os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BASE_DIR, '..')
+
+def parse_importtime(output):
+    """
+    Parses the report that python -X importtime writes to stderr.
+
+    Args:
+        output (str): The stderr of the interpreter.
+
+    Returns:
+        list: (module, depth, cumulative seconds) tuples in report order, where a module's nested imports
+            come right before it with a depth one greater.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, total, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(total) / 1e6))
+    return imports
+
+def direct_imports(imports, module):
+    """
+    Returns the modules that a module imports itself, along with their cumulative import times.
+
+    Args:
+        imports (list): The output of parse_importtime.
+        module (str): A top-level module of the report.
+
+    Returns:
+        list: (module, cumulative seconds) tuples, slowest first.
+    """
+    end = next(i for i, (name, depth, _) in enumerate(imports) if name == module and depth == 0)
+    start = end
+    while start > 0 and imports[start - 1][1] > 0:
+        start -= 1
+    children = [(name, seconds) for name, depth, seconds in imports[start:end] if depth == 1]
+    return sorted(children, key=lambda item: -item[1])
+
+def measure_import(module, env):
+    """
+    Imports a module in a fresh interpreter under python -X importtime.
+
+    Args:
+        module (str): The module to import.
+        env (dict): Environment of the interpreter.
+
+    Returns:
+        float: Wall time in seconds of the whole interpreter run, including its own startup.
+        list: The parsed importtime report, see parse_importtime.
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            cwd=REPO_DIR, env=env, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return seconds, parse_importtime(result.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that importing the web app stays within a startup-time budget.")
+    parser.add_argument('--module', default='app', help="Module to import.")
+    parser.add_argument('--budget', type=float, default=0.5, help="Maximum median import time of the module in seconds.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of fresh interpreters to measure.")
+    parser.add_argument('--forbid', default='pandas,scipy,sklearn',
+                        help="Comma-separated modules that must not be imported at startup.")
+    parser.add_argument('--db', default=os.path.join(REPO_DIR, 'db', 'movies.db'),
+                        help="Database the app starts against. An empty one is used if it doesn't exist.")
+    parser.add_argument('--top', type=int, default=10, help="Number of slowest top-level imports to list.")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='startup_budget_')
+    env = dict(os.environ)
+    env.setdefault('FLASK_SECRET_KEY', 'startup-budget')
+    env['ARTIFACTS_DIR'] = os.path.join(tmp_dir, 'artifacts')
+    env['MOVIES_DB_PATH'] = os.path.join(tmp_dir, 'movies.db')
+    try:
+        if os.path.exists(args.db):
+            shutil.copy(args.db, env['MOVIES_DB_PATH'])
+
+        runs = [measure_import(args.module, env) for _ in range(args.repeat)]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    cumulative = lambda imports: next(seconds for name, depth, seconds in imports if name == args.module and depth == 0)
+    import_seconds = statistics.median(cumulative(imports) for _, imports in runs)
+    wall_seconds = statistics.median(seconds for seconds, _ in runs)
+    imports = runs[-1][1]
+
+    print(f"Slowest imports of {args.module}:")
+    for name, seconds in direct_imports(imports, args.module)[:args.top]:
+        print(f"  {name:40} {seconds * 1000:8.1f} ms")
+    print(f"import {args.module}: {import_seconds * 1000:.1f} ms (budget {args.budget * 1000:.0f} ms), "
+          f"interpreter run: {wall_seconds * 1000:.1f} ms")
+
+    failed = False
+    imported = {name for name, _, _ in imports}
+    forbidden = [name for name in args.forbid.split(',') if name and name in imported]
+    if forbidden:
+        print(f"Imported at startup but should be lazy: {', '.join(forbidden)}")
+        failed = True
+    if import_seconds > args.budget:
+        print(f"Over budget by {(import_seconds - args.budget) * 1000:.1f} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("Within budget.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+MOVIELENS_GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime', 'Documentary', 'Drama',
+                    'Fantasy', 'Film-Noir', 'Horror', 'IMAX', 'Musical', 'Mystery', 'Romance', 'Sci-Fi',
+                    'Thriller', 'War', 'Western']
+
+def make_movies(num_movies, num_genres=len(MOVIELENS_GENRES), max_genres_per_movie=4, rng=None):
+    """
+    Generates a movies dataframe with the same columns as MovieLens' movies.csv.
+
+    Args:
+        num_movies (int): Number of movies to generate.
+        num_genres (int): Size of the genre vocabulary. The MovieLens genres are used first.
+        max_genres_per_movie (int): Upper bound on the number of genres per movie.
+        rng (np.random.Generator): Random number generator.
+
+    Returns:
+        pd.Dataframe: Movie data with movieId, title and genres columns.
+    """
+    rng = rng if rng is not None else np.random.default_rng(24)
+    genres = MOVIELENS_GENRES[:num_genres] + [f'Genre{i}' for i in range(len(MOVIELENS_GENRES), num_genres)]
+
+    movie_ids = np.arange(1, num_movies + 1)
+    years = rng.integers(1920, 2024, size=num_movies)
+    genre_counts = rng.integers(1, min(max_genres_per_movie, num_genres) + 1, size=num_movies)
+    movie_genres = ['|'.join(rng.choice(genres, size=count, replace=False)) for count in genre_counts]
+
+    return pd.DataFrame({'movieId': movie_ids,
+                         'title': [f'Synthetic Movie {movie_id} ({year})' for movie_id, year in zip(movie_ids, years)],
+                         'genres': movie_genres})
+
+def make_ratings(num_users, num_movies, num_ratings, rng=None):
+    """
+    Generates a ratings dataframe with the same columns as MovieLens' ratings.csv. Movie popularity follows a
+    long-tailed (Zipf-like) distribution, as it does in MovieLens.
+
+    Args:
+        num_users (int): Number of users.
+        num_movies (int): Number of movies.
+        num_ratings (int): Target number of ratings. Duplicate (userId, movieId) pairs are dropped.
+        rng (np.random.Generator): Random number generator.
+
+    Returns:
+        pd.Dataframe: Rating data with userId, movieId, rating and timestamp columns.
+    """
+    rng = rng if rng is not None else np.random.default_rng(24)
+
+    popularity = 1 / np.arange(1, num_movies + 1) ** 0.8
+    popularity = rng.permutation(popularity / popularity.sum())
+
+    df_ratings = pd.DataFrame({'userId': rng.integers(1, num_users + 1, size=num_ratings),
+                               'movieId': rng.choice(np.arange(1, num_movies + 1), size=num_ratings, p=popularity)})
+    df_ratings = df_ratings.drop_duplicates(['userId', 'movieId']).reset_index(drop=True)
+    df_ratings['rating'] = rng.integers(1, 11, size=len(df_ratings)) / 2
+    df_ratings['timestamp'] = rng.integers(828124615, 1700000000, size=len(df_ratings))
+    return df_ratings
+
+def make_dataset(num_users=610, num_movies=9700, num_ratings=100000, num_genres=len(MOVIELENS_GENRES), seed=24):
+    """
+    Generates a MovieLens-shaped dataset. The defaults match the size of MovieLens Latest Small, and every
+    dimension can be scaled independently.
+
+    Args:
+        num_users (int): Number of users.
+        num_movies (int): Number of movies.
+        num_ratings (int): Target number of ratings.
+        num_genres (int): Size of the genre vocabulary.
+        seed (int): Acts as a seed for the pseudo-random number generator.
+
+    Returns:
+        pd.Dataframe: Movie data.
+        pd.Dataframe: Rating data.
+    """
+    rng = np.random.default_rng(seed)
+    df_movies = make_movies(num_movies, num_genres=num_genres, rng=rng)
+    df_ratings = make_ratings(num_users, num_movies, num_ratings, rng=rng)
+    return df_movies, df_ratings
@@ -0,0 +1,34 @@
+import pandas as pd
+import sqlite3
+import sys, os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '..'))
+import recommender.artifact as artifact
+
+def build_model_artifact():
+    db_path = os.path.join(BASE_DIR, '..', 'db', 'movies.db')
+    artifact_path = os.path.join(BASE_DIR, '..', 'artifacts', 'model.npz')
+
+    conn = None
+    try:
+        print(f"Connecting to database at: {db_path}")
+        conn = sqlite3.connect(db_path)
+
+        print("Reading movies...")
+        df_movies = pd.read_sql_query("SELECT * FROM movies", conn)
+
+        print("Building model artifact...")
+        model_artifact = artifact.build_artifact(df_movies=df_movies)
+
+        print(f"Writing artifact to: {artifact_path}")
+        artifact.save_artifact(model_artifact, artifact_path)
+        print(f"Model artifact v{artifact.ARTIFACT_VERSION} built for {len(model_artifact.movie_ids)} movies.")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    build_model_artifact()
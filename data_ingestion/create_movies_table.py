@@ -6,6 +6,7 @@ import sys, os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(BASE_DIR, '..'))
 import recommender.preprocessing as pp
+import database.schema as schema
 
 def create_movies_table():
     db_path = os.path.join(BASE_DIR, '..', 'db', 'movies.db')
@@ -24,7 +25,14 @@ def create_movies_table():
         df_movies = pp.clean_movies(df_movies)
 
         print("Writing to SQLite DB...")
-        df_movies.to_sql("movies", conn, if_exists="replace", index=False)
+        schema.apply_pragmas(conn)
+        conn.execute("DROP TABLE IF EXISTS movies")
+        schema.create_schema(conn)
+        columns = ['movieId', 'title', 'genres', 'year', 'normalized_year']
+        conn.executemany(
+            "INSERT INTO movies (movieId, title, genres, year, normalized_year) VALUES (?, ?, ?, ?, ?)",
+            df_movies[columns].astype(object).where(df_movies[columns].notna(), None).itertuples(index=False, name=None)
+        )
 
         conn.commit()
         print("Table 'movies' created in database.")
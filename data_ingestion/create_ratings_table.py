@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import sqlite3
 import sys, os
@@ -5,6 +6,7 @@ import sys, os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(BASE_DIR, '..'))
 import recommender.preprocessing as pp
+import database.schema as schema
 
 movie_replacement_map = {
     26958: 838,
@@ -14,31 +16,96 @@ movie_replacement_map = {
     64997: 34048
 }
 
-def create_ratings_table():
+RATINGS_DTYPES = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32, 'timestamp': np.int64}
+CHUNK_SIZE = 500_000
+
+def stream_ratings(csv_path, chunksize=CHUNK_SIZE):
+    """
+    Reads the ratings CSV in chunks with compact dtypes and cleans every chunk, so memory use is bounded
+    by the chunk size rather than the file size.
+
+    Args:
+        csv_path (str): Path of the ratings CSV.
+        chunksize (int): Number of rows per chunk.
+
+    Returns:
+        generator: Cleaned pd.Dataframe chunks.
+    """
+    for chunk in pd.read_csv(csv_path, usecols=list(RATINGS_DTYPES), dtype=RATINGS_DTYPES, chunksize=chunksize):
+        yield pp.clean_ratings(chunk, movie_replacement_map)
+
+def insert_ratings(conn, chunks):
+    """
+    Upserts rating chunks into the ratings table inside a single transaction and collects the distinct
+    userIds on the way, so that the users table can be seeded without parsing the CSV again.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+        chunks (iterable): pd.Dataframe chunks with userId, movieId, rating and timestamp columns.
+
+    Returns:
+        tuple: The number of rows read and a sorted np.ndarray of the distinct userIds.
+    """
+    num_rows = 0
+    user_ids = np.empty(0, dtype=np.int32)
+
+    conn.execute("BEGIN")
+    try:
+        for chunk in chunks:
+            conn.executemany(
+                """
+                INSERT INTO ratings (userId, movieId, rating, timestamp) VALUES (?, ?, ?, ?)
+                ON CONFLICT (userId, movieId) DO UPDATE SET rating = excluded.rating, timestamp = excluded.timestamp
+                """,
+                chunk[['userId', 'movieId', 'rating', 'timestamp']].astype(object).itertuples(index=False, name=None)
+            )
+            num_rows += len(chunk)
+            user_ids = np.union1d(user_ids, chunk['userId'].unique())
+            print(f"  {num_rows} ratings written...")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return num_rows, user_ids
+
+def create_ratings_table(chunksize=CHUNK_SIZE):
+    """
+    Streams data/ratings.csv into the ratings table.
+
+    Args:
+        chunksize (int): Number of CSV rows read and inserted at a time.
+
+    Returns:
+        np.ndarray: The distinct userIds found in the ratings, or None if ingestion failed.
+    """
     db_path = os.path.join(BASE_DIR, '..', 'db', 'movies.db')
     csv_path = os.path.join(BASE_DIR, '..', 'data', 'ratings.csv')
     
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
 
+    conn = None
     try:
         print(f"Connecting to database at: {db_path}")
-        conn = sqlite3.connect(db_path)
-
-        print(f"Reading CSV from: {csv_path}")
-        df_ratings = pd.read_csv(csv_path)
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        schema.apply_pragmas(conn)
+        conn.execute("DROP TABLE IF EXISTS ratings")
 
-        print("Cleaning ratings data...")
-        df_ratings = pp.clean_ratings(df_ratings, movie_replacement_map)
+        # Only the unique index the upsert needs exists during the load, the rest are built once at the end
+        conn.execute(schema.RATINGS_TABLE)
+        conn.execute("CREATE UNIQUE INDEX idx_ratings_user_movie ON ratings (userId, movieId)")
 
-        print("Writing to SQLite DB...")
-        df_ratings.to_sql("ratings", conn, if_exists="replace", index=False)
+        print(f"Streaming CSV from: {csv_path}")
+        num_rows, user_ids = insert_ratings(conn, stream_ratings(csv_path, chunksize))
 
-        conn.commit()
-        print("Table 'ratings' created in database.")
+        print("Creating indexes...")
+        schema.create_schema(conn)
+        print(f"Table 'ratings' created in database with {num_rows} ratings from {len(user_ids)} users.")
+        return user_ids
     except Exception as e:
         print(f"Error: {e}")
     finally:
-        conn.close()
+        if conn:
+            conn.close()
 
 if __name__ == "__main__":
-    create_ratings_table()
\ No newline at end of file
+    create_ratings_table()
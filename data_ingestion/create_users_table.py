@@ -1,17 +1,46 @@
+import argparse
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from werkzeug.security import generate_password_hash
-import pandas as pd
 import os, sys
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(BASE_DIR, '..'))
+import database.schema as schema
 
-def create_users_table():
+def hash_passwords(passwords, num_workers=None):
+    """
+    Hashes passwords across a process pool. Password hashing is deliberately slow, so this is only
+    worth it when the dataset accounts need real credentials up front.
+
+    Args:
+        passwords (list): Plain-text passwords.
+        num_workers (int): Number of processes. Defaults to the number of CPUs.
+
+    Returns:
+        list: The password hashes, in the same order as passwords.
+    """
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(generate_password_hash, passwords, chunksize=64))
+
+def create_users_table(user_ids=None, hash_dataset_passwords=False, num_workers=None):
+    """
+    Seeds the users table with one account per dataset user, whose username and password are both "user<id>".
+
+    By default the accounts are inserted without a password hash and app.py hashes the password the first
+    time the user logs in, so seeding costs no hashing at all.
+
+    Args:
+        user_ids (array-like): The dataset userIds, as returned by create_ratings_table. Read from the
+            ratings table if None.
+        hash_dataset_passwords (bool): Hash every password now, across a process pool, instead of on first login.
+        num_workers (int): Number of processes used for hashing. Defaults to the number of CPUs.
+    """
     db_path = os.path.join(BASE_DIR, '..', 'db', 'movies.db')
-    csv_path = os.path.join(BASE_DIR, '..', 'data', 'ratings.csv')
 
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
 
+    conn = None
     try:
         print(f"Connecting to database at: {db_path}")
         conn = sqlite3.connect(db_path)
@@ -22,34 +51,32 @@ def create_users_table():
         # WARNING: IF THIS IS RUN AFTER REAL USER DATA IS ADDED, IT WILL BE DELETED
         cur.execute("DROP TABLE IF EXISTS users")   # THIS LINE WOULD BE THE CULPRIT
 
-        cur.execute("""
-        CREATE TABLE users (
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT,
-            is_dataset_user BOOLEAN NOT NULL DEFAULT 0
-        )
-        """)
+        cur.execute(schema.USERS_TABLE)
+
+        if user_ids is None:
+            print("Reading userIds from the ratings table...")
+            user_ids = [row[0] for row in cur.execute("SELECT DISTINCT userId FROM ratings")]
 
-        print(f"Reading CSV from: {csv_path}")
-        df_ratings = pd.read_csv(csv_path)
+        user_ids = [int(uid) for uid in user_ids]
+        usernames = [f"user{uid}" for uid in user_ids]
+        if hash_dataset_passwords:
+            print(f"Hashing {len(usernames)} passwords...")
+            password_hashes = hash_passwords(usernames, num_workers)  # username and password are the same
+        else:
+            password_hashes = [None] * len(usernames)
 
         print("Inserting user data...")
-        for uid in df_ratings["userId"].unique():
-            uid = int(uid)
-            username = f"user{uid}"
-            dummy_pw = generate_password_hash(username)  # username and password are the same
-            cur.execute("""
-                INSERT INTO users (user_id, username, password_hash, is_dataset_user)
-                VALUES (?, ?, ?, 1)
-            """, (uid, username, dummy_pw))
+        cur.executemany("""
+            INSERT INTO users (user_id, username, password_hash, is_dataset_user)
+            VALUES (?, ?, ?, 1)
+        """, zip(user_ids, usernames, password_hashes))
 
         # Prime Autoincrement for real users starting at 1000
         print("Preparing autoincrement for real users...")
         cur.execute("""
             INSERT INTO users (user_id, username, password_hash, is_dataset_user)
-            VALUES (?, ?, ?, 0)
-        """, (999, "placeholder", generate_password_hash("placeholder")))
+            VALUES (?, ?, NULL, 0)
+        """, (999, "placeholder"))
         cur.execute("DELETE FROM users WHERE user_id = 999")
 
         conn.commit()
@@ -62,4 +89,10 @@ def create_users_table():
             conn.close()
 
 if __name__ == "__main__":
-    create_users_table()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Seed the users table with the dataset users.")
+    parser.add_argument('--hash-passwords', action='store_true',
+                        help="Hash every dataset password now instead of on first login.")
+    parser.add_argument('--workers', type=int, default=None, help="Number of processes used for hashing.")
+    args = parser.parse_args()
+
+    create_users_table(hash_dataset_passwords=args.hash_passwords, num_workers=args.workers)
@@ -0,0 +1,31 @@
+import argparse
+import sys, os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+from create_movies_table import create_movies_table
+from create_ratings_table import create_ratings_table
+from create_users_table import create_users_table
+
+def ingest(hash_dataset_passwords=False):
+    """
+    Loads movies, ratings and users in one run. The ratings CSV is streamed once and the users are
+    seeded from the userIds collected during that pass.
+
+    Args:
+        hash_dataset_passwords (bool): Hash the dataset users' passwords now instead of on first login.
+    """
+    create_movies_table()
+    user_ids = create_ratings_table()
+    if user_ids is None:
+        print("Error: ratings ingestion failed, users were not created.")
+        return
+    create_users_table(user_ids, hash_dataset_passwords)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the MovieLens CSVs into db/movies.db.")
+    parser.add_argument('--hash-passwords', action='store_true',
+                        help="Hash every dataset password now instead of on first login.")
+    args = parser.parse_args()
+
+    ingest(hash_dataset_passwords=args.hash_passwords)
@@ -0,0 +1,27 @@
+import sqlite3
+import sys, os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '..'))
+import database.schema as schema
+
+def migrate_db():
+    db_path = os.path.join(BASE_DIR, '..', 'db', 'movies.db')
+
+    conn = None
+    try:
+        print(f"Connecting to database at: {db_path}")
+        conn = sqlite3.connect(db_path)
+        schema.apply_pragmas(conn)
+
+        print(f"Migrating schema to version {schema.SCHEMA_VERSION}...")
+        schema.migrate(conn)
+        print("Database schema is up to date.")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    migrate_db()
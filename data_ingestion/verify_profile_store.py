@@ -0,0 +1,40 @@
+import pandas as pd
+import sqlite3
+import sys, os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '..'))
+import recommender.artifact as artifact
+from recommender.profile_store import ProfileStore
+
+def verify_profile_store():
+    db_path = os.path.join(BASE_DIR, '..', 'db', 'movies.db')
+    artifact_path = os.path.join(BASE_DIR, '..', 'artifacts', 'model.npz')
+    store_path = os.path.join(BASE_DIR, '..', 'artifacts', 'profile_store.npz')
+    journal_path = os.path.join(BASE_DIR, '..', 'artifacts', 'profile_store.journal')
+
+    conn = None
+    try:
+        print(f"Loading profile store from: {store_path}")
+        model_artifact = artifact.load_artifact(artifact_path)
+        store = ProfileStore(model_artifact.genre_matrix, model_artifact.movie_ids, model_artifact.genres, journal_path=journal_path)
+        store.load(store_path)
+
+        print(f"Connecting to database at: {db_path}")
+        conn = sqlite3.connect(db_path)
+        df_ratings = pd.read_sql_query("SELECT userId, movieId, rating FROM ratings", conn)
+
+        print("Comparing incremental profiles against a full rebuild...")
+        mismatched = store.verify(df_ratings)
+        if mismatched:
+            print(f"{len(mismatched)} profiles differ from the rebuild, e.g. users {mismatched[:10]}")
+        else:
+            print("All profiles match the rebuild.")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    verify_profile_store()
@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import threading
+import time
+import database.schema as schema
+
+class ConnectionPool:
+    """
+    Long-lived SQLite connections, one per thread, that are configured once when opened instead of on every
+    request. Keeping the connection also keeps its prepared-statement cache, so the statements a route runs
+    are only compiled the first time the thread runs them.
+
+    A connection that sat idle for check_interval seconds is health-checked on checkout and replaced if the
+    query fails or the database file was replaced, e.g. by a fresh ingestion. Connections are never shared
+    with a forked child process, which opens its own.
+
+    Args:
+        db_path (str): Path of the SQLite database.
+        read_only (bool): Open the database with a mode=ro URI, for routes that only read.
+        cached_statements (int): Size of each connection's prepared-statement cache.
+        check_interval (float): Seconds a connection can sit idle before it is health-checked on checkout.
+        configure (callable): Called with every new connection after it is configured, e.g. to trace queries.
+    """
+
+    def __init__(self, db_path, read_only=False, cached_statements=256, check_interval=5.0, configure=None):
+        self.db_path = db_path
+        self.read_only = read_only
+        self.cached_statements = cached_statements
+        self.check_interval = check_interval
+        self.configure = configure
+
+        self._local = threading.local()
+        self._connections = {} # thread ident -> connection, so that close_all can reach every thread's connection
+        self._generation = 0
+        self._pid = os.getpid()
+        self._num_opened = 0
+        self._lock = threading.Lock()
+
+    def _file_id(self):
+        stat = os.stat(self.db_path)
+        return stat.st_dev, stat.st_ino
+
+    def _connect(self):
+        if self.read_only:
+            conn = sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True,
+                                   cached_statements=self.cached_statements, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, cached_statements=self.cached_statements, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        schema.apply_pragmas(conn, read_only=self.read_only)
+        if self.configure is not None:
+            self.configure(conn)
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _healthy(self):
+        try:
+            if self._file_id() != self._local.file_id:
+                return False
+            self._local.conn.execute("SELECT 1").fetchone()
+            return True
+        except (OSError, sqlite3.Error):
+            return False
+
+    def connection(self):
+        """
+        Checks out the calling thread's connection, opening it on first use.
+
+        Returns:
+            sqlite3.Connection: A connection with sqlite3.Row rows.
+        """
+        local = self._local
+        now = time.monotonic()
+        conn = getattr(local, 'conn', None)
+        if conn is not None:
+            if local.pid != os.getpid() or local.generation != self._generation:
+                # Inherited from the parent process or closed by close_all, the connection must not be used
+                conn = None
+            elif now - local.last_used >= self.check_interval and not self._healthy():
+                self._close(conn)
+                conn = None
+
+        if conn is None:
+            conn = self._connect()
+            ident = threading.get_ident()
+            with self._lock:
+                if self._pid != os.getpid():
+                    # The parent's connections are left alone, closing them here could disturb the parent
+                    self._connections = {}
+                    self._pid = os.getpid()
+                # Connections of threads that have ended are closed here, as is this thread's previous one
+                alive = {thread.ident for thread in threading.enumerate()}
+                for stale_ident in [i for i in self._connections if i == ident or i not in alive]:
+                    self._close(self._connections.pop(stale_ident))
+                self._connections[ident] = conn
+                self._num_opened += 1
+                local.generation = self._generation
+            local.conn = conn
+            local.pid = os.getpid()
+            local.file_id = self._file_id()
+
+        local.last_used = now
+        return conn
+
+    def release(self, conn):
+        """
+        Returns a connection at the end of a request. A transaction the request left open is rolled back,
+        so it doesn't hold locks until the thread's next request.
+
+        Args:
+            conn (sqlite3.Connection): A connection checked out with connection().
+        """
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            pass
+
+    def close_all(self):
+        """Closes every thread's connection. Threads open a new one on their next checkout."""
+        with self._lock:
+            for conn in self._connections.values():
+                self._close(conn)
+            self._connections.clear()
+            self._generation += 1
+
+    def stats(self):
+        """
+        Returns the number of open connections and of connections opened since the pool was created.
+        """
+        with self._lock:
+            return {'connections': len(self._connections), 'opened': self._num_opened}
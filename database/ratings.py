@@ -0,0 +1,61 @@
+RATINGS_PAGE_SIZE = 50
+
+def encode_cursor(timestamp, movie_id):
+    return f"{timestamp}:{movie_id}"
+
+def decode_cursor(cursor):
+    """
+    Parses a cursor produced by encode_cursor.
+
+    Args:
+        cursor (str): A "timestamp:movieId" cursor.
+
+    Returns:
+        tuple: (timestamp, movieId), or None if the cursor is missing or malformed.
+    """
+    try:
+        timestamp, movie_id = cursor.split(':')
+        return int(timestamp), int(movie_id)
+    except (AttributeError, ValueError):
+        return None
+
+def get_user_ratings_page(conn, user_id, cursor=None, limit=RATINGS_PAGE_SIZE):
+    """
+    Returns one page of a user's ratings, newest first, with the movie titles joined in the same query.
+
+    Pages use keyset pagination on (timestamp, movieId) instead of OFFSET, so every page costs the same
+    no matter how deep it is. movieId breaks ties between ratings that share a timestamp.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+        user_id (int): The user whose ratings are listed.
+        cursor (str): The next_cursor of the previous page, or None for the first page.
+        limit (int): Number of ratings per page.
+
+    Returns:
+        list: (title, rating, timestamp, movieId) rows.
+        str: Cursor of the next page, or None if this is the last page.
+    """
+    query = """
+        SELECT movies.title, ratings.rating, ratings.timestamp, ratings.movieId
+        FROM ratings
+        JOIN movies ON movies.movieId = ratings.movieId
+        WHERE ratings.userId = ?
+    """
+    params = [user_id]
+
+    position = decode_cursor(cursor)
+    if position is not None:
+        query += " AND (ratings.timestamp < ? OR (ratings.timestamp = ? AND ratings.movieId < ?))"
+        params += [position[0], position[0], position[1]]
+
+    query += " ORDER BY ratings.timestamp DESC, ratings.movieId DESC LIMIT ?"
+    params.append(limit + 1) # one extra row tells us whether there is a next page
+
+    rows = conn.execute(query, params).fetchall()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last_row = rows[-1]
+    return rows, encode_cursor(last_row[2], last_row[3])
@@ -0,0 +1,161 @@
+import sqlite3
+
+SCHEMA_VERSION = 2
+
+MOVIES_TABLE = """
+CREATE TABLE IF NOT EXISTS movies (
+    movieId INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    genres TEXT NOT NULL,
+    year REAL,
+    normalized_year REAL
+)
+"""
+
+RATINGS_TABLE = """
+CREATE TABLE IF NOT EXISTS ratings (
+    ratingId INTEGER PRIMARY KEY,
+    userId INTEGER NOT NULL,
+    movieId INTEGER NOT NULL,
+    rating REAL NOT NULL,
+    timestamp INTEGER NOT NULL
+)
+"""
+
+USERS_TABLE = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password_hash TEXT,
+    is_dataset_user BOOLEAN NOT NULL DEFAULT 0
+)
+"""
+
+# A counter that every write to movies or ratings bumps, so caches of the data can tell when they are stale
+DATA_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS data_version (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+)
+"""
+
+DATA_VERSION_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_data_version AFTER {event} ON {table}
+    BEGIN UPDATE data_version SET version = version + 1; END
+    """
+    for table in ('movies', 'ratings') for event in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_movies_title ON movies (title)",
+    # One rating per user and movie, which also serves WHERE userId = ? and the upsert/delete lookups
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_ratings_user_movie ON ratings (userId, movieId)",
+    # Newest-first listing of a user's ratings, movieId breaks ties between equal timestamps
+    "CREATE INDEX IF NOT EXISTS idx_ratings_user_timestamp ON ratings (userId, timestamp, movieId)",
+]
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+]
+
+# A read-only connection can't switch the journal mode, and synchronous only matters to writers
+READ_ONLY_PRAGMAS = [pragma for pragma in PRAGMAS if not pragma.startswith(("PRAGMA journal_mode", "PRAGMA synchronous"))]
+
+def apply_pragmas(conn, read_only=False):
+    """
+    Configures a connection for a read-heavy web workload: WAL so readers don't block the writer,
+    synchronous=NORMAL which is durable enough under WAL, and memory-mapped reads.
+
+    Args:
+        conn (sqlite3.Connection): The connection to configure.
+        read_only (bool): Whether the connection was opened read-only (mode=ro), which only gets the read settings.
+    """
+    for pragma in READ_ONLY_PRAGMAS if read_only else PRAGMAS:
+        conn.execute(pragma)
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+def _has_primary_key(conn, table):
+    return any(column[5] for column in conn.execute(f"PRAGMA table_info({table})"))
+
+def create_schema(conn):
+    """
+    Creates every table, index and trigger that doesn't exist yet. The data version is bumped as well,
+    since this runs after every bulk load, which the triggers don't see when it replaces a whole table.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+    """
+    for statement in [MOVIES_TABLE, RATINGS_TABLE, USERS_TABLE, DATA_VERSION_TABLE] + INDEXES + DATA_VERSION_TRIGGERS:
+        conn.execute(statement)
+    conn.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (0, 0)")
+    conn.execute("UPDATE data_version SET version = version + 1")
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def get_data_version(conn):
+    """
+    Returns the data version, which changes whenever the movies or ratings tables do.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+
+    Returns:
+        int: The current data version, or None for a database without the data_version table.
+    """
+    try:
+        row = conn.execute("SELECT version FROM data_version WHERE id = 0").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+def migrate(conn):
+    """
+    Brings a database up to SCHEMA_VERSION. Tables that were written by DataFrame.to_sql have no types,
+    primary keys or indexes, so they are rebuilt into the typed tables and their rows copied over. Duplicate
+    ratings of the same movie by the same user are collapsed into the most recent one.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+    """
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    # IMMEDIATE takes the write lock up front, so if several processes migrate at once the others wait and
+    # then find the schema up to date below
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            conn.rollback()
+            return
+
+        if _table_exists(conn, 'movies') and not _has_primary_key(conn, 'movies'):
+            conn.execute("ALTER TABLE movies RENAME TO movies_legacy")
+            conn.execute(MOVIES_TABLE)
+            conn.execute("""
+                INSERT OR REPLACE INTO movies (movieId, title, genres, year, normalized_year)
+                SELECT movieId, title, genres, year, normalized_year FROM movies_legacy
+            """)
+            conn.execute("DROP TABLE movies_legacy")
+
+        if _table_exists(conn, 'ratings') and not _has_primary_key(conn, 'ratings'):
+            conn.execute("ALTER TABLE ratings RENAME TO ratings_legacy")
+            conn.execute(RATINGS_TABLE)
+            conn.execute("CREATE UNIQUE INDEX idx_ratings_user_movie ON ratings (userId, movieId)")
+            conn.execute("""
+                INSERT INTO ratings (userId, movieId, rating, timestamp)
+                SELECT userId, movieId, rating, timestamp FROM ratings_legacy WHERE true
+                ORDER BY timestamp
+                ON CONFLICT (userId, movieId) DO UPDATE SET rating = excluded.rating, timestamp = excluded.timestamp
+            """)
+            conn.execute("DROP TABLE ratings_legacy")
+
+        create_schema(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
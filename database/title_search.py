@@ -0,0 +1,170 @@
+import bisect
+import re
+import threading
+import time
+import numpy as np
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+
+def _normalize(text):
+    return text.casefold().strip()
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class TitleSearchIndex:
+    """
+    In-memory autocomplete index over movie titles. A query matches, in order of preference:
+
+    1. titles with a word that starts with it, e.g. "matrix" finds "The Matrix (1999)" (sorted token array),
+       or, for multi-word queries, titles that start with it (sorted title array), both by binary search,
+    2. titles that contain it anywhere (trigram postings, verified with a substring check).
+
+    Movies are numbered by popularity, so every posting list is already in popularity order and the most
+    popular matches are simply the smallest ids.
+
+    Args:
+        titles (list): Movie titles.
+        popularity (list): A popularity score per title, such as its number of ratings.
+    """
+
+    def __init__(self, titles, popularity):
+        order = sorted(range(len(titles)), key=lambda i: (-popularity[i], titles[i]))
+        self.titles = [titles[i] for i in order]
+        normalized_titles = [_normalize(title) for title in self.titles]
+        self.normalized_titles = normalized_titles
+
+        title_order = sorted(range(len(normalized_titles)), key=normalized_titles.__getitem__)
+        self.sorted_titles = [normalized_titles[i] for i in title_order]
+        self.sorted_title_ids = np.array(title_order, dtype=np.int32)
+
+        tokens = [(token, movie) for movie, title in enumerate(normalized_titles)
+                  for token in set(_TOKEN_PATTERN.findall(title))]
+        tokens.sort()
+        self.sorted_tokens = [token for token, _ in tokens]
+        self.sorted_token_ids = np.array([movie for _, movie in tokens], dtype=np.int32)
+
+        postings = {}
+        for movie, title in enumerate(normalized_titles):
+            for trigram in _trigrams(title):
+                postings.setdefault(trigram, []).append(movie)
+        self.trigram_postings = {trigram: np.array(movies, dtype=np.int32) for trigram, movies in postings.items()}
+
+    @classmethod
+    def from_db(cls, conn):
+        """
+        Builds the index from the movies table, ranking titles by their number of ratings.
+
+        Args:
+            conn (sqlite3.Connection): Database connection.
+
+        Returns:
+            TitleSearchIndex: The built index.
+        """
+        rows = conn.execute("""
+            SELECT movies.title, COALESCE(counts.num_ratings, 0)
+            FROM movies
+            LEFT JOIN (SELECT movieId, COUNT(*) AS num_ratings FROM ratings GROUP BY movieId) AS counts
+                ON counts.movieId = movies.movieId
+        """).fetchall()
+        return cls([row[0] for row in rows], [row[1] for row in rows])
+
+    @staticmethod
+    def _range(sorted_values, prefix):
+        start = bisect.bisect_left(sorted_values, prefix)
+        end = bisect.bisect_left(sorted_values, prefix + '\U0010ffff', lo=start)
+        return start, end
+
+    @staticmethod
+    def _most_popular(ids, limit):
+        # ids may contain duplicates, so a few extra candidates are kept before deduplicating
+        candidates = min(len(ids), 4 * limit)
+        if len(ids) > candidates:
+            top = np.unique(np.partition(ids, candidates - 1)[:candidates])
+            if len(top) >= limit:
+                return top[:limit]
+        return np.unique(ids)[:limit]
+
+    def search(self, query, limit=10):
+        """
+        Returns the best matching titles for an autocomplete query. Word-start matches come first and
+        substring matches fill the remaining slots, each ranked by popularity.
+
+        Args:
+            query (str): What the user has typed so far.
+            limit (int): Maximum number of titles to return.
+
+        Returns:
+            list: Matching titles, best first.
+        """
+        query = _normalize(query)
+        if not query or limit <= 0:
+            return []
+
+        query_tokens = _TOKEN_PATTERN.findall(query)
+        if len(query_tokens) == 1 and query_tokens[0] == query:
+            # A single word matches the start of any word, which includes the start of the title
+            start, end = self._range(self.sorted_tokens, query)
+            results = self._most_popular(self.sorted_token_ids[start:end], limit).tolist()
+        else:
+            start, end = self._range(self.sorted_titles, query)
+            results = self._most_popular(self.sorted_title_ids[start:end], limit).tolist()
+
+        if len(results) < limit and len(query) >= 3:
+            postings = sorted((self.trigram_postings.get(trigram) for trigram in _trigrams(query)),
+                              key=lambda ids: -1 if ids is None else len(ids))
+            if postings[0] is not None:
+                candidates = postings[0]
+                for ids in postings[1:]:
+                    candidates = np.intersect1d(candidates, ids, assume_unique=True)
+
+                seen = set(results)
+                for movie in candidates.tolist():
+                    if movie not in seen and query in self.normalized_titles[movie]:
+                        results.append(movie)
+                        if len(results) == limit:
+                            break
+
+        return [self.titles[movie] for movie in results]
+
+class RefreshingTitleSearchIndex:
+    """
+    Holds a TitleSearchIndex and rebuilds it when the movies table changes. The table is checked at most
+    once every refresh_interval seconds so that keystrokes never pay for the check.
+
+    Args:
+        refresh_interval (float): Minimum number of seconds between checks of the movies table.
+    """
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self.index = None
+        self._signature = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _table_signature(conn):
+        return tuple(conn.execute("SELECT COUNT(*), MAX(movieId), TOTAL(LENGTH(title)) FROM movies").fetchone())
+
+    def get(self, conn):
+        """
+        Returns the current index, rebuilding it first if the movies table has changed.
+
+        Args:
+            conn (sqlite3.Connection): Database connection used for the check and the rebuild.
+
+        Returns:
+            TitleSearchIndex: The index.
+        """
+        if self.index is not None and time.monotonic() - self._checked_at < self.refresh_interval:
+            return self.index
+
+        with self._lock:
+            if self.index is None or time.monotonic() - self._checked_at >= self.refresh_interval:
+                signature = self._table_signature(conn)
+                if signature != self._signature:
+                    self.index = TitleSearchIndex.from_db(conn)
+                    self._signature = signature
+                self._checked_at = time.monotonic()
+        return self.index
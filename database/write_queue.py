@@ -0,0 +1,220 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+import database.schema as schema
+
+# old_rating and old_timestamp are None if there was no rating before, rating and timestamp are None after a delete.
+# version is the database's data version right after the write, which orders it among all writes (see database.schema)
+RatingChange = namedtuple('RatingChange', ['user_id', 'movie_id', 'old_rating', 'old_timestamp', 'rating', 'timestamp', 'version'])
+
+logger = logging.getLogger(__name__)
+
+_UPSERT = 'upsert'
+_DELETE = 'delete'
+_STOP = object()
+
+class RatingWriteQueue:
+    """
+    Writes rating upserts and deletes from a single background thread with group commit: the writes that
+    arrive within max_delay seconds of each other, up to max_batch_size of them, share one transaction and
+    therefore one fsync, and the thread is the only writer of this process, so requests never wait on
+    each other for SQLite's write lock.
+
+    Every write returns a Future that resolves to its RatingChange once the transaction is durably
+    committed (the writer runs with synchronous=FULL) and every listener has seen it, so in-memory state
+    is up to date by the time the caller continues.
+
+    Args:
+        db_path (str): Path of the SQLite database.
+        max_batch_size (int): Maximum number of writes per transaction.
+        max_delay (float): Seconds the writer waits for more writes after the first one of a batch.
+        timeout (float): Seconds the writer waits for another process's write lock before failing a batch.
+    """
+
+    def __init__(self, db_path, max_batch_size=256, max_delay=0.005, timeout=30.0):
+        self.db_path = db_path
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+        self._listeners = []
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._num_batches = 0
+        self._num_writes = 0
+        self._num_failed = 0
+
+    def add_listener(self, listener):
+        """
+        Registers a function that is called with the list of RatingChanges of every committed batch, on
+        the writer thread. Deletes of ratings that didn't exist aren't passed on.
+
+        Args:
+            listener (callable): Takes a list of RatingChanges.
+        """
+        self._listeners.append(listener)
+
+    def _ensure_started(self):
+        # The thread is started on first use, and again in a forked worker, where it doesn't survive the fork
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='rating-writer', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def _submit(self, operation, user_id, movie_id, rating=None, timestamp=None):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((operation, int(user_id), int(movie_id), rating, timestamp, future))
+        return future
+
+    def upsert(self, user_id, movie_id, rating, timestamp):
+        """
+        Queues a rating, replacing the user's existing rating of the movie.
+
+        Args:
+            user_id (int): The user that rated the movie.
+            movie_id (int): The rated movie.
+            rating (float): The rating.
+            timestamp (int): Unix timestamp of the rating.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the RatingChange once it is committed.
+        """
+        return self._submit(_UPSERT, user_id, movie_id, float(rating), int(timestamp))
+
+    def delete(self, user_id, movie_id):
+        """
+        Queues the deletion of a user's rating of a movie.
+
+        Args:
+            user_id (int): The user whose rating is deleted.
+            movie_id (int): The movie whose rating is deleted.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the RatingChange once it is committed.
+        """
+        return self._submit(_DELETE, user_id, movie_id)
+
+    def close(self):
+        """Commits the writes that are still queued and stops the writer thread."""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self):
+        """
+        Returns the number of committed batches, committed and failed writes, and writes still queued.
+        """
+        with self._stats_lock:
+            return {'batches': self._num_batches,
+                    'writes': self._num_writes,
+                    'failed': self._num_failed,
+                    'queued': self._queue.qsize() if self._queue is not None else 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+        schema.apply_pragmas(conn)
+        # Writes are acknowledged as durable, and group commit keeps the extra fsync cheap
+        conn.execute("PRAGMA synchronous = FULL")
+        return conn
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None, True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._next_batch()
+                if batch:
+                    self._write_batch(conn, batch)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _execute(conn, operation, user_id, movie_id, rating, timestamp):
+        old = conn.execute("SELECT rating, timestamp FROM ratings WHERE userId = ? AND movieId = ?",
+                           (user_id, movie_id)).fetchone()
+        old_rating, old_timestamp = old if old is not None else (None, None)
+
+        if operation == _UPSERT:
+            conn.execute(
+                """
+                INSERT INTO ratings (userId, movieId, rating, timestamp) VALUES (?, ?, ?, ?)
+                ON CONFLICT (userId, movieId) DO UPDATE SET rating = excluded.rating, timestamp = excluded.timestamp
+                """,
+                (user_id, movie_id, rating, timestamp)
+            )
+        elif old is not None:
+            conn.execute("DELETE FROM ratings WHERE userId = ? AND movieId = ?", (user_id, movie_id))
+        return RatingChange(user_id, movie_id, old_rating, old_timestamp, rating, timestamp, schema.get_data_version(conn))
+
+    def _commit(self, conn, items):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            changes = [self._execute(conn, *item[:5]) for item in items]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return changes
+
+    def _write_batch(self, conn, batch):
+        try:
+            results = [(item, change, None) for item, change in zip(batch, self._commit(conn, batch))]
+        except Exception:
+            # Retry one write per transaction, so one bad write doesn't fail the whole batch
+            results = []
+            for item in batch:
+                try:
+                    results.append((item, self._commit(conn, [item])[0], None))
+                except Exception as e:
+                    results.append((item, None, e))
+
+        changes = [change for _, change, _ in results
+                   if change is not None and (change.old_rating is not None or change.rating is not None)]
+        if changes:
+            for listener in self._listeners:
+                try:
+                    listener(changes)
+                except Exception:
+                    logger.exception("Rating change listener %r failed", listener)
+
+        with self._stats_lock:
+            self._num_batches += 1
+            self._num_writes += len(results) - sum(error is not None for _, _, error in results)
+            self._num_failed += sum(error is not None for _, _, error in results)
+
+        for item, change, error in results:
+            future = item[5]
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(change)
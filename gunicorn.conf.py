@@ -0,0 +1,41 @@
+# Picked up by "gunicorn app:app" when it is run from this directory
+import gc
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:8000")
+# Workers share the recommendation cache (below), and the profile store and popular movies through their
+# journals under ARTIFACTS_DIR, which must therefore be on a local disk. See "Deployment" in README.md for
+# what each worker still keeps to itself.
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# Workers share one recommendation cache, so a rating in one worker invalidates the cached recommendations
+# of the others. A tmpfs keeps the file in memory.
+if workers > 1 and not os.environ.get("RECOMMENDATION_CACHE_PATH"):
+    _cache_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    os.environ["RECOMMENDATION_CACHE_PATH"] = os.path.join(_cache_dir, f"movie-recommendation-cache-{os.getpid()}.db")
+    _shared_cache_path = os.environ["RECOMMENDATION_CACHE_PATH"]
+else:
+    _shared_cache_path = None
+
+# app.py is imported once in the master and the workers are forked from it, so they start without
+# importing anything and share the master's memory copy-on-write
+preload_app = True
+
+def when_ready(server):
+    import app
+    # Migrating here runs it once, before any worker can race another on the schema
+    app.migrate_db()
+    app.warm_up()
+    # Everything allocated so far is moved out of the garbage collector's reach, so collections in the
+    # workers don't write to the shared pages (and thereby copy them)
+    gc.freeze()
+    server.log.info("Warmed up, %d objects frozen", gc.get_freeze_count())
+
+def on_exit(server):
+    if _shared_cache_path is not None:
+        for path in (_shared_cache_path, _shared_cache_path + '-wal', _shared_cache_path + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
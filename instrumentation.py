@@ -0,0 +1,253 @@
+import cProfile
+import hmac
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, has_request_context, request, Response
+
+# Upper bounds in seconds, roughly logarithmic from 1ms to 10s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus sense: every bucket counts the observations that are
+    less than or equal to its upper bound.
+
+    Args:
+        buckets (tuple): Sorted upper bounds. An implicit +Inf bucket is added.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    """
+    In-process metrics in the Prometheus text format. Each worker process keeps its own registry, so with
+    several workers every one of them has to be scraped (or the values aggregated) separately.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._collectors = []
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def describe(self, name, kind, help_text):
+        """Sets the TYPE and HELP lines of a metric."""
+        self._help[name] = (kind, help_text)
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """Records a value in a histogram."""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        """Increments a counter."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_collector(self, collector):
+        """
+        Registers a function that is called on every scrape and returns (name, kind, help, value) tuples,
+        for values that already live elsewhere, such as the cache statistics.
+        """
+        self._collectors.append(collector)
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        escaped = (name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+                   for name, value in labels)
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        described = set()
+
+        def header(name, kind, help_text=None):
+            if name not in described:
+                kind, help_text = self._help.get(name, (kind, help_text))
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            histograms = [(key, list(h.buckets), list(h.counts), h.sum, h.count) for key, h in histograms]
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+
+        for (name, labels), buckets, counts, total, count in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{self._format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+
+        for collector in self._collectors:
+            for name, kind, help_text, value in collector():
+                header(name, kind, help_text)
+                lines.append(f"{name} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+metrics.describe('http_request_duration_seconds', 'histogram', 'Latency of HTTP requests by route, method and status.')
+metrics.describe('http_request_sql_queries', 'histogram', 'Number of SQL statements executed per HTTP request.')
+metrics.describe('stage_duration_seconds', 'histogram', 'Latency of instrumented stages of the request path.')
+metrics.describe('http_requests_total', 'counter', 'Number of HTTP requests by route, method and status.')
+
+@contextmanager
+def timer(stage):
+    """
+    Times a block as a stage of the current request. The duration is recorded in the stage histogram and,
+    inside a request, added to the request's Server-Timing header.
+
+    Args:
+        stage (str): Name of the stage, e.g. "score".
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('stage_duration_seconds', elapsed, stage=stage)
+        if has_request_context():
+            stages = g.setdefault('instrumentation_stages', {})
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+def timed(stage):
+    """
+    Decorator version of timer.
+
+    Args:
+        stage (str): Name of the stage. Every call of the decorated function is timed as this stage.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapped
+    return decorator
+
+def _count_query(statement):
+    if has_request_context():
+        g.instrumentation_sql_queries = g.get('instrumentation_sql_queries', 0) + 1
+
+def trace_queries(conn):
+    """
+    Counts every statement executed on a connection towards the current request's SQL query count.
+
+    Args:
+        conn (sqlite3.Connection): The connection to trace.
+    """
+    conn.set_trace_callback(_count_query)
+
+def has_bearer_token(token):
+    """
+    Checks in constant time that the current request carries the header "Authorization: Bearer <token>".
+
+    Args:
+        token (str): The expected token.
+
+    Returns:
+        bool: Whether the request carries the token.
+    """
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+
+def init_app(app, profile_dir=None, metrics_token=None):
+    """
+    Records the latency, status and SQL query count of every request and adds the /metrics endpoint.
+    /metrics is disabled unless metrics_token is set, and scrapers send it as "Authorization: Bearer <token>".
+
+    If profile_dir is set, a request sent with the header "X-Profile: 1" is run under cProfile and its
+    stats are written to profile_dir, with the file name returned in the X-Profile-Output header. Profiling
+    is off unless profile_dir is given, so clients can't slow the app down with the header.
+
+    Args:
+        app (flask.Flask): The app to instrument.
+        profile_dir (str): Where profiles of single requests are written, or None to disable profiling.
+        metrics_token (str): The token that /metrics requires, or None to disable /metrics.
+    """
+    @app.before_request
+    def start_request():
+        g.instrumentation_start = time.perf_counter()
+        g.instrumentation_sql_queries = 0
+        if profile_dir and request.headers.get('X-Profile') == '1':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                return # another request is already being profiled
+            g.instrumentation_profiler = profiler
+
+    @app.after_request
+    def finish_request(response):
+        profiler = g.pop('instrumentation_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            file_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unmatched'}-{os.getpid()}.prof"
+            pstats.Stats(profiler).dump_stats(os.path.join(profile_dir, file_name))
+            response.headers['X-Profile-Output'] = file_name
+
+        start = g.get('instrumentation_start')
+        if start is None or request.endpoint == 'metrics':
+            return response
+
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        labels = dict(route=route, method=request.method, status=response.status_code)
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - start, **labels)
+        metrics.inc('http_requests_total', **labels)
+        metrics.observe('http_request_sql_queries', g.get('instrumentation_sql_queries', 0),
+                        buckets=QUERY_COUNT_BUCKETS, route=route)
+
+        stages = g.get('instrumentation_stages')
+        if stages:
+            response.headers['Server-Timing'] = ', '.join(f"{stage};dur={seconds * 1000:.2f}"
+                                                          for stage, seconds in stages.items())
+        return response
+
+    @app.route('/metrics', endpoint='metrics')
+    def metrics_endpoint():
+        if not metrics_token:
+            return Response("Metrics are disabled.\n", status=503, mimetype='text/plain')
+        if not has_bearer_token(metrics_token):
+            return Response("Invalid metrics token.\n", status=401, mimetype='text/plain')
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
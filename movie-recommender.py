@@ -1,44 +1,95 @@
+import argparse
 import recommender.preprocessing as pp
 import recommender.model as model
 import recommender.evaluation as eval
+import recommender.item_cf as item_cf
+import recommender.parallel as parallel
+import recommender.snapshot as snapshot
 
-# -=| Data Loading |=-
-df_movies, df_ratings = pp.load_data('data/movies.csv', 'data/ratings.csv')
+DATASET_CACHE_DIR = 'artifacts/dataset'
 
-# -=| Feature Engineering |=-
-movie_replacement_map = {
-    26958: 838,
-    168358: 2851,
-    6003: 144606,
-    32600: 147002,
-    64997: 34048
-}
+def evaluate_model(name, user_ids, recommendations, movie_ids, df_train_ratings, df_test_ratings):
+    """
+    Prints the ranking metrics of a model's top-k recommendations on the test ratings.
 
-df_movies = pp.clean_movies(df_movies)
-df_ratings = pp.clean_ratings(df_ratings, movie_replacement_map=movie_replacement_map)
+    Args:
+        name (str): The model's name in the printed output.
+        user_ids (pd.Index): The userId of every row of recommendations.
+        recommendations (np.ndarray): Column positions in movie_ids, as returned by model.top_k_movies.
+        movie_ids (pd.Index): The movieId of every column position.
+        df_train_ratings (pd.Dataframe): The training ratings, used for the novelty of the recommendations.
+        df_test_ratings (pd.Dataframe): The withheld ratings.
 
-# Remove less active users and movies
-df_ratings, df_movies = pp.filter_less_active_data(df_ratings=df_ratings, df_movies=df_movies)
+    Returns:
+        pd.Dataframe: The metrics, as returned by eval.evaluate.
+    """
+    ground_truth = eval.ground_truth_matrix(df_test_ratings, user_ids, movie_ids)
+    metrics = eval.evaluate(recommendations, ground_truth, ks=(5, 10),
+                            item_popularity=eval.item_popularity(df_train_ratings, movie_ids),
+                            num_bootstrap=1000)
+    average_recall = metrics.loc[(metrics['metric'] == 'recall') & (metrics['k'] == 10), 'value'].item()
+    print(f"{name} Average Recall@10: {average_recall:.4f}")
+    print(metrics.to_string(index=False, float_format='{:.4f}'.format))
+    return metrics
 
-df_train_ratings, df_test_ratings = pp.user_rating_train_test_split(df_ratings=df_ratings)
+def main(num_workers=1, split='random', num_neighbours=50):
+    # -=| Data Loading & Feature Engineering |=-
+    movie_replacement_map = {
+        26958: 838,
+        168358: 2851,
+        6003: 144606,
+        32600: 147002,
+        64997: 34048
+    }
 
-df_genres = pp.encode_genres(df_movies=df_movies)
+    # The cleaned data and genre encoding are cached and only rebuilt when the CSVs change
+    df_movies, df_ratings, genre_encoding = snapshot.load_clean_data('data/movies.csv', 'data/ratings.csv',
+                                                                     cache_dir=DATASET_CACHE_DIR,
+                                                                     movie_replacement_map=movie_replacement_map)
 
-user_profiles = model.create_user_profiles(df_ratings=df_train_ratings, df_movies=df_movies, df_genres=df_genres)
+    # Remove less active users and movies
+    df_ratings, df_movies = pp.filter_less_active_data(df_ratings=df_ratings, df_movies=df_movies)
 
-df_user_movie_similarities = model.compute_similarity_matrix(user_profiles=user_profiles, df_genres=df_genres)
+    if split == 'temporal':
+        df_train_ratings, df_test_ratings = pp.user_rating_temporal_split(df_ratings=df_ratings, num_test=10)
+    else:
+        df_train_ratings, df_test_ratings = pp.user_rating_train_test_split(df_ratings=df_ratings)
 
-# Example Recommendation
-recommendations = model.recommend_movies(user_id=5, 
-                                         df_user_movie_similarities=df_user_movie_similarities, 
-                                         df_ratings=df_train_ratings,
-                                         df_movies=df_movies,
-                                         num_recommendations=10)
-print(recommendations)
+    df_genres = pp.select_genres(genre_encoding, df_movies['movieId'], as_frame=True)
 
-# Evaluation
-test_recommendations = model.recommend_movies_all_users(user_movie_similarities=df_user_movie_similarities, df_ratings=df_train_ratings, df_movies=df_movies, num_recommendations=10)
-ground_truth = df_test_ratings.groupby('userId')['movieId'].apply(set).to_dict()
+    user_profiles = model.create_user_profiles_sparse(df_ratings=df_train_ratings, df_movies=df_movies, df_genres=df_genres)
 
-average_recall = eval.average_recall_at_k(test_recommendations, ground_truth)
-print(f"Average Recall@10: {average_recall:.4f}")
\ No newline at end of file
+    # Example Recommendation, scored from user 5's profile alone instead of a users x movies similarity matrix
+    genre_matrix, movie_ids, _ = model.unpack_genres(df_genres)
+    top_k = model.recommend_for_profile(profile_vector=user_profiles.loc[5].to_numpy(),
+                                        normalized_features=model.normalize_rows(genre_matrix),
+                                        movie_ids=movie_ids,
+                                        exclude_ids=df_train_ratings.loc[df_train_ratings['userId'] == 5, 'movieId'].to_numpy(),
+                                        k=10)
+    recommendations = df_movies[['movieId', 'title']].merge(top_k, on='movieId').sort_values(by='score', ascending=False)
+    print(recommendations)
+
+    # Evaluation
+    if num_workers > 1:
+        ground_truth = df_test_ratings.groupby('userId')['movieId'].apply(set).to_dict()
+        average_recall = parallel.parallel_average_recall_at_k(user_profiles=user_profiles, df_genres=df_genres, df_ratings=df_train_ratings, ground_truth=ground_truth, num_recommendations=10, num_workers=num_workers)
+        print(f"Average Recall@10: {average_recall:.4f}")
+    else:
+        user_ids, test_recommendations, movie_ids = model.top_k_movies(user_profiles=user_profiles, df_genres=df_genres, df_ratings=df_train_ratings, num_recommendations=10)
+        evaluate_model("Content-based", user_ids, test_recommendations, movie_ids, df_train_ratings, df_test_ratings)
+
+    # Item-item collaborative filtering, evaluated on the same split and candidate movies
+    neighbours = item_cf.compute_item_neighbours(df_ratings=df_train_ratings, movie_ids=df_genres.index, num_neighbours=num_neighbours)
+    print(item_cf.recommend_movies(user_id=5, neighbours=neighbours, df_ratings=df_train_ratings, df_movies=df_movies, num_recommendations=10))
+    user_ids, test_recommendations, movie_ids = item_cf.top_k_movies(neighbours=neighbours, df_ratings=df_train_ratings, num_recommendations=10)
+    evaluate_model("Item-item CF", user_ids, test_recommendations, movie_ids, df_train_ratings, df_test_ratings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train and evaluate the movie recommender.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes used for the evaluation.")
+    parser.add_argument('--split', choices=['random', 'temporal'], default='random',
+                        help="Withhold a random 20%% of each user's ratings, or their 10 most recent ones.")
+    parser.add_argument('--neighbours', type=int, default=50, help="Number of neighbours kept per movie by item-item CF.")
+    args = parser.parse_args()
+
+    main(num_workers=args.workers, split=args.split, num_neighbours=args.neighbours)
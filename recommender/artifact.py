@@ -0,0 +1,164 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import recommender.preprocessing as pp
+import recommender.model as model
+import recommender.retrieval as retrieval
+
+ARTIFACT_VERSION = 3
+
+class ModelArtifact:
+    """
+    Precomputed model state that is built offline and shared across requests.
+
+    Args:
+        movie_ids (np.ndarray): The movieId of every row in the genre matrix.
+        titles (np.ndarray): Movie titles, aligned with movie_ids.
+        genres (np.ndarray): Genre vocabulary, aligned with the genre matrix columns.
+        genre_matrix (sparse.csr_matrix): Multi-hot encoded genre data (movies x genres).
+        years (np.ndarray): Normalized release years, aligned with movie_ids.
+        built_at (float): Unix timestamp of when the artifact was built.
+    """
+
+    def __init__(self, movie_ids, titles, genres, genre_matrix, years, built_at):
+        self.movie_ids = movie_ids
+        self.titles = titles
+        self.genres = genres
+        self.genre_matrix = genre_matrix
+        self.years = years
+        self.built_at = built_at
+
+        self.movie_index = pd.Index(movie_ids)
+
+        # Rows are normalized once so that scoring a user is a single dot product
+        self.normalized_genres = model.normalize_rows(genre_matrix)
+        self.retrieval_index = None
+
+    def build_retrieval_index(self, backend='exact', **kwargs):
+        """
+        Serves recommend_for_profile from a retrieval index instead of scoring every movie.
+
+        Args:
+            backend (str): One of retrieval.INDEX_BACKENDS.
+            **kwargs: Tuning parameters of the chosen backend.
+        """
+        self.retrieval_index = retrieval.build_index(self.genre_matrix, self.movie_index, backend=backend, **kwargs)
+
+    def recommend_for_profile(self, profile, exclude_ids=None, num_recommendations=10):
+        """
+        Provides the top-k recommended movies for an already built user profile.
+
+        Args:
+            profile (np.ndarray): The user's profile, aligned with genres.
+            exclude_ids (array-like): movieIds that should not be recommended.
+            num_recommendations (int): The number of recommendations the function should output.
+
+        Returns:
+            pd.Dataframe: The top-k recommended movies for the user, along with their scores.
+        """
+        if self.retrieval_index is not None:
+            top_k = self.retrieval_index.search(profile, k=num_recommendations, exclude_ids=exclude_ids)
+        else:
+            top_k = model.recommend_for_profile(profile_vector=profile,
+                                                normalized_features=self.normalized_genres,
+                                                movie_ids=self.movie_index,
+                                                exclude_ids=exclude_ids,
+                                                k=num_recommendations)
+        top_k.insert(1, 'title', self.titles[self.movie_index.get_indexer(top_k['movieId'])])
+        return top_k
+
+    def recommend_for_profiles(self, profiles, rated_matrix=None, num_recommendations=10):
+        """
+        Provides the top-k recommended movies for a batch of user profiles, scored together in one
+        matrix-matrix product. The retrieval index is not used, since scoring every movie for a whole
+        batch at once is already cheap per user.
+
+        Args:
+            profiles (np.ndarray): User profiles (users x genres).
+            rated_matrix (sparse.csr_matrix): Movies to exclude per user (users x movies), as built by
+                model.build_rated_matrix with this artifact's movie_index.
+            num_recommendations (int): The number of recommendations per user.
+
+        Returns:
+            np.ndarray: The recommended movieIds per user, best first (users x k). Padded with -1 when a
+                user has fewer unrated movies than k.
+            np.ndarray: The matching scores.
+        """
+        profiles = model.normalize_rows(np.asarray(profiles, dtype=np.float32))
+        scores = np.asarray((self.normalized_genres @ profiles.T).T)
+        top_k, top_scores = model.top_k_rows(scores, num_recommendations, rated_matrix)
+
+        found = np.isfinite(top_scores)
+        return np.where(found, self.movie_ids[top_k], -1), np.where(found, top_scores, 0)
+
+def build_artifact(df_movies, vocabulary=None):
+    """
+    Builds a model artifact from the movies table. User profiles aren't part of it, they are kept up to
+    date by recommender.profile_store.ProfileStore.
+
+    Args:
+        df_movies (pd.Dataframe): Cleaned movie data.
+        vocabulary (list): Genre vocabulary of a previous artifact, so that its columns stay stable.
+
+    Returns:
+        ModelArtifact: The precomputed model state.
+    """
+    genre_encoding = pp.encode_genres(df_movies=df_movies, sparse=True, vocabulary=vocabulary)
+
+    return ModelArtifact(movie_ids=genre_encoding.movie_index.to_numpy(dtype=np.int64),
+                         titles=df_movies['title'].to_numpy(dtype=str),
+                         genres=np.asarray(genre_encoding.vocabulary, dtype=str),
+                         genre_matrix=genre_encoding.matrix.astype(np.float32),
+                         years=df_movies['normalized_year'].to_numpy(dtype=np.float32),
+                         built_at=time.time())
+
+def save_artifact(artifact, path):
+    """
+    Writes a model artifact to disk. The file is written next to its destination and then
+    moved into place so that readers never see a partially written artifact.
+
+    Args:
+        artifact (ModelArtifact): The artifact to save.
+        path (str): Destination .npz file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path,
+             version=np.int64(ARTIFACT_VERSION),
+             built_at=np.float64(artifact.built_at),
+             movie_ids=artifact.movie_ids,
+             titles=artifact.titles,
+             genres=artifact.genres,
+             genre_data=artifact.genre_matrix.data,
+             genre_indices=artifact.genre_matrix.indices,
+             genre_indptr=artifact.genre_matrix.indptr,
+             years=artifact.years)
+    os.replace(tmp_path, path)
+
+def load_artifact(path):
+    """
+    Loads a model artifact from disk.
+
+    Args:
+        path (str): The .npz file written by save_artifact.
+
+    Returns:
+        ModelArtifact: The precomputed model state.
+
+    Raises:
+        ValueError: If the artifact was written by an incompatible version.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        version = int(data['version'])
+        if version != ARTIFACT_VERSION:
+            raise ValueError(f"Model artifact version {version} is not supported (expected {ARTIFACT_VERSION}).")
+
+        return ModelArtifact(movie_ids=data['movie_ids'],
+                             titles=data['titles'],
+                             genres=data['genres'],
+                             genre_matrix=sparse.csr_matrix((data['genre_data'], data['genre_indices'], data['genre_indptr']),
+                                                            shape=(len(data['movie_ids']), len(data['genres']))),
+                             years=data['years'],
+                             built_at=float(data['built_at']))
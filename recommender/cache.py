@@ -0,0 +1,256 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+class CacheBackend(ABC):
+    """
+    Storage interface used by RecommendationCache. Backends store JSON-serializable values with an
+    optional expiry time, keep their entries in least-recently-used order and hold integer counters.
+    """
+
+    @abstractmethod
+    def get(self, key):
+        """Returns (value, expires_at) and marks the entry as recently used, or None if the key is missing."""
+
+    @abstractmethod
+    def set(self, key, value, expires_at=None):
+        """Stores a value. expires_at is a unix timestamp, or None for entries that never expire."""
+
+    @abstractmethod
+    def delete(self, key):
+        """Removes an entry if it exists."""
+
+    @abstractmethod
+    def evict(self, max_entries):
+        """Removes least-recently-used entries until at most max_entries remain and returns how many were removed."""
+
+    @abstractmethod
+    def counter(self, key):
+        """Returns the current value of a counter, 0 if it has never been incremented."""
+
+    @abstractmethod
+    def incr(self, key):
+        """Increments a counter and returns its new value."""
+
+    @abstractmethod
+    def __len__(self):
+        """Returns the number of entries."""
+
+class MemoryBackend(CacheBackend):
+    """
+    In-process backend. Entries are only shared between the threads of one worker.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at=None):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def evict(self, max_entries):
+        with self._lock:
+            evicted = 0
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+class SQLiteBackend(CacheBackend):
+    """
+    File-backed backend that several worker processes on the same machine can share. Placing the file
+    on a tmpfs such as /dev/shm keeps it in shared memory. Every thread opens its own connection, and so
+    does a forked worker, which must not use its parent's.
+
+    Args:
+        path (str): The SQLite file that holds the cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_last_used ON cache_entries (last_used);
+            CREATE TABLE IF NOT EXISTS cache_counters (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF") # losing the cache on a crash is harmless
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE cache_entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at=None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), expires_at, time.time())
+        )
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def evict(self, max_entries):
+        cur = self._conn().execute("""
+            DELETE FROM cache_entries WHERE key IN (
+                SELECT key FROM cache_entries ORDER BY last_used
+                LIMIT MAX((SELECT COUNT(*) FROM cache_entries) - ?, 0)
+            )
+        """, (max_entries,))
+        return cur.rowcount
+
+    def counter(self, key):
+        row = self._conn().execute("SELECT value FROM cache_counters WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key):
+        conn = self._conn()
+        conn.execute("""
+            INSERT INTO cache_counters (key, value) VALUES (?, 1)
+            ON CONFLICT(key) DO UPDATE SET value = value + 1
+        """, (key,))
+        return self.counter(key)
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+class RecommendationCache:
+    """
+    Bounded LRU cache of per-user recommendations with an optional TTL. Every user has a ratings version
+    counter that is part of the cache key, so bumping it when the user's ratings change makes the old
+    entry unreachable without having to find and delete it. get returns the version it looked up and set
+    stores under that version, so recommendations computed before an invalidation can't be cached under
+    the version that follows it.
+
+    Args:
+        backend (CacheBackend): Where entries are stored. Defaults to an in-process MemoryBackend.
+        max_entries (int): Maximum number of cached users before the least recently used are evicted.
+        ttl (float): Seconds an entry stays valid, or None for no expiry.
+    """
+
+    def __init__(self, backend=None, max_entries=10000, ttl=None):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._stats_lock = threading.Lock()
+
+    def _key(self, user_id):
+        return f"{user_id}:{self.backend.counter(f'version:{user_id}')}"
+
+    def _count(self, stat, amount=1):
+        with self._stats_lock:
+            setattr(self, stat, getattr(self, stat) + amount)
+
+    def get(self, user_id):
+        """
+        Returns the cached recommendations for a user along with the ratings version they were looked up
+        under, which is passed to set if they are missing.
+
+        Returns:
+            The cached recommendations, or None if they are missing, stale or expired.
+            int: The user's ratings version.
+        """
+        version = self.backend.counter(f'version:{user_id}')
+        key = f"{user_id}:{version}"
+        entry = self.backend.get(key)
+        if entry is None:
+            self._count('misses')
+            return None, version
+
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            self.backend.delete(key)
+            self._count('expirations')
+            self._count('misses')
+            return None, version
+
+        self._count('hits')
+        return value, version
+
+    def set(self, user_id, value, version):
+        """
+        Caches a user's recommendations under the ratings version that get returned before they were
+        computed. If the user's ratings changed since, the entry is never read and ages out.
+        """
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        self.backend.set(f"{user_id}:{version}", value, expires_at)
+        evicted = self.backend.evict(self.max_entries)
+        if evicted:
+            self._count('evictions', evicted)
+
+    def invalidate(self, user_id):
+        """
+        Bumps a user's ratings version so that their cached recommendations are no longer used.
+        """
+        self.backend.delete(self._key(user_id))
+        self.backend.incr(f'version:{user_id}')
+
+    def stats(self):
+        """
+        Returns the hit, miss, eviction and expiration counters of this process along with the cache size.
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'size': len(self.backend),
+                'max_entries': self.max_entries}
@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
 def recall_at_k(recommended_items, relevant_items):
     """
@@ -38,4 +39,147 @@ def average_recall_at_k(recommendations, ground_truth):
         if score is not None:
             recalls.append(score)
 
-    return np.mean(recalls) if recalls else 0.0
\ No newline at end of file
+    return np.mean(recalls) if recalls else 0.0
+
+def ground_truth_matrix(df_ratings, user_ids, movie_ids):
+    """
+    Builds a sparse users x items relevance matrix from withheld ratings. Withheld movies that aren't in
+    movie_ids get extra columns after the catalog, so they can never be hit but still count as relevant.
+
+    Args:
+        df_ratings (pd.Dataframe): The withheld (test) ratings.
+        user_ids (pd.Index): The userId of every row, in the same order as the recommendations.
+        movie_ids (pd.Index): The movieId of every catalog column.
+
+    Returns:
+        sparse.csr_matrix: A boolean matrix where entry (i, j) is True if item j is relevant to user i.
+    """
+    df_ratings = df_ratings[df_ratings['userId'].isin(user_ids)]
+    user_rows = user_ids.get_indexer(df_ratings['userId'])
+    columns = movie_ids.get_indexer(df_ratings['movieId'])
+
+    unknown = columns < 0
+    extra_columns, extra_ids = pd.factorize(df_ratings['movieId'].to_numpy()[unknown])
+    columns[unknown] = len(movie_ids) + extra_columns
+
+    matrix = sparse.csr_matrix((np.ones(len(columns), dtype=bool), (user_rows, columns)),
+                               shape=(len(user_ids), len(movie_ids) + len(extra_ids)))
+    matrix.sum_duplicates()
+    matrix.sort_indices()
+    return matrix
+
+def item_popularity(df_ratings, movie_ids):
+    """
+    Computes the share of users that rated each movie, which novelty is measured against.
+
+    Args:
+        df_ratings (pd.Dataframe): The training ratings.
+        movie_ids (pd.Index): The movieId of every catalog column.
+
+    Returns:
+        np.ndarray: The fraction of users that rated each movie.
+    """
+    columns = movie_ids.get_indexer(df_ratings['movieId'])
+    counts = np.bincount(columns[columns >= 0], minlength=len(movie_ids))
+    return counts / max(df_ratings['userId'].nunique(), 1)
+
+def _hits(recommendations, ground_truth):
+    # Every (row, column) pair is a single sortable key, so all lookups are one searchsorted over the relevant pairs
+    num_columns = ground_truth.shape[1]
+    relevant_keys = np.repeat(np.arange(ground_truth.shape[0], dtype=np.int64), np.diff(ground_truth.indptr)) * num_columns \
+                    + ground_truth.indices
+    keys = np.arange(len(recommendations), dtype=np.int64)[:, None] * num_columns + recommendations
+    positions = np.minimum(np.searchsorted(relevant_keys, keys), max(len(relevant_keys) - 1, 0))
+    found = relevant_keys[positions] == keys if len(relevant_keys) else np.zeros(keys.shape, dtype=bool)
+    return found & (recommendations >= 0)
+
+def _bootstrap(per_user, num_bootstrap, confidence, random_state, max_elements=10_000_000):
+    """
+    Poisson bootstrap of the mean of every column of per_user. Each resample weighs every user by a
+    Poisson(1) draw, which approximates resampling users with replacement and needs no index arrays.
+    """
+    rng = np.random.default_rng(random_state)
+    num_users = len(per_user)
+    chunk = max(1, max_elements // max(num_users, 1))
+
+    estimates = []
+    for start in range(0, num_bootstrap, chunk):
+        weights = rng.poisson(1.0, size=(min(chunk, num_bootstrap - start), num_users)).astype(np.float64)
+        estimates.append((weights @ per_user) / np.maximum(weights.sum(axis=1), 1)[:, None])
+    estimates = np.concatenate(estimates)
+
+    alpha = (1 - confidence) / 2
+    return np.quantile(estimates, alpha, axis=0), np.quantile(estimates, 1 - alpha, axis=0)
+
+def evaluate(recommendations, ground_truth, ks=(5, 10, 20), item_popularity=None, num_bootstrap=0,
+             confidence=0.95, random_state=24):
+    """
+    Computes Recall@k, Precision@k, NDCG@k, MAP@k, hit rate, catalog coverage and novelty for several k
+    in one vectorized pass. Users without relevant items are skipped, like in average_recall_at_k.
+
+    Args:
+        recommendations (np.ndarray): Catalog column positions of every user's recommendations, best first
+            (users x k). Rows padded with -1 are shorter lists.
+        ground_truth (sparse.csr_matrix): Relevant items per user (users x items), as built by ground_truth_matrix.
+        ks (tuple): Cutoffs to report. Cutoffs larger than the number of recommendations are clipped to it.
+        item_popularity (np.ndarray): Share of users that rated each catalog movie. Novelty is only reported if given.
+        num_bootstrap (int): Number of bootstrap resamples of the users. No confidence intervals if 0.
+        confidence (float): Confidence level of the intervals.
+        random_state (int): Acts as a seed for the pseudo-random number generator.
+
+    Returns:
+        pd.Dataframe: One row per metric and k, with the value and, if bootstrapped, the interval bounds.
+    """
+    recommendations = np.asarray(recommendations, dtype=np.int64)
+    num_relevant = np.diff(ground_truth.indptr)
+    users = num_relevant > 0
+    recommendations, num_relevant = recommendations[users], num_relevant[users]
+    ground_truth = ground_truth[users]
+    ground_truth.sort_indices()
+    hits = _hits(recommendations, ground_truth)
+
+    num_catalog = len(item_popularity) if item_popularity is not None else ground_truth.shape[1]
+    if item_popularity is not None:
+        # Movies nobody rated are treated like the rarest rated movie rather than infinitely novel
+        rated = item_popularity[item_popularity > 0]
+        self_information = -np.log2(np.maximum(item_popularity, rated.min() if len(rated) else 1.0))
+    discounts = 1 / np.log2(np.arange(2, recommendations.shape[1] + 2))
+    ideal_dcg = np.cumsum(discounts)
+
+    rows, per_user_columns = [], []
+    for k in sorted({min(k, recommendations.shape[1]) for k in ks} - {0}):
+        top_hits = hits[:, :k]
+        num_hits = top_hits.sum(axis=1)
+        num_recommended = (recommendations[:, :k] >= 0).sum(axis=1)
+
+        per_user = {
+            'recall': num_hits / num_relevant,
+            'precision': num_hits / k,
+            'ndcg': (top_hits @ discounts[:k]) / ideal_dcg[np.minimum(num_relevant, k) - 1],
+            'map': (np.cumsum(top_hits, axis=1) / np.arange(1, k + 1) * top_hits).sum(axis=1) / np.minimum(num_relevant, k),
+            'hit_rate': (num_hits > 0).astype(np.float64),
+        }
+        if item_popularity is not None:
+            recommended = recommendations[:, :k]
+            information = np.where(recommended >= 0, self_information[np.maximum(recommended, 0)], 0).sum(axis=1)
+            per_user['novelty'] = information / np.maximum(num_recommended, 1)
+
+        for metric, values in per_user.items():
+            rows.append({'metric': metric, 'k': k, 'value': values.mean() if len(values) else 0.0})
+            per_user_columns.append(values)
+
+        recommended = recommendations[:, :k]
+        rows.append({'metric': 'coverage', 'k': k,
+                     'value': len(np.unique(recommended[recommended >= 0])) / max(num_catalog, 1)})
+        per_user_columns.append(None)
+
+    results = pd.DataFrame(rows)
+    if num_bootstrap and len(num_relevant):
+        bootstrapped = [i for i, values in enumerate(per_user_columns) if values is not None]
+        low, high = _bootstrap(np.column_stack([per_user_columns[i] for i in bootstrapped]),
+                               num_bootstrap, confidence, random_state)
+        results['ci_low'] = np.nan
+        results['ci_high'] = np.nan
+        results.loc[bootstrapped, 'ci_low'] = low
+        results.loc[bootstrapped, 'ci_high'] = high
+    return results
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from scipy import sparse
+import recommender.model as model
+
+# Row i holds the top-N neighbours of movie movie_ids[i] and their similarities (movies x movies)
+ItemNeighbours = namedtuple('ItemNeighbours', ['matrix', 'movie_ids'])
+
+def build_rating_matrix(df_ratings, movie_ids):
+    """
+    Builds the sparse users x movies rating matrix.
+
+    Args:
+        df_ratings (pd.Dataframe): Users' movie rating data.
+        movie_ids (pd.Index): The movieId of every column. Ratings of other movies are dropped.
+
+    Returns:
+        sparse.csr_matrix: The ratings (users x movies).
+        pd.Index: The userId of every row, in order of first appearance in df_ratings.
+    """
+    user_ids = pd.Index(df_ratings['userId'].unique())
+    user_rows = user_ids.get_indexer(df_ratings['userId'])
+    movie_columns = movie_ids.get_indexer(df_ratings['movieId'])
+    known = movie_columns >= 0
+
+    rating_matrix = sparse.csr_matrix((df_ratings['rating'].to_numpy(dtype=np.float32)[known],
+                                       (user_rows[known], movie_columns[known])),
+                                      shape=(len(user_ids), len(movie_ids)))
+    return rating_matrix, user_ids
+
+def center_ratings(rating_matrix):
+    """
+    Subtracts every user's mean rating from their ratings, which turns cosine similarity between movie
+    columns into adjusted cosine similarity. Only stored ratings are centered, the matrix stays sparse.
+
+    Args:
+        rating_matrix (sparse.csr_matrix): The ratings (users x movies).
+
+    Returns:
+        sparse.csr_matrix: The centered ratings, with the same sparsity structure.
+    """
+    rating_matrix = sparse.csr_matrix(rating_matrix, dtype=np.float32, copy=True)
+    counts = np.diff(rating_matrix.indptr)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.asarray(rating_matrix.sum(axis=1)).ravel() / counts
+    rating_matrix.data -= np.repeat(np.nan_to_num(means), counts).astype(np.float32)
+    return rating_matrix
+
+def compute_item_neighbours(df_ratings, movie_ids, num_neighbours=50, block_size=256):
+    """
+    Computes the adjusted cosine similarity of every pair of movies and keeps the num_neighbours most
+    similar movies of each one. Similarities are computed for block_size movies at a time as a sparse
+    product, so memory is O(block_size x movies) instead of O(movies x movies). Only positive similarities
+    are kept.
+
+    Args:
+        df_ratings (pd.Dataframe): The training ratings.
+        movie_ids (array-like): The movies that can be recommended.
+        num_neighbours (int): Number of neighbours kept per movie.
+        block_size (int): Number of movies whose similarities are computed together.
+
+    Returns:
+        ItemNeighbours: The sparse neighbour matrix (movies x movies) and its movieIds.
+    """
+    movie_ids = movie_ids if isinstance(movie_ids, pd.Index) else pd.Index(movie_ids)
+    rating_matrix, _ = build_rating_matrix(df_ratings, movie_ids)
+
+    # Normalizing the columns of the centered matrix makes each block of similarities a single product
+    centered = center_ratings(rating_matrix).tocsc()
+    norms = np.sqrt(np.asarray(centered.multiply(centered).sum(axis=0)).ravel())
+    norms[norms == 0] = 1
+    normalized = (centered @ sparse.diags(1 / norms).astype(np.float32)).tocsc()
+    normalized_t = normalized.T.tocsr()
+
+    num_movies = len(movie_ids)
+    num_neighbours = min(num_neighbours, max(num_movies - 1, 0))
+    rows, columns, similarities = [], [], []
+    for start in range(0, num_movies, block_size):
+        end = min(start + block_size, num_movies)
+        block = (normalized_t[start:end] @ normalized).toarray()
+        block[np.arange(end - start), np.arange(start, end)] = 0 # a movie isn't its own neighbour
+        if num_neighbours == 0:
+            continue
+
+        top = np.argpartition(-block, num_neighbours - 1, axis=1)[:, :num_neighbours]
+        top_similarities = np.take_along_axis(block, top, axis=1)
+        positive = top_similarities > 0
+        rows.append(np.repeat(np.arange(start, end), positive.sum(axis=1)))
+        columns.append(top[positive])
+        similarities.append(top_similarities[positive])
+
+    if rows:
+        rows, columns, similarities = np.concatenate(rows), np.concatenate(columns), np.concatenate(similarities)
+    matrix = sparse.csr_matrix((np.asarray(similarities, dtype=np.float32), (np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64))),
+                               shape=(num_movies, num_movies))
+    return ItemNeighbours(matrix=matrix, movie_ids=movie_ids)
+
+def score_users(neighbours, rating_matrix):
+    """
+    Scores every movie for a batch of users as the product of their centered ratings and the neighbour
+    matrix: a movie scores highly when it is a close neighbour of movies the user rated above their average,
+    and low when it is a close neighbour of movies they rated below it.
+
+    Args:
+        neighbours (ItemNeighbours): The output of compute_item_neighbours.
+        rating_matrix (sparse.csr_matrix): The users' ratings (users x movies), aligned with neighbours.movie_ids.
+
+    Returns:
+        np.ndarray: The scores (users x movies). Movies that aren't a neighbour of any rated movie get -inf.
+    """
+    rating_matrix = sparse.csr_matrix(rating_matrix, dtype=np.float32)
+    centered = center_ratings(rating_matrix)
+
+    # A user who gave every movie the same rating has nothing above their average, so all of their movies count
+    flat = np.asarray(abs(centered).max(axis=1).todense()).ravel() == 0
+    if flat.any():
+        flat_entries = np.repeat(flat, np.diff(centered.indptr))
+        centered.data[flat_entries] = rating_matrix.data[flat_entries]
+
+    product = (centered @ neighbours.matrix).tocoo()
+    scores = np.full(product.shape, -np.inf, dtype=np.float32)
+    scores[product.row, product.col] = product.data
+    return scores
+
+def top_k_movies(neighbours, df_ratings, num_recommendations=10, batch_size=1024):
+    """
+    Computes the top-k movies of every user in df_ratings, in the same format as model.top_k_movies so
+    that both models can be passed to evaluation.evaluate.
+
+    Args:
+        neighbours (ItemNeighbours): The output of compute_item_neighbours.
+        df_ratings (pd.Dataframe): The training ratings, which are also excluded from recommendations.
+        num_recommendations (int): Number of recommendations per user.
+        batch_size (int): Number of users scored together.
+
+    Returns:
+        pd.Index: The userId of every row.
+        np.ndarray: Column positions in movie_ids of every user's recommendations, best first (users x k).
+            Rows are padded with -1 when fewer than k unrated movies are neighbours of the user's movies.
+        pd.Index: The movieId of every column position.
+    """
+    rating_matrix, user_ids = build_rating_matrix(df_ratings, neighbours.movie_ids)
+    rated_matrix = rating_matrix.astype(bool)
+
+    recommendations = np.full((len(user_ids), min(num_recommendations, len(neighbours.movie_ids))), -1, dtype=np.int64)
+    for start in range(0, len(user_ids), batch_size):
+        end = start + batch_size
+        scores = score_users(neighbours, rating_matrix[start:end])
+        top_k, top_scores = model.top_k_rows(scores, num_recommendations, rated_matrix[start:end])
+        recommendations[start:end] = np.where(np.isfinite(top_scores), top_k, -1)
+
+    return user_ids, recommendations, neighbours.movie_ids
+
+def recommend_movies(user_id, neighbours, df_ratings, df_movies, num_recommendations=10):
+    """
+    Provides the top-k recommended movies for a given user, like model.recommend_movies.
+
+    Args:
+        user_id (int): The user's id that the recommendations are for.
+        neighbours (ItemNeighbours): The output of compute_item_neighbours.
+        df_ratings (pd.Dataframe): Users' movie rating data.
+        df_movies (pd.Dataframe): Movie data.
+        num_recommendations (int): the number of recommendations the function should output.
+
+    Returns:
+        pd.Dataframe: The top-k recommended movies for the user, along with their scores.
+    """
+    rating_matrix, _ = build_rating_matrix(df_ratings[df_ratings['userId'] == user_id], neighbours.movie_ids)
+    if rating_matrix.shape[0] == 0:
+        return pd.DataFrame({'movieId': neighbours.movie_ids[:0], 'title': [], 'score': []})
+
+    scores = score_users(neighbours, rating_matrix)
+    top_k, top_scores = model.top_k_rows(scores, num_recommendations, rating_matrix.astype(bool))
+    found = np.isfinite(top_scores[0])
+    top_k = pd.DataFrame({'movieId': neighbours.movie_ids[top_k[0][found]], 'score': top_scores[0][found]})
+
+    return df_movies[['movieId', 'title']].merge(top_k, on='movieId').sort_values(by='score', ascending=False)
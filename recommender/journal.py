@@ -0,0 +1,213 @@
+import os
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError: # Windows, where a journal must only be used by one process
+    fcntl = None
+
+@contextmanager
+def file_lock(path, exclusive=False):
+    """
+    Holds an advisory lock on a lock file, which processes that share a file take around reading and
+    writing it. Without fcntl, e.g. on Windows, nothing is locked.
+
+    Args:
+        path (str): The lock file, created if it doesn't exist.
+        exclusive (bool): Take the lock exclusively.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd) # closing the file releases the lock
+
+class Journal:
+    """
+    Append-only file of update lines that several processes share, such as the workers of the app. Every
+    process appends its own updates and reads the lines that were appended since its last read, so state
+    that is built from the lines converges across processes.
+
+    compact folds the lines into a snapshot and replaces the file with an empty one, so the journal doesn't
+    grow without bound. Appends and compaction exclude each other through a lock file, and a process that
+    still has lines of the replaced file to read finishes it before it moves on to the new one, so no line
+    is lost or read twice. The new file starts with a header naming the file it replaced; a process that
+    fell more than one compaction behind can't follow the chain, and read raises so that it reloads the
+    snapshot instead. A position is the (device, inode) of the file and an offset in it.
+
+    Args:
+        path (str): The journal file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._fd = None
+        self._file_id = None
+        self.offset = 0
+
+    @staticmethod
+    def _id(stat):
+        return stat.st_dev, stat.st_ino
+
+    @contextmanager
+    def lock(self, exclusive=False):
+        """
+        Holds the journal's lock file, shared by readers of a snapshot and appenders or exclusively by compact.
+
+        Args:
+            exclusive (bool): Take the lock exclusively.
+        """
+        with file_lock(self.lock_path, exclusive=exclusive):
+            yield
+
+    def _open_file(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_RDONLY | os.O_CREAT, 0o644)
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd, self._file_id = fd, self._id(os.fstat(fd))
+
+    def open(self, position=None):
+        """
+        Starts reading the journal at a position, creating the journal if it doesn't exist.
+
+        Args:
+            position (tuple): A position returned by position(), or None for the start of the journal.
+
+        Raises:
+            ValueError: If the journal was replaced or truncated since the position was taken.
+        """
+        self._open_file()
+        self.offset = 0
+        if position is not None:
+            file_id, offset = position
+            if tuple(file_id) != self._file_id or offset > os.fstat(self._fd).st_size:
+                raise ValueError("The journal was replaced since this position was taken.")
+            self.offset = offset
+
+    def seek_end(self):
+        """
+        Starts reading the journal at its current end, creating the journal if it doesn't exist.
+
+        Returns:
+            tuple: The position of the end.
+        """
+        self._open_file()
+        self.offset = os.fstat(self._fd).st_size
+        return self.position()
+
+    def position(self):
+        """Returns the position of the next line to read."""
+        return self._file_id, self.offset
+
+    def size(self):
+        """Returns the size in bytes of the journal file, 0 if it doesn't exist."""
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def append(self, lines):
+        """
+        Appends lines with a single O_APPEND write, which keeps lines of concurrent processes intact.
+
+        Args:
+            lines (list): The lines to append, without newlines.
+        """
+        data = ''.join(line + '\n' for line in lines).encode()
+        with self.lock():
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+    def _replaced(self):
+        try:
+            return self._id(os.stat(self.path)) != self._file_id
+        except FileNotFoundError:
+            return False
+
+    def _read_to_end(self):
+        size = os.fstat(self._fd).st_size
+        if size <= self.offset:
+            return []
+        # pread leaves the file offset alone, which a forked process shares with its parent
+        data = os.pread(self._fd, size - self.offset, self.offset)
+        end = data.rfind(b'\n') + 1 # a line without its newline is still being written
+        self.offset += end
+        return [line for line in data[:end].decode().splitlines() if not line.startswith('#')]
+
+    def _header(self):
+        # The file id that compact wrote into the first line, or None for a journal without one
+        line = os.pread(self._fd, 256, 0).split(b'\n', 1)[0].decode().split()
+        if len(line) != 3 or line[0] != '#replaces':
+            return None
+        return int(line[1]), int(line[2])
+
+    def read(self):
+        """
+        Returns the complete lines that were appended since the last read, opening the journal at its start
+        if it isn't open yet.
+
+        Returns:
+            list: The lines, without newlines.
+
+        Raises:
+            ValueError: If the journal was compacted more than once since the last read, so that lines were
+                missed. The state must be reloaded from the snapshot.
+        """
+        if self._fd is None:
+            self.open()
+        lines = []
+        while True:
+            # A replaced file is complete, since compact holds the lock that appends take, so it is read
+            # to its end before moving on to the new file
+            replaced = self._replaced()
+            lines += self._read_to_end()
+            if not replaced:
+                return lines
+            previous = self._file_id
+            self._open_file()
+            self.offset = 0
+            if self._header() != previous:
+                raise ValueError("The journal was compacted more than once since it was last read.")
+
+    def compact(self, save, min_size=0):
+        """
+        Replaces the journal with an empty one under the exclusive lock. save is called with the lines that
+        haven't been read yet and the position of the new, empty journal, and must write a snapshot that
+        includes every line before it returns. The old journal is only replaced once it has.
+
+        Args:
+            save (callable): Takes the unread lines and the position of the new journal.
+            min_size (int): Leave the journal alone if it is smaller than this many bytes.
+
+        Returns:
+            bool: Whether the journal was compacted.
+        """
+        with self.lock(exclusive=True):
+            if self.size() < min_size:
+                return False
+            lines = self.read()
+            tmp_path = f"{self.path}.tmp{os.getpid()}"
+            fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                file_id = self._id(os.fstat(fd))
+                header = f"#replaces {self._file_id[0]} {self._file_id[1]}\n".encode()
+                os.write(fd, header)
+                save(lines, (file_id, len(header)))
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.close(fd)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            os.close(self._fd)
+            self._fd, self._file_id, self.offset = fd, file_id, len(header)
+        return True
@@ -1,6 +1,23 @@
 import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+import recommender.preprocessing as pp
+
+def unpack_genres(df_genres):
+    """
+    Gives uniform access to either genre encoding returned by pp.encode_genres.
+    
+    Args:
+        df_genres (pd.Dataframe or pp.GenreEncoding): Multi-hot encoded genre data.
+    
+    Returns:
+        np.ndarray or sparse.csr_matrix: The movies x genres matrix.
+        pd.Index: The movieId of every row.
+        np.ndarray: The genre of every column.
+    """
+    if isinstance(df_genres, pp.GenreEncoding):
+        return df_genres.matrix, df_genres.movie_index, np.array(df_genres.vocabulary)
+    return df_genres.to_numpy(), df_genres.index, np.array(df_genres.columns.tolist())
 
 def create_user_profiles(df_ratings, df_movies, df_genres):
     """
@@ -24,19 +41,60 @@ def create_user_profiles(df_ratings, df_movies, df_genres):
     user_profiles = pd.DataFrame(user_profiles.tolist(), index=user_profiles.index, columns=np.array(df_genres.columns.tolist()))
     return user_profiles.fillna(0) # assume preference for a genre is 0 if the user hasn't rated a movie in said genre
 
+def create_user_profiles_sparse(df_ratings, df_movies, df_genres):
+    """
+    Vectorized version of create_user_profiles. The rating-weighted genre averages are computed as a
+    single sparse matrix product (users x movies ratings times movies x genres) divided by each user's
+    rating total, instead of a Python-level average per user.
+    
+    Args:
+        df_ratings (pd.Dataframe): The user ratings that are going to be used to create the user profiles.
+        df_movies (pd.Dataframe): Movie data.
+        df_genres (pd.Dataframe or pp.GenreEncoding): Multi-hot encoded genre data.
+    
+    Returns:
+        pd.Dataframe: The user profiles, identical to the output of create_user_profiles.
+    """
+
+    genre_matrix, movie_index, genres = unpack_genres(df_genres)
+
+    # Only ratings of known movies are used, like the inner merge in create_user_profiles
+    df_ratings = df_ratings[df_ratings['movieId'].isin(df_movies['movieId'])]
+    movie_rows = movie_index.get_indexer(df_ratings['movieId'])
+    known = movie_rows >= 0
+    df_ratings = df_ratings[known]
+    movie_rows = movie_rows[known]
+
+    user_rows, user_ids = pd.factorize(df_ratings['userId'], sort=True)
+    rating_matrix = sparse.csr_matrix((df_ratings['rating'].to_numpy(dtype=np.float64), (user_rows, movie_rows)),
+                                      shape=(len(user_ids), len(movie_index)))
+
+    weighted_sums = rating_matrix @ genre_matrix.astype(np.float64)
+    if sparse.issparse(weighted_sums):
+        weighted_sums = weighted_sums.toarray()
+    weight_totals = np.asarray(rating_matrix.sum(axis=1))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profiles = weighted_sums / weight_totals
+
+    user_profiles = pd.DataFrame(profiles, index=pd.Index(user_ids, name='userId'), columns=genres)
+    return user_profiles.fillna(0) # assume preference for a genre is 0 if the user hasn't rated a movie in said genre
+
 def compute_similarity_matrix(user_profiles, df_genres):
     """
     Computes a similarity matrix
     
     Args:
         user_profiles (pd.Dataframe): User profiles.
-        df_genres (pd.Dataframe): A dataframe with multi-hot encoded genre data.
+        df_genres (pd.Dataframe or pp.GenreEncoding): Multi-hot encoded genre data.
         
     Returns:
         pd.Dataframe: A similarity matrix"""
     
-    similarity_matrix = cosine_similarity(user_profiles.values, df_genres.values)
-    return pd.DataFrame(similarity_matrix, index=user_profiles.index, columns=df_genres.index)
+    from sklearn.metrics.pairwise import cosine_similarity # imported here, sklearn takes about a second to import
+    genre_matrix, movie_index, _ = unpack_genres(df_genres)
+    similarity_matrix = cosine_similarity(user_profiles.values, genre_matrix)
+    return pd.DataFrame(similarity_matrix, index=user_profiles.index, columns=movie_index)
 
 def recommend_movies(user_id, df_user_movie_similarities, df_ratings, df_movies, num_recommendations=10):
     """
@@ -66,7 +124,150 @@ def recommend_movies(user_id, df_user_movie_similarities, df_ratings, df_movies,
 
     return df_movies[['movieId', 'title']].merge(top_k, on='movieId').sort_values(by='score', ascending=False)
 
-def recommend_movies_all_users(user_movie_similarities, df_ratings, df_movies, num_recommendations=10):
+def normalize_rows(features):
+    """
+    L2-normalizes the rows of a feature matrix so that cosine similarity becomes a dot product.
+
+    Args:
+        features (np.ndarray or sparse.csr_matrix): A movie feature matrix (movies x features).
+
+    Returns:
+        np.ndarray or sparse.csr_matrix: The row-normalized feature matrix. All-zero rows are left as zeros.
+    """
+    if sparse.issparse(features):
+        features = sparse.csr_matrix(features, dtype=np.float32)
+        norms = np.sqrt(np.asarray(features.multiply(features).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return (sparse.diags(1 / norms).astype(np.float32) @ features).tocsr()
+
+    features = np.asarray(features, dtype=np.float32)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return features / norms
+
+def recommend_for_profile(profile_vector, normalized_features, movie_ids, exclude_ids=None, k=10):
+    """
+    Provides the top-k recommended movies for a single user profile without building a similarity matrix.
+
+    Args:
+        profile_vector (np.ndarray): The user's profile (features,).
+        normalized_features (np.ndarray or sparse.csr_matrix): Row-normalized movie features (movies x features), see normalize_rows.
+        movie_ids (pd.Index or np.ndarray): The movieId of every row in normalized_features.
+        exclude_ids (array-like): movieIds that should not be recommended, such as the movies the user has rated.
+        k (int): The number of recommendations the function should output.
+
+    Returns:
+        pd.Dataframe: The top-k movieIds along with their cosine similarity scores, best first.
+    """
+    movie_ids = movie_ids if isinstance(movie_ids, pd.Index) else pd.Index(movie_ids)
+    profile_vector = np.asarray(profile_vector, dtype=np.float32)
+    norm = np.linalg.norm(profile_vector)
+
+    # One matrix-vector product, so memory is O(movies)
+    scores = normalized_features @ (profile_vector / norm if norm else profile_vector)
+
+    if exclude_ids is not None and len(exclude_ids):
+        excluded = movie_ids.get_indexer(np.asarray(exclude_ids))
+        scores[excluded[excluded >= 0]] = -np.inf
+
+    k = min(k, len(scores))
+    if k <= 0:
+        return pd.DataFrame({'movieId': movie_ids[:0], 'score': scores[:0]})
+    top_k = np.argpartition(-scores, k - 1)[:k]
+    top_k = top_k[np.argsort(-scores[top_k], kind='stable')]
+    top_k = top_k[np.isfinite(scores[top_k])]
+
+    return pd.DataFrame({'movieId': movie_ids[top_k], 'score': scores[top_k]})
+
+def build_rated_matrix(df_ratings, user_ids, movie_ids):
+    """
+    Builds a sparse users x movies matrix marking the movies each user has rated.
+
+    Args:
+        df_ratings (pd.Dataframe): Users' movie rating data.
+        user_ids (pd.Index): The userId of every row.
+        movie_ids (pd.Index): The movieId of every column.
+
+    Returns:
+        sparse.csr_matrix: A boolean matrix where entry (i, j) is True if user i has rated movie j.
+    """
+    user_rows = user_ids.get_indexer(df_ratings['userId'])
+    movie_columns = movie_ids.get_indexer(df_ratings['movieId'])
+    known = (user_rows >= 0) & (movie_columns >= 0)
+
+    rated_matrix = sparse.csr_matrix((np.ones(known.sum(), dtype=bool), (user_rows[known], movie_columns[known])),
+                                     shape=(len(user_ids), len(movie_ids)))
+    rated_matrix.sum_duplicates()
+    return rated_matrix
+
+def top_k_rows(scores, k, rated_matrix=None):
+    """
+    Finds the top-k columns of every row of a score matrix, in place of a full sort.
+
+    Args:
+        scores (np.ndarray): A users x movies score matrix. Rated entries are overwritten with -inf.
+        k (int): Number of columns to keep per row.
+        rated_matrix (sparse.csr_matrix): Entries that must be excluded, aligned with scores.
+
+    Returns:
+        np.ndarray: The column indices of the top-k scores per row, best first (users x k).
+        np.ndarray: The matching scores. Excluded entries have a score of -inf.
+    """
+    if rated_matrix is not None:
+        rated = rated_matrix.tocoo()
+        scores[rated.row, rated.col] = -np.inf
+
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((len(scores), 0), dtype=np.int64), np.empty((len(scores), 0), dtype=scores.dtype)
+    top_k = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top_k, axis=1)
+
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top_k, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+def _top_k_to_dict(user_ids, top_k, top_scores, movie_ids):
+    movie_ids = movie_ids.to_numpy()
+    return {user_id: movie_ids[columns[np.isfinite(row_scores)]].tolist()
+            for user_id, columns, row_scores in zip(user_ids, top_k, top_scores)}
+
+def top_k_movies(user_profiles, df_genres, df_ratings, num_recommendations=10, batch_size=1024):
+    """
+    Computes the top-k movies of every user as a users x k array, without materializing the full
+    user-movie similarity matrix. Users are scored in batches of batch_size, rated movies are masked
+    through a sparse matrix and the top-k is selected with np.argpartition.
+
+    Args:
+        user_profiles (pd.Dataframe): User profiles.
+        df_genres (pd.Dataframe or pp.GenreEncoding): Multi-hot encoded genre data.
+        df_ratings (pd.Dataframe): The training ratings that will be excluded from recommendations.
+        num_recommendations (int): Number of recommendations per user.
+        batch_size (int): Number of users scored together.
+
+    Returns:
+        pd.Index: The userId of every row.
+        np.ndarray: Column positions in movie_ids of every user's recommendations, best first (users x k).
+            Rows are padded with -1 when a user has fewer than k unrated movies.
+        pd.Index: The movieId of every column position.
+    """
+    genre_matrix, movie_ids, _ = unpack_genres(df_genres)
+    normalized_genres = normalize_rows(genre_matrix)
+
+    user_ids = pd.Index(df_ratings['userId'].unique())
+    user_ids = user_ids[user_ids.isin(user_profiles.index)]
+    profiles = normalize_rows(user_profiles.loc[user_ids].to_numpy())
+    rated_matrix = build_rated_matrix(df_ratings, user_ids, movie_ids)
+
+    recommendations = np.full((len(user_ids), min(num_recommendations, len(movie_ids))), -1, dtype=np.int64)
+    for start in range(0, len(user_ids), batch_size):
+        end = start + batch_size
+        scores = np.asarray((normalized_genres @ profiles[start:end].T).T)
+        top_k, top_scores = top_k_rows(scores, num_recommendations, rated_matrix[start:end])
+        recommendations[start:end] = np.where(np.isfinite(top_scores), top_k, -1)
+
+    return user_ids, recommendations, movie_ids
+
+def recommend_movies_all_users(user_movie_similarities, df_ratings, df_movies, num_recommendations=10, batch_size=1024):
     """
     Returns a dictionary of top-k movie IDs per user for every user.
 
@@ -75,14 +276,31 @@ def recommend_movies_all_users(user_movie_similarities, df_ratings, df_movies, n
         df_ratings (pd.Dataframe): The training ratings that will be excluded from recommendations.
         df_movies (pd.Dataframe): Movie data.
         num_recommendations (int): Number of recommendations per user.
+        batch_size (int): Number of users whose similarity rows are processed together.
     
     Returns:
         pd.Dataframe: All of the top-k recommended movies for each user.
     """
 
+    similarities = user_movie_similarities.to_numpy()
+
+    # Only movies that are in df_movies can be recommended, like the merge in recommend_movies
+    movie_columns = np.flatnonzero(user_movie_similarities.columns.isin(df_movies['movieId']))
+    movie_ids = user_movie_similarities.columns[movie_columns]
+
+    user_ids = pd.Index(df_ratings['userId'].unique())
+    user_rows = user_movie_similarities.index.get_indexer(user_ids)
+    if (user_rows < 0).any():
+        raise KeyError(f"Users missing from the similarity matrix: {user_ids[user_rows < 0].tolist()}")
+    rated_matrix = build_rated_matrix(df_ratings, user_ids, movie_ids)
+
     all_recommendations = {}
-    for user_id in df_ratings['userId'].unique():
-        recommendations = recommend_movies(user_id=user_id, df_user_movie_similarities=user_movie_similarities, df_ratings=df_ratings, df_movies=df_movies, num_recommendations=num_recommendations)
-        all_recommendations[user_id] = recommendations['movieId'].tolist()
+    for start in range(0, len(user_ids), batch_size):
+        end = start + batch_size
+        scores = similarities[user_rows[start:end]]
+        if len(movie_columns) < similarities.shape[1]:
+            scores = scores[:, movie_columns]
+        top_k, top_scores = top_k_rows(scores, num_recommendations, rated_matrix[start:end])
+        all_recommendations.update(_top_k_to_dict(user_ids[start:end], top_k, top_scores, movie_ids))
 
     return all_recommendations
@@ -0,0 +1,108 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import recommender.model as model
+
+# Set in each worker process by _attach_movie_features
+_worker_shm = None
+_worker_movie_features = None
+
+def _attach_movie_features(shm_name, shape, dtype):
+    """
+    Process pool initializer. Maps the shared movie feature matrix into the worker instead of
+    receiving a pickled copy, and limits BLAS to one thread so the workers don't oversubscribe the cores.
+    """
+    global _worker_shm, _worker_movie_features
+
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_movie_features = np.ndarray(shape, dtype=dtype, buffer=_worker_shm.buf)
+
+def _recall_shard(profiles, rated_matrix, relevant_items, num_recommendations, batch_size):
+    """
+    Scores one shard of users against the shared movie features and returns its partial Recall@k sums.
+
+    Returns:
+        float: The sum of Recall@k over the users with relevant items.
+        int: The number of users that were scored.
+    """
+    recall_sum, num_users = 0.0, 0
+    for start in range(0, len(profiles), batch_size):
+        end = start + batch_size
+        scores = profiles[start:end] @ _worker_movie_features.T
+        top_k, top_scores = model.top_k_rows(scores, num_recommendations, rated_matrix[start:end])
+
+        for columns, row_scores, (relevant, num_relevant) in zip(top_k, top_scores, relevant_items[start:end]):
+            if not num_relevant:
+                continue
+            hits = np.isin(columns[np.isfinite(row_scores)], relevant).sum()
+            recall_sum += hits / num_relevant
+            num_users += 1
+
+    return recall_sum, num_users
+
+def parallel_average_recall_at_k(user_profiles, df_genres, df_ratings, ground_truth, num_recommendations=10, num_workers=None, num_shards=None, batch_size=1024):
+    """
+    Computes the same average Recall@k as evaluation.average_recall_at_k over model.top_k_movies, but splits
+    the users into shards that are scored in a process pool. The normalized movie feature matrix is placed
+    in shared memory once and mapped by every worker, and each shard only returns its partial sums.
+
+    Args:
+        user_profiles (pd.Dataframe): User profiles.
+        df_genres (pd.Dataframe or pp.GenreEncoding): Multi-hot encoded genre data.
+        df_ratings (pd.Dataframe): The training ratings that will be excluded from recommendations.
+        ground_truth (dict): A mapping of userIds to withheld movieIds.
+        num_recommendations (int): Number of recommendations per user.
+        num_workers (int): Number of worker processes. Defaults to the number of CPUs.
+        num_shards (int): Number of user shards. Defaults to four per worker to even out stragglers.
+        batch_size (int): Number of users scored together inside a shard.
+
+    Returns:
+        float: The average Recall@k value over all users with withheld movies.
+    """
+    num_workers = num_workers or os.cpu_count()
+    num_shards = num_shards or num_workers * 4
+
+    genre_matrix, movie_ids, _ = model.unpack_genres(df_genres)
+    normalized_genres = model.normalize_rows(genre_matrix)
+    if not isinstance(normalized_genres, np.ndarray):
+        normalized_genres = normalized_genres.toarray()
+
+    user_ids = pd.Index(df_ratings['userId'].unique())
+    user_ids = user_ids[user_ids.isin(user_profiles.index)]
+    profiles = model.normalize_rows(user_profiles.loc[user_ids].to_numpy())
+    rated_matrix = model.build_rated_matrix(df_ratings, user_ids, movie_ids)
+
+    # Relevant items are translated to column positions so that workers never need the movieIds. The number of
+    # relevant items is kept separately because withheld movies outside of the catalog still count towards recall.
+    relevant_items = []
+    for user_id in user_ids:
+        relevant = ground_truth.get(user_id, set())
+        columns = movie_ids.get_indexer(list(relevant))
+        relevant_items.append((columns[columns >= 0], len(relevant)))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(normalized_genres.nbytes, 1))
+    try:
+        shared_features = np.ndarray(normalized_genres.shape, dtype=normalized_genres.dtype, buffer=shm.buf)
+        shared_features[:] = normalized_genres
+        del shared_features # the segment can't be closed while an array still points into it
+
+        bounds = np.linspace(0, len(user_ids), num_shards + 1, dtype=int)
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 initializer=_attach_movie_features,
+                                 initargs=(shm.name, normalized_genres.shape, normalized_genres.dtype)) as executor:
+            futures = [executor.submit(_recall_shard, profiles[start:end], rated_matrix[start:end],
+                                       relevant_items[start:end], num_recommendations, batch_size)
+                       for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+            partial_sums = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    recall_sum = sum(partial_sum for partial_sum, _ in partial_sums)
+    num_users = sum(count for _, count in partial_sums)
+    return recall_sum / num_users if num_users else 0.0
@@ -0,0 +1,454 @@
+import os
+import threading
+import time
+from contextlib import nullcontext
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from recommender.journal import Journal
+
+POPULARITY_VERSION = 2
+WINDOWS = ('all', 'recent')
+SECONDS_PER_DAY = 86400
+
+def _format(value):
+    return '-' if value is None else repr(value)
+
+def _change_line(change):
+    old_rating = None if change.old_rating is None else float(change.old_rating)
+    old_timestamp = None if change.old_timestamp is None else int(change.old_timestamp)
+    rating = None if change.rating is None else float(change.rating)
+    timestamp = None if change.timestamp is None else int(change.timestamp)
+    version = None if change.version is None else int(change.version)
+    return ' '.join(_format(value) for value in (int(change.movie_id), old_rating, old_timestamp, rating, timestamp, version))
+
+def journal_rating_changes(journal_path, changes):
+    """
+    Journals rating changes for the indexes that share journal_path without loading an index, for a process
+    whose index isn't ready yet. Every index applies them when it next replays the journal.
+
+    Args:
+        journal_path (str): The journal of the indexes.
+        changes (list): The database.write_queue.RatingChanges of committed writes.
+    """
+    Journal(journal_path).append([_change_line(change) for change in changes])
+
+class PopularityIndex:
+    """
+    Most popular movies by Bayesian average rating, overall and per genre, for all ratings ('all') and for
+    the ratings of the last recent_days days ('recent').
+
+    A movie's score is (C * m + sum of ratings) / (C + number of ratings), where m is the mean of every
+    rating in the window and C is prior_weight, so a movie needs a fair number of good ratings to beat the
+    average rather than a single 5-star one.
+
+    Only per-movie rating sums and counts are kept: one pair for all time and one per time bucket of
+    bucket_days days, so adding or deleting a rating is O(1). The recent window ends at the current time
+    and moves in whole buckets; older buckets are dropped as it moves, so on a dataset that no longer gets
+    new ratings the recent lists are empty. The top lists are rebuilt from
+    the sums lazily, at most once every refresh_interval seconds, and are then served as they are.
+
+    Ratings change through apply_rating_changes, with the batches of the rating writer. With a journal, the
+    changes are appended to it and every index that shares it replays them before it serves a list, so the
+    indexes of several app workers converge and a restarted process recovers from the saved sums plus the
+    journal, like recommender.profile_store.ProfileStore. Changes carry the data version
+    of their database write; a rebuild skips those at or below the version of the ratings it read, and
+    data_version is the newest version the sums include.
+
+    Args:
+        movie_ids (array-like): The movieId of every row in genre_matrix.
+        titles (array-like): Movie titles, aligned with movie_ids.
+        genre_matrix (sparse.csr_matrix): Multi-hot encoded genre data (movies x genres).
+        genres (np.ndarray): The genre of every column in genre_matrix.
+        recent_days (int): Length of the recent window in days.
+        bucket_days (int): Length of a time bucket in days.
+        prior_weight (float): The C of the Bayesian average. Defaults to the mean number of ratings of the
+            movies rated in the window.
+        list_size (int): Number of movies kept in each top list.
+        refresh_interval (float): Minimum number of seconds between rebuilds of the top lists.
+        journal (Journal): Journal that rating changes are appended to, or None to keep them in memory.
+    """
+
+    def __init__(self, movie_ids, titles, genre_matrix, genres, recent_days=365, bucket_days=30,
+                 prior_weight=None, list_size=100, refresh_interval=5, journal=None):
+        self.movie_index = pd.Index(movie_ids)
+        self.titles = np.asarray(titles, dtype=str)
+        self.genre_matrix = sparse.csr_matrix(genre_matrix)
+        self.genres = np.asarray(genres, dtype=str)
+        self.recent_days = recent_days
+        self.bucket_days = bucket_days
+        self.prior_weight = prior_weight
+        self.list_size = list_size
+        self.refresh_interval = refresh_interval
+        self.journal = journal
+
+        num_movies = len(self.movie_index)
+        self.num_buckets = -(-recent_days // bucket_days)
+        self.rating_sums = np.zeros(num_movies)
+        self.rating_counts = np.zeros(num_movies, dtype=np.int64)
+        # Bucket b lives in slot b % num_buckets, bucket_ids says which bucket a slot currently holds
+        self.bucket_sums = np.zeros((self.num_buckets, num_movies))
+        self.bucket_counts = np.zeros((self.num_buckets, num_movies), dtype=np.int64)
+        self.bucket_ids = np.full(self.num_buckets, -1, dtype=np.int64)
+        self.latest_bucket = -1
+
+        # The movie rows of every genre, for the per-genre lists
+        genre_columns = self.genre_matrix.tocsc()
+        self._genre_rows = {genre: genre_columns.indices[genre_columns.indptr[i]:genre_columns.indptr[i + 1]]
+                            for i, genre in enumerate(self.genres)}
+
+        self.base_version = None
+        self.data_version = None
+        self.snapshot_path = None
+
+        self.lists = {}
+        self._dirty = True
+        self._refreshed_at = 0
+        self._lock = threading.Lock()
+
+    def _bucket(self, timestamp):
+        return int(timestamp) // (self.bucket_days * SECONDS_PER_DAY)
+
+    def _advance(self, bucket):
+        # Moving the window forward frees the slots of the buckets that fall out of it
+        if bucket <= self.latest_bucket:
+            return
+        stale = self.bucket_ids <= bucket - self.num_buckets
+        self.bucket_sums[stale] = 0
+        self.bucket_counts[stale] = 0
+        self.bucket_ids[stale] = -1
+        self.latest_bucket = bucket
+        self._dirty = True
+
+    def _apply(self, movie_id, rating, timestamp, sign):
+        row = self.movie_index.get_indexer([movie_id])[0]
+        if row < 0:
+            return
+        self.rating_sums[row] += sign * rating
+        self.rating_counts[row] += sign
+
+        bucket = self._bucket(timestamp)
+        if sign > 0:
+            self._advance(bucket)
+        if bucket <= self.latest_bucket - self.num_buckets:
+            return # too old for the recent window
+        slot = bucket % self.num_buckets
+        if self.bucket_ids[slot] != bucket:
+            if sign < 0:
+                return
+            self.bucket_sums[slot] = 0
+            self.bucket_counts[slot] = 0
+            self.bucket_ids[slot] = bucket
+        self.bucket_sums[slot, row] += sign * rating
+        self.bucket_counts[slot, row] += sign
+
+    def _change(self, movie_id, old_rating, old_timestamp, rating, timestamp):
+        if old_rating is not None:
+            self._apply(movie_id, float(old_rating), old_timestamp, -1)
+        if rating is not None:
+            self._apply(movie_id, float(rating), timestamp, 1)
+        self._dirty = True
+
+    def _apply_lines(self, lines):
+        for line in lines:
+            movie_id, old_rating, old_timestamp, rating, timestamp, version = (None if field == '-' else field for field in line.split())
+            if version is not None:
+                version = int(version)
+                if self.base_version is not None and version <= self.base_version:
+                    continue # the rebuilt ratings already include it
+                self.data_version = version if self.data_version is None else max(self.data_version, version)
+            self._change(int(movie_id),
+                         None if old_rating is None else float(old_rating), None if old_timestamp is None else int(old_timestamp),
+                         None if rating is None else float(rating), None if timestamp is None else int(timestamp))
+
+    def _replay_journal(self):
+        if self.journal is None:
+            return
+        try:
+            lines = self.journal.read()
+        except ValueError:
+            # Lines were compacted away before this process read them, but the saved sums include them
+            if self.snapshot_path is None:
+                raise
+            self._load(self.snapshot_path)
+            lines = self.journal.read()
+        self._apply_lines(lines)
+
+    def apply_rating_changes(self, changes):
+        """
+        Applies a batch of committed rating writes, through the journal if there is one.
+
+        Args:
+            changes (list): The database.write_queue.RatingChanges of committed writes.
+        """
+        with self._lock:
+            if self.journal is None:
+                self._apply_lines([_change_line(change) for change in changes])
+                return
+            self.journal.append([_change_line(change) for change in changes])
+            self._replay_journal()
+
+    def journal_size(self):
+        """Returns the size of the journal in bytes."""
+        return self.journal.size() if self.journal is not None else 0
+
+    def rebuild(self, df_ratings, data_version=None):
+        """
+        Replaces the sums with a full rebuild from the ratings table. Journaled changes are replayed from
+        the journal's read position, which the caller should take with journal.seek_end() before reading
+        the ratings, except for those at or below data_version.
+
+        Args:
+            df_ratings (pd.Dataframe): Users' movie rating data, with timestamps.
+            data_version (int): The data version the ratings were read at, see snapshot.load_versioned_data_from_db.
+        """
+        rows = self.movie_index.get_indexer(df_ratings['movieId'])
+        known = rows >= 0
+        rows = rows[known]
+        ratings = df_ratings['rating'].to_numpy(dtype=np.float64)[known]
+        buckets = df_ratings['timestamp'].to_numpy(dtype=np.int64)[known] // (self.bucket_days * SECONDS_PER_DAY)
+        num_movies = len(self.movie_index)
+
+        with self._lock:
+            self.rating_sums = np.bincount(rows, weights=ratings, minlength=num_movies)
+            self.rating_counts = np.bincount(rows, minlength=num_movies).astype(np.int64)
+
+            self.bucket_ids = np.full(self.num_buckets, -1, dtype=np.int64)
+            # The window ends now, or at the newest rating if a clock was ahead when it was written
+            self.latest_bucket = max(self._bucket(time.time()), int(buckets.max()) if len(buckets) else -1)
+
+            recent = buckets > self.latest_bucket - self.num_buckets
+            slots = buckets[recent] % self.num_buckets
+            cells = slots * num_movies + rows[recent]
+            self.bucket_sums = np.bincount(cells, weights=ratings[recent],
+                                           minlength=self.num_buckets * num_movies).reshape(self.num_buckets, num_movies)
+            self.bucket_counts = np.bincount(cells, minlength=self.num_buckets * num_movies).reshape(self.num_buckets, num_movies).astype(np.int64)
+            for bucket in np.unique(buckets[recent]):
+                self.bucket_ids[bucket % self.num_buckets] = bucket
+            self._dirty = True
+
+            self.base_version = self.data_version = data_version
+            self._replay_journal()
+
+    def _window_totals(self, window):
+        if window == 'all':
+            return self.rating_sums, self.rating_counts
+        live = self.bucket_ids > self.latest_bucket - self.num_buckets
+        return self.bucket_sums[live].sum(axis=0), self.bucket_counts[live].sum(axis=0)
+
+    def _top_list(self, scores, counts, rows):
+        k = min(self.list_size, len(rows))
+        if k == 0:
+            return rows
+        top = rows[np.argpartition(-scores[rows], k - 1)[:k]]
+        # Ties go to the movie with more ratings, then the smaller movieId
+        return top[np.lexsort((self.movie_index.to_numpy()[top], -counts[top], -scores[top]))]
+
+    def _refresh(self):
+        lists = {}
+        for window in WINDOWS:
+            sums, counts = self._window_totals(window)
+            rated = counts > 0
+            num_ratings = counts.sum()
+            mean_rating = sums.sum() / num_ratings if num_ratings else 0.0
+            prior_weight = self.prior_weight if self.prior_weight is not None else (num_ratings / rated.sum() if rated.any() else 0.0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = (prior_weight * mean_rating + sums) / (prior_weight + counts)
+
+            lists[(window, None)] = self._frame(self._top_list(scores, counts, np.flatnonzero(rated)), scores, counts)
+            for genre, rows in self._genre_rows.items():
+                lists[(window, genre)] = self._frame(self._top_list(scores, counts, rows[rated[rows]]), scores, counts)
+        self.lists = lists
+        self._dirty = False
+        self._refreshed_at = time.monotonic()
+
+    def _frame(self, rows, scores, counts):
+        return pd.DataFrame({'movieId': self.movie_index[rows],
+                             'title': self.titles[rows],
+                             'score': scores[rows],
+                             'num_ratings': counts[rows]})
+
+    def top(self, num_movies=10, genre=None, window='all', exclude_ids=None):
+        """
+        Returns the most popular movies from the precomputed lists.
+
+        Args:
+            num_movies (int): Number of movies to return, at most list_size.
+            genre (str): Only movies of this genre, or None for all movies.
+            window (str): 'all' for every rating or 'recent' for the ratings of the last recent_days days.
+            exclude_ids (array-like): movieIds that must not be returned, such as the movies the user has rated.
+
+        Returns:
+            pd.Dataframe: The movieIds, titles, Bayesian average scores and number of ratings, best first.
+
+        Raises:
+            KeyError: If the window or genre is unknown.
+        """
+        if window not in WINDOWS:
+            raise KeyError(f"Unknown popularity window '{window}', expected one of {WINDOWS}.")
+        current_bucket = self._bucket(time.time())
+        if self.journal is not None or current_bucket > self.latest_bucket:
+            with self._lock:
+                self._replay_journal()
+                self._advance(current_bucket)
+        if not self.lists or (self._dirty and time.monotonic() - self._refreshed_at >= self.refresh_interval):
+            with self._lock:
+                if not self.lists or self._dirty:
+                    self._refresh()
+
+        lists = self.lists
+        if genre is not None and (window, genre) not in lists:
+            raise KeyError(f"Unknown genre '{genre}'.")
+        movies = lists[(window, genre)]
+        if exclude_ids is not None and len(exclude_ids):
+            movies = movies[~movies['movieId'].isin(exclude_ids)]
+        return movies.iloc[:num_movies]
+
+    def _save(self, path, journal_position):
+        self.snapshot_path = path
+        file_id, offset = journal_position if journal_position is not None else ((0, 0), 0)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path,
+                 version=np.int64(POPULARITY_VERSION),
+                 movie_ids=self.movie_index.to_numpy(),
+                 titles=self.titles,
+                 genres=self.genres,
+                 genre_data=self.genre_matrix.data,
+                 genre_indices=self.genre_matrix.indices,
+                 genre_indptr=self.genre_matrix.indptr,
+                 windows=np.array([self.recent_days, self.bucket_days], dtype=np.int64),
+                 rating_sums=self.rating_sums,
+                 rating_counts=self.rating_counts.astype(np.int32),
+                 bucket_sums=self.bucket_sums,
+                 bucket_counts=self.bucket_counts.astype(np.int32),
+                 bucket_ids=self.bucket_ids,
+                 latest_bucket=np.int64(self.latest_bucket),
+                 journal_file=np.array(file_id, dtype=np.uint64),
+                 journal_offset=np.int64(offset),
+                 versions=np.array([-1 if version is None else version for version in (self.base_version, self.data_version)], dtype=np.int64))
+        os.replace(tmp_path, path)
+
+    def save(self, path):
+        """
+        Writes the sums, along with the movies, to a compact .npz file that load_popularity_index restores
+        on its own. The top lists are rebuilt from the sums when loaded. The file remembers the data version
+        and how much of the journal it includes.
+
+        Args:
+            path (str): Destination .npz file.
+        """
+        with self._lock:
+            self._replay_journal()
+            self._save(path, self.journal.position() if self.journal is not None else None)
+
+    def compact(self, path, min_journal_size=0):
+        """
+        Saves the sums, like save, and empties the journal they now include, so the journal doesn't grow
+        without bound and a restart only replays what was journaled since.
+
+        Args:
+            path (str): Destination .npz file.
+            min_journal_size (int): Leave the journal alone if it is smaller than this many bytes.
+
+        Returns:
+            bool: Whether the journal was compacted.
+        """
+        if self.journal is None:
+            self.save(path)
+            return False
+
+        def save(lines, journal_position):
+            self._apply_lines(lines)
+            self._save(path, journal_position)
+
+        with self._lock:
+            # Catching up first reloads the sums if this process fell behind, which can't happen under the exclusive lock
+            self._replay_journal()
+            return self.journal.compact(save, min_size=min_journal_size)
+
+    def _load(self, path):
+        with self.journal.lock() if self.journal is not None else nullcontext():
+            # The lock keeps another process from compacting the journal between reading the file and opening it
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['version']) != POPULARITY_VERSION:
+                    raise ValueError("Popularity index was written by another version.")
+                if (not np.array_equal(data['movie_ids'], self.movie_index.to_numpy())
+                        or not np.array_equal(data['genres'], self.genres)
+                        or data['windows'].tolist() != [self.recent_days, self.bucket_days]):
+                    raise ValueError("Popularity index was built for other movies, genres or windows.")
+                if self.journal is not None:
+                    self.journal.open((tuple(int(i) for i in data['journal_file']), int(data['journal_offset'])))
+
+                self.rating_sums = data['rating_sums'].copy()
+                self.rating_counts = data['rating_counts'].astype(np.int64)
+                self.bucket_sums = data['bucket_sums'].copy()
+                self.bucket_counts = data['bucket_counts'].astype(np.int64)
+                self.bucket_ids = data['bucket_ids'].copy()
+                self.latest_bucket = int(data['latest_bucket'])
+                self.base_version, self.data_version = (None if version < 0 else int(version) for version in data['versions'])
+                self._dirty = True
+        self.snapshot_path = path
+
+    def load(self, path):
+        """
+        Restores the sums written by save and replays the journal written after them.
+
+        Args:
+            path (str): The .npz file written by save.
+
+        Raises:
+            ValueError: If the file was written by another version, for other movies, genres or windows, or
+                its journal has since been replaced.
+        """
+        with self._lock:
+            self._load(path)
+            self._replay_journal()
+
+def load_popularity_index(path, journal_path=None, **kwargs):
+    """
+    Restores a PopularityIndex from the file written by save alone, without the dataset.
+
+    Args:
+        path (str): The .npz file written by save.
+        journal_path (str): The journal the index shares with the other processes, or None.
+        **kwargs: Tuning parameters of PopularityIndex.
+
+    Returns:
+        PopularityIndex: The restored index, up to date with the journal.
+
+    Raises:
+        ValueError: See PopularityIndex.load.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['version']) != POPULARITY_VERSION:
+            raise ValueError("Popularity index was written by another version.")
+        genres = data['genres']
+        genre_matrix = sparse.csr_matrix((data['genre_data'], data['genre_indices'], data['genre_indptr']),
+                                         shape=(len(data['movie_ids']), len(genres)))
+        index = PopularityIndex(data['movie_ids'], data['titles'], genre_matrix, genres,
+                                journal=Journal(journal_path) if journal_path is not None else None, **kwargs)
+    index.load(path)
+    return index
+
+def build_popularity_index(df_movies, df_ratings, genre_encoding, data_version=None, **kwargs):
+    """
+    Builds a PopularityIndex from the cleaned dataset.
+
+    Args:
+        df_movies (pd.Dataframe): Cleaned movie data.
+        df_ratings (pd.Dataframe): Users' movie rating data, with timestamps, or None for an empty index
+            that is filled with load.
+        genre_encoding (pp.GenreEncoding): Sparse genre encoding of df_movies.
+        data_version (int): The data version df_ratings was read at, see PopularityIndex.rebuild.
+        **kwargs: Tuning parameters of PopularityIndex.
+
+    Returns:
+        PopularityIndex: The built index.
+    """
+    titles = df_movies.set_index('movieId')['title'].reindex(genre_encoding.movie_index).fillna('')
+    index = PopularityIndex(genre_encoding.movie_index, titles.to_numpy(dtype=str), genre_encoding.matrix,
+                            genre_encoding.vocabulary, **kwargs)
+    if df_ratings is not None:
+        index.rebuild(df_ratings, data_version=data_version)
+    return index
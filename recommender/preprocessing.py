@@ -2,8 +2,12 @@ import pandas as pd
 import numpy as np
 import sqlite3
 import os
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.model_selection import train_test_split
+from collections import namedtuple
+from scipy import sparse as sp
+
+# Sparse multi-hot genre encoding: a movies x genres CSR matrix, the genre of every column
+# and a pd.Index that maps each movieId to its row.
+GenreEncoding = namedtuple('GenreEncoding', ['matrix', 'vocabulary', 'movie_index'])
 
 def load_data_from_db():
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -38,6 +42,7 @@ def clean_movies(df_movies):
 
     df_movies['year'] = df_movies['title'].str.extract(r'\((\d{4})\)').astype(float)
     
+    from sklearn.preprocessing import MinMaxScaler # imported here, sklearn takes about a second to import
     scaler = MinMaxScaler()
     df_movies['normalized_year'] = scaler.fit_transform(df_movies[['year']])
     
@@ -86,46 +91,133 @@ def filter_less_active_data(df_ratings, df_movies, min_user_ratings=5, min_movie
     
     return df_ratings, df_movies
 
-def encode_genres(df_movies):
+def encode_genres(df_movies, sparse=False, vocabulary=None):
     """
     Extracts genres and multi-hot encodes them.
     
     Args: 
         df_movies (pd.Dataframe): A dataframe with movie information.
+        sparse (bool): Return a compact GenreEncoding (uint8 CSR matrix) instead of a dense dataframe.
+        vocabulary (list): Genres to encode, in column order. Passing the vocabulary of a previous fit keeps the
+            columns stable, genres that aren't in it are ignored. Defaults to the sorted genres of df_movies.
     
     Returns: 
-        pd.Dataframe: A dataframe with multi-hot encoded genre values.
+        pd.Dataframe: A dataframe with multi-hot encoded genre values, or a GenreEncoding if sparse is True.
     """
+    if sparse:
+        genre_split = df_movies['genres'].fillna('').str.split('|')
+        genres = genre_split.explode().str.strip().to_numpy()
+        rows = np.repeat(np.arange(len(df_movies)), genre_split.str.len().to_numpy())
+
+        if vocabulary is None:
+            vocabulary = sorted(set(genres) - {''})
+        vocabulary = list(vocabulary)
+
+        columns = pd.Index(vocabulary).get_indexer(genres)
+        known = columns >= 0
+        matrix = sp.csr_matrix((np.ones(known.sum(), dtype=np.uint8), (rows[known], columns[known])),
+                               shape=(len(df_movies), len(vocabulary)))
+        return GenreEncoding(matrix=matrix, vocabulary=vocabulary, movie_index=pd.Index(df_movies['movieId']))
+
     genre_split = df_movies['genres'].str.split('|')
     df_genres = (genre_split.explode()
                            .str.strip()
                            .pipe(pd.get_dummies)
                            .groupby(level=0)
                            .sum())
+    if vocabulary is not None:
+        df_genres = df_genres.reindex(columns=list(vocabulary), fill_value=0)
     df_genres = df_genres.set_index(df_movies['movieId'])
     return df_genres
 
-def user_rating_train_test_split(df_ratings, test_size=0.2, random_state=24):
+def select_genres(genre_encoding, movie_ids, as_frame=False):
+    """
+    Selects the rows of a sparse genre encoding that belong to the given movies, e.g. after filtering.
+
+    Args:
+        genre_encoding (GenreEncoding): A sparse genre encoding.
+        movie_ids (array-like): The movieIds to keep, in the order they should appear.
+        as_frame (bool): Return the same dense dataframe as encode_genres(sparse=False) instead.
+
+    Returns:
+        GenreEncoding: The encoding restricted to movie_ids, with the same vocabulary, or a pd.Dataframe if as_frame is True.
+    """
+    rows = genre_encoding.movie_index.get_indexer(np.asarray(movie_ids))
+    if (rows < 0).any():
+        raise KeyError("Some movieIds are not part of the genre encoding.")
+    matrix = genre_encoding.matrix[rows]
+    movie_index = genre_encoding.movie_index[rows]
+    if as_frame:
+        return pd.DataFrame(matrix.toarray().astype(np.int64), index=movie_index.rename('movieId'),
+                            columns=list(genre_encoding.vocabulary))
+    return GenreEncoding(matrix=matrix, vocabulary=genre_encoding.vocabulary, movie_index=movie_index)
+
+def _rank_within_user(user_ids, *keys):
+    """
+    Ranks every rating within its user by keys, with a single sort over the whole frame.
+
+    Args:
+        user_ids (np.ndarray): The userId of every rating.
+        *keys (np.ndarray): Sort keys of every rating, the last one is the primary key (as in np.lexsort).
+
+    Returns:
+        np.ndarray: The 0-based rank of every rating within its user.
+        np.ndarray: The number of ratings of every rating's user.
     """
-    Performs a train_test_split on users' movie ratings.
+    order = np.lexsort(keys + (user_ids,))
+    sorted_users = user_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    group = np.repeat(np.arange(len(starts)), sizes)
+
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - starts[group]
+    counts = np.empty(len(order), dtype=np.int64)
+    counts[order] = sizes[group]
+    return ranks, counts
+
+def user_rating_train_test_split(df_ratings, test_size=0.2, random_state=24, min_user_ratings=5):
+    """
+    Performs a per-user random train/test split on users' movie ratings. Every user with at least
+    min_user_ratings ratings has ceil(test_size * n) of their n ratings withheld for testing, the same
+    counts as sklearn's train_test_split, the ratings of other users are all used for training.
 
     Args: 
         df_ratings (pd.Dataframe): A dataframe with user movie rating information.
         test_size (float): Percentage of values that are used for testing.
         random_state (int): Acts as a seed for the pseudo-random number generator.
+        min_user_ratings (int): Users with less ratings than this threshold are only used for training.
     
     Returns:
         pd.dataFrame: Ratings for training the model.
         pd.dataFrame: Ratings for testing the model.
     """
-    train_list, test_list = [], []
+    rng = np.random.default_rng(random_state)
+    ranks, counts = _rank_within_user(df_ratings['userId'].to_numpy(), rng.random(len(df_ratings)))
+
+    test_counts = np.where(counts >= min_user_ratings, np.ceil(test_size * counts), 0)
+    is_test = ranks < test_counts
+    return df_ratings[~is_test], df_ratings[is_test]
+
+def user_rating_temporal_split(df_ratings, num_test=1, min_user_ratings=5):
+    """
+    Performs a leave-last-N-out split: every user's most recent num_test ratings are withheld for testing,
+    which mirrors predicting what a user watches next. Of ratings with equal timestamps, the larger movieId counts as newer.
+
+    Args:
+        df_ratings (pd.Dataframe): A dataframe with user movie rating information, including timestamps.
+        num_test (int): Number of most recent ratings withheld per user.
+        min_user_ratings (int): Users with less ratings than this threshold are only used for training, as are
+            users with num_test ratings or less, who would otherwise have no training ratings left.
 
-    for user_id, group in df_ratings.groupby('userId'):
-        if len(group) >= 5:
-            train, test = train_test_split(group, test_size=test_size, random_state=random_state)
-            train_list.append(train)
-            test_list.append(test)
-        else:
-            train_list.append(group)
+    Returns:
+        pd.dataFrame: Ratings for training the model.
+        pd.dataFrame: Ratings for testing the model.
+    """
+    # Ranking by negated timestamps puts each user's newest ratings first
+    ranks, counts = _rank_within_user(df_ratings['userId'].to_numpy(),
+                                      -df_ratings['movieId'].to_numpy(),
+                                      -df_ratings['timestamp'].to_numpy())
 
-    return pd.concat(train_list), pd.concat(test_list)
\ No newline at end of file
+    is_test = (counts >= min_user_ratings) & (counts > num_test) & (ranks < num_test)
+    return df_ratings[~is_test], df_ratings[is_test]
@@ -0,0 +1,334 @@
+import os
+import threading
+from contextlib import nullcontext
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from recommender.journal import Journal
+
+def _journal_line(user_id, movie_id, weight_delta, version):
+    return f"{int(user_id)} {int(movie_id)} {float(weight_delta)!r} {'-' if version is None else int(version)}"
+
+def _change_line(change):
+    weight_delta = -float(change.old_rating) if change.rating is None else float(change.rating) - float(change.old_rating or 0)
+    return _journal_line(change.user_id, change.movie_id, weight_delta, change.version)
+
+def journal_rating_changes(journal_path, changes):
+    """
+    Journals rating changes for the stores that share journal_path without loading a store, for a process
+    whose store isn't ready yet. Every store applies them when it next replays the journal, including the
+    one this process loads later.
+
+    Args:
+        journal_path (str): The journal of the stores.
+        changes (list): The database.write_queue.RatingChanges of committed writes.
+    """
+    Journal(journal_path).append([_change_line(change) for change in changes])
+
+class ProfileStore:
+    """
+    Keeps every user's profile as a running rating-weighted sum of genre vectors and a weight total, so that
+    adding, deleting or changing a rating updates the profile in O(genres) instead of rebuilding all profiles.
+    Ratings change through apply_rating_changes, with the batches of the rating writer.
+
+    Updates are appended to a journal file before they are applied. Every process that shares the journal
+    replays the lines it hasn't seen yet before it reads a profile, so the stores of several app workers
+    converge, and a restarted process recovers its state from the last snapshot plus the journal. compact
+    folds the journal into the snapshot, so it stays short.
+
+    Updates carry the data version of the database write they come from (see database.schema). A rebuild
+    records the version of the ratings it read, and journaled updates at or below it are skipped because the
+    ratings already include them. data_version is the newest version the profiles include, so a store whose
+    data_version differs from the database's has missed writes.
+
+    Args:
+        genre_matrix (sparse.csr_matrix): Multi-hot encoded genre data (movies x genres).
+        movie_ids (pd.Index): The movieId of every row in genre_matrix.
+        genres (np.ndarray): The genre of every column in genre_matrix.
+        journal_path (str): File that updates are appended to. Updates are only kept in memory if None.
+    """
+
+    def __init__(self, genre_matrix, movie_ids, genres, journal_path=None):
+        self.genre_matrix = sparse.csr_matrix(genre_matrix, dtype=np.float64)
+        self.movie_index = pd.Index(movie_ids)
+        self.genres = np.asarray(genres, dtype=str)
+        self.journal_path = journal_path
+        self.journal = Journal(journal_path) if journal_path is not None else None
+
+        self.user_rows = {}
+        self.weighted_sums = np.zeros((0, len(self.genres)))
+        self.weight_totals = np.zeros(0)
+        self.base_version = None
+        self.data_version = None
+        self.snapshot_path = None
+        self._rebuild_position = None
+        self._lock = threading.Lock()
+
+    def _user_row(self, user_id):
+        row = self.user_rows.get(user_id)
+        if row is None:
+            row = len(self.user_rows)
+            if row == len(self.weight_totals):
+                # Grow by doubling so that adding users is amortized O(genres)
+                capacity = max(2 * row, 16)
+                self.weighted_sums = np.resize(self.weighted_sums, (capacity, len(self.genres)))
+                self.weighted_sums[row:] = 0
+                self.weight_totals = np.resize(self.weight_totals, capacity)
+                self.weight_totals[row:] = 0
+            self.user_rows[user_id] = row
+        return row
+
+    def _apply(self, user_id, movie_id, weight_delta):
+        movie_row = self.movie_index.get_indexer([movie_id])[0]
+        if movie_row < 0 or weight_delta == 0:
+            return
+        user_row = self._user_row(user_id)
+        start, end = self.genre_matrix.indptr[movie_row], self.genre_matrix.indptr[movie_row + 1]
+        self.weighted_sums[user_row, self.genre_matrix.indices[start:end]] += weight_delta * self.genre_matrix.data[start:end]
+        self.weight_totals[user_row] += weight_delta
+
+    def _apply_versioned(self, user_id, movie_id, weight_delta, version):
+        if version is not None:
+            if self.base_version is not None and version <= self.base_version:
+                return # the rebuilt ratings already include it
+            self.data_version = version if self.data_version is None else max(self.data_version, version)
+        self._apply(user_id, movie_id, weight_delta)
+
+    def _apply_lines(self, lines):
+        for line in lines:
+            user_id, movie_id, weight_delta, version = line.split()
+            self._apply_versioned(int(user_id), int(movie_id), float(weight_delta), None if version == '-' else int(version))
+
+    def _replay_journal(self):
+        if self.journal is None:
+            return
+        try:
+            lines = self.journal.read()
+        except ValueError:
+            # Lines were compacted away before this process read them, but the snapshot includes them
+            if self.snapshot_path is None:
+                raise
+            self._load(self.snapshot_path)
+            lines = self.journal.read()
+        self._apply_lines(lines)
+
+    def apply_rating_changes(self, changes):
+        """
+        Applies a batch of committed rating writes with a single journal append.
+
+        Args:
+            changes (list): The database.write_queue.RatingChanges of committed writes.
+        """
+        with self._lock:
+            if self.journal is None:
+                self._apply_lines([_change_line(change) for change in changes])
+                return
+            self.journal.append([_change_line(change) for change in changes])
+            self._replay_journal()
+
+    def journal_position(self):
+        """
+        Starts reading the journal at its current end. Call it before reading the ratings that are passed to
+        rebuild, so that updates journaled while they are read aren't lost.
+
+        Returns:
+            tuple: The journal position, or None if the store has no journal.
+        """
+        with self._lock:
+            if self.journal is None:
+                return None
+            self._rebuild_position = self.journal.seek_end()
+            return self._rebuild_position
+
+    def journal_size(self):
+        """Returns the size of the journal in bytes."""
+        return self.journal.size() if self.journal is not None else 0
+
+    def profile(self, user_id):
+        """
+        Returns a user's profile.
+
+        Args:
+            user_id (int): The user's id.
+
+        Returns:
+            np.ndarray: The rating-weighted average genre vector, or zeros if the user has no ratings.
+        """
+        with self._lock:
+            self._replay_journal()
+            row = self.user_rows.get(user_id)
+            if row is None or self.weight_totals[row] <= 0:
+                return np.zeros(len(self.genres))
+            return self.weighted_sums[row] / self.weight_totals[row]
+
+    def profile_matrix(self, user_ids):
+        """
+        Returns the profiles of a batch of users.
+
+        Args:
+            user_ids (array-like): The users' ids.
+
+        Returns:
+            np.ndarray: The profiles, one row per user id (users x genres). Users without ratings get zeros.
+            np.ndarray: Whether each user has any ratings.
+        """
+        with self._lock:
+            self._replay_journal()
+            rows = np.array([self.user_rows.get(int(user_id), -1) for user_id in user_ids], dtype=np.int64)
+            known = rows >= 0
+            known[known] = self.weight_totals[rows[known]] > 0
+            profiles = np.zeros((len(rows), len(self.genres)))
+            profiles[known] = self.weighted_sums[rows[known]] / self.weight_totals[rows[known], None]
+        return profiles, known
+
+    def profiles(self):
+        """
+        Returns every user's profile.
+
+        Returns:
+            pd.Dataframe: The user profiles, in the same format as model.create_user_profiles_sparse.
+        """
+        with self._lock:
+            self._replay_journal()
+            num_users = len(self.user_rows)
+            user_ids = np.fromiter(self.user_rows.keys(), dtype=np.int64, count=num_users)
+            weight_totals = self.weight_totals[:num_users].copy()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                profiles = self.weighted_sums[:num_users] / weight_totals[:, None]
+        profiles = pd.DataFrame(profiles, index=pd.Index(user_ids, name='userId'), columns=self.genres)
+        return profiles[weight_totals > 0].fillna(0).sort_index()
+
+    def rebuild(self, df_ratings, data_version=None):
+        """
+        Replaces the running sums with a full rebuild from the ratings table. Journaled updates are replayed
+        from the position of the last journal_position call, or from the end of the journal if there wasn't
+        one, except for those at or below data_version.
+
+        Args:
+            df_ratings (pd.Dataframe): Users' movie rating data.
+            data_version (int): The data version the ratings were read at, see snapshot.load_versioned_data_from_db.
+        """
+        movie_rows = self.movie_index.get_indexer(df_ratings['movieId'])
+        df_ratings = df_ratings[movie_rows >= 0]
+        movie_rows = movie_rows[movie_rows >= 0]
+
+        user_rows, user_ids = pd.factorize(df_ratings['userId'], sort=True)
+        rating_matrix = sparse.csr_matrix((df_ratings['rating'].to_numpy(dtype=np.float64), (user_rows, movie_rows)),
+                                          shape=(len(user_ids), len(self.movie_index)))
+
+        with self._lock:
+            self.user_rows = {int(user_id): row for row, user_id in enumerate(user_ids)}
+            self.weighted_sums = (rating_matrix @ self.genre_matrix).toarray()
+            self.weight_totals = np.asarray(rating_matrix.sum(axis=1)).ravel()
+            self.base_version = self.data_version = data_version
+            if self.journal is not None and self._rebuild_position is None:
+                # Without a position taken before the ratings were read, the rebuild is assumed to include every journaled update
+                self.journal.seek_end()
+            self._rebuild_position = None
+            self._replay_journal()
+
+    def verify(self, df_ratings, atol=1e-9):
+        """
+        Checks the incrementally maintained profiles against a full rebuild from the ratings table.
+
+        Args:
+            df_ratings (pd.Dataframe): Users' movie rating data.
+            atol (float): Allowed absolute difference per genre.
+
+        Returns:
+            list: The userIds whose incremental profile differs from the rebuilt one. Empty if the store is consistent.
+        """
+        rebuilt = ProfileStore(self.genre_matrix, self.movie_index, self.genres)
+        rebuilt.rebuild(df_ratings)
+        expected = rebuilt.profiles()
+        actual = self.profiles()
+
+        user_ids = expected.index.union(actual.index)
+        expected = expected.reindex(user_ids, fill_value=0)
+        actual = actual.reindex(user_ids, fill_value=0)
+        mismatched = ~np.isclose(actual.to_numpy(), expected.to_numpy(), rtol=0, atol=atol).all(axis=1)
+        return user_ids[mismatched].tolist()
+
+    def _save(self, path, journal_position):
+        self.snapshot_path = path
+        num_users = len(self.user_rows)
+        file_id, offset = journal_position if journal_position is not None else ((0, 0), 0)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path,
+                 genres=self.genres,
+                 user_ids=np.fromiter(self.user_rows.keys(), dtype=np.int64, count=num_users),
+                 weighted_sums=self.weighted_sums[:num_users],
+                 weight_totals=self.weight_totals[:num_users],
+                 journal_file=np.array(file_id, dtype=np.uint64),
+                 journal_offset=np.int64(offset),
+                 versions=np.array([-1 if version is None else version for version in (self.base_version, self.data_version)], dtype=np.int64))
+        os.replace(tmp_path, path)
+
+    def save(self, path):
+        """
+        Writes a snapshot of the store. The snapshot remembers how much of the journal it already includes.
+
+        Args:
+            path (str): Destination .npz file.
+        """
+        with self._lock:
+            self._replay_journal()
+            self._save(path, self.journal.position() if self.journal is not None else None)
+
+    def compact(self, path, min_journal_size=0):
+        """
+        Writes a snapshot of the store, like save, and empties the journal it now includes, so the journal
+        doesn't grow without bound and a restart only replays what was journaled since.
+
+        Args:
+            path (str): Destination .npz file.
+            min_journal_size (int): Leave the journal alone if it is smaller than this many bytes.
+
+        Returns:
+            bool: Whether the journal was compacted.
+        """
+        if self.journal is None:
+            self.save(path)
+            return False
+
+        def save(lines, journal_position):
+            self._apply_lines(lines)
+            self._save(path, journal_position)
+
+        with self._lock:
+            # Catching up first reloads the snapshot if this process fell behind, which can't happen under the exclusive lock
+            self._replay_journal()
+            return self.journal.compact(save, min_size=min_journal_size)
+
+    def _load(self, path):
+        with self.journal.lock() if self.journal is not None else nullcontext():
+            # The lock keeps another process from compacting the journal between reading the snapshot and opening it
+            with np.load(path, allow_pickle=False) as data:
+                if not np.array_equal(data['genres'], self.genres):
+                    raise ValueError("Profile store snapshot was built with a different genre vocabulary.")
+                if 'versions' not in data.files:
+                    raise ValueError("Profile store snapshot was written by an older version.")
+                if self.journal is not None:
+                    self.journal.open((tuple(int(i) for i in data['journal_file']), int(data['journal_offset'])))
+
+                self.user_rows = {int(user_id): row for row, user_id in enumerate(data['user_ids'])}
+                self.weighted_sums = data['weighted_sums'].copy()
+                self.weight_totals = data['weight_totals'].copy()
+                self.base_version, self.data_version = (None if version < 0 else int(version) for version in data['versions'])
+        self.snapshot_path = path
+
+    def load(self, path):
+        """
+        Restores a snapshot written by save and replays the journal written after it.
+
+        Args:
+            path (str): The .npz file written by save.
+
+        Raises:
+            ValueError: If the snapshot was built with a different genre vocabulary, by an older version, or
+                its journal has since been replaced.
+        """
+        with self._lock:
+            self._load(path)
+            self._replay_journal()
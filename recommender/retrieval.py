@@ -0,0 +1,189 @@
+from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import recommender.model as model
+
+class RetrievalIndex(ABC):
+    """
+    Top-k retrieval over row-normalized movie feature vectors. Subclasses decide which movies are
+    scored for a query, the scores themselves are always exact cosine similarities.
+
+    Args:
+        features (np.ndarray or sparse.csr_matrix): Movie features (movies x features). Rows are normalized here.
+        movie_ids (array-like): The movieId of every row in features.
+    """
+
+    def __init__(self, features, movie_ids):
+        features = model.normalize_rows(features)
+        self.features = features.toarray() if sparse.issparse(features) else features
+        self.movie_ids = movie_ids if isinstance(movie_ids, pd.Index) else pd.Index(movie_ids)
+
+    @abstractmethod
+    def candidates(self, query):
+        """Returns the rows that should be scored for a normalized query vector, or None for all rows."""
+
+    def search(self, query, k=10, exclude_ids=None):
+        """
+        Finds the movies most similar to a query vector, such as a user profile.
+
+        Args:
+            query (np.ndarray): The query vector (features,).
+            k (int): Number of movies to return.
+            exclude_ids (array-like): movieIds that must not be returned, such as the movies the user has rated.
+
+        Returns:
+            pd.Dataframe: The top-k movieIds along with their cosine similarity scores, best first.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        query = query / norm if norm else query
+
+        excluded = np.empty(0, dtype=np.int64)
+        if exclude_ids is not None and len(exclude_ids):
+            excluded = self.movie_ids.get_indexer(np.asarray(exclude_ids))
+            excluded = excluded[excluded >= 0]
+
+        rows = self.candidates(query)
+        if rows is None:
+            rows = np.arange(len(self.features))
+            scores = self.features @ query
+            scores[excluded] = -np.inf
+        else:
+            rows = rows[~np.isin(rows, excluded)]
+            scores = self.features[rows] @ query
+
+        k = min(k, len(scores))
+        if k <= 0:
+            return pd.DataFrame({'movieId': self.movie_ids[:0], 'score': np.empty(0, dtype=np.float32)})
+        top_k = np.argpartition(-scores, k - 1)[:k]
+        top_k = top_k[np.argsort(-scores[top_k], kind='stable')]
+        top_k = top_k[np.isfinite(scores[top_k])]
+        return pd.DataFrame({'movieId': self.movie_ids[rows[top_k]], 'score': scores[top_k]})
+
+class ExactIndex(RetrievalIndex):
+    """
+    Brute-force retrieval that scores every movie. This is the reference the approximate indexes are measured against.
+    """
+
+    def candidates(self, query):
+        return None
+
+class LSHIndex(RetrievalIndex):
+    """
+    Random-projection (SimHash) locality-sensitive hashing. Every table hashes a vector to the signs of
+    num_bits random projections, so vectors with a small angle between them tend to share a bucket. A query
+    only scores the movies in its buckets, plus buckets within probe_radius bit flips of them.
+
+    More tables and a larger probe_radius raise recall at the cost of latency, more bits do the opposite.
+
+    Args:
+        features (np.ndarray or sparse.csr_matrix): Movie features (movies x features).
+        movie_ids (array-like): The movieId of every row in features.
+        num_tables (int): Number of independent hash tables.
+        num_bits (int): Number of random projections per table.
+        probe_radius (int): Query buckets within this many bit flips are probed too (0, 1 or 2).
+        seed (int): Acts as a seed for the pseudo-random number generator.
+    """
+
+    def __init__(self, features, movie_ids, num_tables=8, num_bits=12, probe_radius=1, seed=24):
+        super().__init__(features, movie_ids)
+        self.num_bits = num_bits
+        self.probe_radius = probe_radius
+
+        rng = np.random.default_rng(seed)
+        self.projections = rng.standard_normal((num_tables, self.features.shape[1], num_bits)).astype(np.float32)
+        self._bit_weights = 1 << np.arange(num_bits, dtype=np.int64)
+        self._probe_masks = self._masks(num_bits, probe_radius)
+
+        # Each table is stored as movie rows sorted by bucket, so a bucket is a contiguous slice
+        self.tables = []
+        for projection in self.projections:
+            codes = self._hash(self.features, projection)
+            order = np.argsort(codes, kind='stable')
+            self.tables.append((codes[order], order))
+
+    @staticmethod
+    def _masks(num_bits, radius):
+        masks = [0]
+        if radius >= 1:
+            masks += [1 << i for i in range(num_bits)]
+        if radius >= 2:
+            masks += [(1 << i) | (1 << j) for i in range(num_bits) for j in range(i + 1, num_bits)]
+        return np.array(masks, dtype=np.int64)
+
+    def _hash(self, vectors, projection):
+        return ((vectors @ projection) > 0) @ self._bit_weights
+
+    def candidates(self, query):
+        rows = []
+        for projection, (codes, order) in zip(self.projections, self.tables):
+            buckets = self._hash(query[None, :], projection)[0] ^ self._probe_masks
+            starts = np.searchsorted(codes, buckets, side='left')
+            ends = np.searchsorted(codes, buckets, side='right')
+            rows.extend(order[start:end] for start, end in zip(starts, ends) if end > start)
+        return np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+
+class IVFIndex(RetrievalIndex):
+    """
+    Inverted-file index. Movies are clustered with spherical k-means and a query only scores the movies
+    in its num_probes closest clusters. More probes raise recall at the cost of latency.
+
+    Args:
+        features (np.ndarray or sparse.csr_matrix): Movie features (movies x features).
+        movie_ids (array-like): The movieId of every row in features.
+        num_clusters (int): Number of clusters. Defaults to roughly the square root of the number of movies.
+        num_probes (int): Number of clusters scored per query.
+        num_iterations (int): Number of k-means iterations.
+        seed (int): Acts as a seed for the pseudo-random number generator.
+    """
+
+    def __init__(self, features, movie_ids, num_clusters=None, num_probes=4, num_iterations=10, seed=24):
+        super().__init__(features, movie_ids)
+        num_movies = len(self.features)
+        num_clusters = min(num_clusters or max(int(np.sqrt(num_movies)), 1), num_movies)
+        self.num_probes = num_probes
+
+        rng = np.random.default_rng(seed)
+        centroids = self.features[rng.choice(num_movies, size=num_clusters, replace=False)]
+        for _ in range(num_iterations):
+            assignments = np.argmax(self.features @ centroids.T, axis=1)
+            membership = sparse.csr_matrix((np.ones(num_movies, dtype=np.float32), (assignments, np.arange(num_movies))),
+                                           shape=(num_clusters, num_movies))
+            sums = membership @ self.features
+            empty = ~np.bincount(assignments, minlength=num_clusters).astype(bool)
+            sums[empty] = centroids[empty] # keep the old centroid for clusters that lost all of their movies
+            centroids = model.normalize_rows(sums)
+        self.centroids = centroids
+
+        assignments = np.argmax(self.features @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind='stable')
+        self.cluster_rows = np.split(order, np.searchsorted(assignments[order], np.arange(1, num_clusters)))
+
+    def candidates(self, query):
+        num_probes = min(self.num_probes, len(self.centroids))
+        closest = np.argpartition(-(self.centroids @ query), num_probes - 1)[:num_probes]
+        return np.concatenate([self.cluster_rows[cluster] for cluster in closest])
+
+INDEX_BACKENDS = {
+    'exact': ExactIndex,
+    'lsh': LSHIndex,
+    'ivf': IVFIndex,
+}
+
+def build_index(features, movie_ids, backend='exact', **kwargs):
+    """
+    Builds a retrieval index over movie feature vectors.
+
+    Args:
+        features (np.ndarray or sparse.csr_matrix): Movie features (movies x features).
+        movie_ids (array-like): The movieId of every row in features.
+        backend (str): One of INDEX_BACKENDS: 'exact', 'lsh' or 'ivf'.
+        **kwargs: Tuning parameters of the chosen backend.
+
+    Returns:
+        RetrievalIndex: The built index.
+    """
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown retrieval backend '{backend}', expected one of {sorted(INDEX_BACKENDS)}.")
+    return INDEX_BACKENDS[backend](features, movie_ids, **kwargs)
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import recommender.preprocessing as pp
+import database.schema as schema
+from recommender.journal import file_lock
+
+SNAPSHOT_VERSION = 1
+
+def source_fingerprint(paths, **params):
+    """
+    Hashes the size and modification time of every source file along with the parameters that shape the
+    cleaned data, so a snapshot is invalidated as soon as a source changes without reading the sources.
+
+    Args:
+        paths (list): Source files. Missing files are hashed as missing.
+        **params: Anything else the cleaned data depends on, such as the movie replacement map.
+
+    Returns:
+        str: A hex digest that identifies the sources.
+    """
+    digest = hashlib.sha1(f"v{SNAPSHOT_VERSION}".encode())
+    for path in paths:
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        except FileNotFoundError:
+            digest.update(f"{path}:missing".encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+def _save_frame(directory, name, df):
+    columns = []
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.dtype.kind not in 'biuf':
+            values = df[column].to_numpy(dtype=str)
+        np.save(os.path.join(directory, f"{name}.{column}.npy"), values, allow_pickle=False)
+        columns.append(column)
+
+    has_index = not df.index.equals(pd.RangeIndex(len(df)))
+    if has_index:
+        np.save(os.path.join(directory, f"{name}.index.npy"), df.index.to_numpy(), allow_pickle=False)
+    return {'columns': columns, 'has_index': has_index}
+
+def _load_frame(directory, name, manifest):
+    data = {column: np.load(os.path.join(directory, f"{name}.{column}.npy"), mmap_mode='r')
+            for column in manifest['columns']}
+    index = np.load(os.path.join(directory, f"{name}.index.npy"), mmap_mode='r') if manifest['has_index'] else None
+    # copy=False keeps the numeric columns backed by the memory-mapped files, which tests/test_snapshot.py checks
+    return pd.DataFrame(data, index=index, copy=False)
+
+def save_snapshot(directory, df_movies, df_ratings, genre_encoding, fingerprint):
+    """
+    Writes cleaned data as one .npy file per column plus the sparse genre encoding. The snapshot is written
+    into a temporary directory and moved into place, so readers never see a partial snapshot. Writers of
+    the same directory must hold its lock, as _cached does.
+
+    Args:
+        directory (str): Destination directory.
+        df_movies (pd.Dataframe): Cleaned movie data.
+        df_ratings (pd.Dataframe): Cleaned rating data.
+        genre_encoding (pp.GenreEncoding): Sparse genre encoding of df_movies.
+        fingerprint (str): The source_fingerprint the data was built from.
+    """
+    # A unique name keeps concurrent writers, in this process or another, out of each other's way
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_directory = tempfile.mkdtemp(prefix=os.path.basename(directory) + '.tmp', dir=parent)
+
+    manifest = {'version': SNAPSHOT_VERSION,
+                'fingerprint': fingerprint,
+                'movies': _save_frame(tmp_directory, 'movies', df_movies),
+                'ratings': _save_frame(tmp_directory, 'ratings', df_ratings),
+                'genres': {'vocabulary': list(genre_encoding.vocabulary),
+                           'shape': list(genre_encoding.matrix.shape)}}
+    np.save(os.path.join(tmp_directory, 'genres.data.npy'), genre_encoding.matrix.data)
+    np.save(os.path.join(tmp_directory, 'genres.indices.npy'), genre_encoding.matrix.indices)
+    np.save(os.path.join(tmp_directory, 'genres.indptr.npy'), genre_encoding.matrix.indptr)
+    np.save(os.path.join(tmp_directory, 'genres.movie_index.npy'), genre_encoding.movie_index.to_numpy())
+    with open(os.path.join(tmp_directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    try:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_directory, directory)
+    except BaseException:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        raise
+
+def load_snapshot(directory, fingerprint=None):
+    """
+    Loads a snapshot written by save_snapshot. Numeric columns and the genre matrix are memory-mapped
+    rather than read, so loading costs almost nothing until the data is used.
+
+    Args:
+        directory (str): The snapshot directory.
+        fingerprint (str): If given, the snapshot must have been built from these sources.
+
+    Returns:
+        tuple: The cleaned movies and ratings pd.Dataframes and the pp.GenreEncoding, or None if the
+            snapshot is missing, stale or was written by another version.
+    """
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest['version'] != SNAPSHOT_VERSION or (fingerprint is not None and manifest['fingerprint'] != fingerprint):
+        return None
+
+    df_movies = _load_frame(directory, 'movies', manifest['movies'])
+    df_ratings = _load_frame(directory, 'ratings', manifest['ratings'])
+
+    load = lambda name: np.load(os.path.join(directory, f"genres.{name}.npy"), mmap_mode='r')
+    matrix = sparse.csr_matrix((load('data'), load('indices'), load('indptr')),
+                               shape=tuple(manifest['genres']['shape']), copy=False)
+    genre_encoding = pp.GenreEncoding(matrix=matrix,
+                                      vocabulary=manifest['genres']['vocabulary'],
+                                      movie_index=pd.Index(load('movie_index')))
+    return df_movies, df_ratings, genre_encoding
+
+def _cached(cache_dir, name, fingerprint, build):
+    # Readers share the lock and a builder takes it exclusively, so a snapshot isn't replaced while it is
+    # being opened, and concurrent builders, e.g. two background threads or workers, build it only once.
+    # The memory-mapped files stay valid after the lock is released, even if the snapshot is replaced.
+    directory = os.path.join(cache_dir, name)
+    lock_path = directory + '.lock'
+    with file_lock(lock_path):
+        cached = load_snapshot(directory, fingerprint)
+    if cached is not None:
+        return cached
+
+    with file_lock(lock_path, exclusive=True):
+        cached = load_snapshot(directory, fingerprint)
+        if cached is not None:
+            return cached
+        df_movies, df_ratings = build()
+        genre_encoding = pp.encode_genres(df_movies=df_movies, sparse=True)
+        save_snapshot(directory, df_movies, df_ratings, genre_encoding, fingerprint)
+        return load_snapshot(directory, fingerprint)
+
+def load_clean_data(movies_path, ratings_path, cache_dir, movie_replacement_map=None):
+    """
+    Returns the cleaned CSV dataset, reading and cleaning the CSVs only if they changed since the
+    cached snapshot was written.
+
+    Args:
+        movies_path (str): Path of movies.csv.
+        ratings_path (str): Path of ratings.csv.
+        cache_dir (str): Directory that holds the snapshots.
+        movie_replacement_map (dictionary): Bad movieIds that are mapped to their replacement movieIds.
+
+    Returns:
+        tuple: The cleaned movies and ratings pd.Dataframes and their pp.GenreEncoding.
+    """
+    fingerprint = source_fingerprint([movies_path, ratings_path], movie_replacement_map=movie_replacement_map)
+
+    def build():
+        df_movies, df_ratings = pp.load_data(movies_path, ratings_path)
+        df_movies = pp.clean_movies(df_movies)
+        df_ratings = pp.clean_ratings(df_ratings, movie_replacement_map=movie_replacement_map)
+        return df_movies, df_ratings
+
+    return _cached(cache_dir, 'csv', fingerprint, build)
+
+def database_version(db_path):
+    """
+    Returns the database's data version, which every write to the movies or ratings tables bumps (see database.schema).
+
+    Args:
+        db_path (str): Path of the SQLite database.
+
+    Returns:
+        int: The data version, or None for a database without one.
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return schema.get_data_version(conn)
+    finally:
+        conn.close()
+
+def _version_fingerprint(db_path, data_version):
+    if data_version is None:
+        return source_fingerprint([db_path, db_path + '-wal'])
+    return source_fingerprint([], db_path=os.path.abspath(db_path), data_version=data_version)
+
+def load_versioned_data_from_db(db_path, cache_dir):
+    """
+    Returns the movies and ratings tables along with the data version they were read at, querying the
+    database only if its data changed since the cached snapshot was written. The version and the tables
+    are read in one transaction, so they agree even while ratings are being written.
+
+    Args:
+        db_path (str): Path of the SQLite database.
+        cache_dir (str): Directory that holds the snapshots.
+
+    Returns:
+        tuple: The movies and ratings pd.Dataframes, their pp.GenreEncoding and the data version (None for
+            a database without one).
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        # Everything below is read from the one snapshot of the database that this transaction sees
+        conn.execute("BEGIN")
+        data_version = schema.get_data_version(conn)
+
+        def build():
+            df_movies = pd.read_sql_query("SELECT movieId, title, genres, year, normalized_year FROM movies", conn)
+            df_ratings = pd.read_sql_query("SELECT userId, movieId, rating, timestamp FROM ratings", conn)
+            return df_movies, df_ratings
+
+        data = _cached(cache_dir, 'db', _version_fingerprint(db_path, data_version), build)
+    finally:
+        conn.close()
+    return data + (data_version,)
+
+def load_clean_data_from_db(db_path, cache_dir):
+    """
+    Returns the movies and ratings tables, which are cleaned during ingestion, querying the database only
+    if its data changed since the cached snapshot was written.
+
+    Args:
+        db_path (str): Path of the SQLite database.
+        cache_dir (str): Directory that holds the snapshots.
+
+    Returns:
+        tuple: The movies and ratings pd.Dataframes and their pp.GenreEncoding.
+    """
+    return load_versioned_data_from_db(db_path, cache_dir)[:3]
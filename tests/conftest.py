@@ -0,0 +1,117 @@
+import sqlite3
+import sys, os
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '..'))
+import recommender.preprocessing as pp
+import database.schema as schema
+from database.write_queue import RatingChange
+from benchmarks.synthetic import make_dataset
+
+class RatingLog:
+    """
+    Keeps the ratings table in memory and turns writes into the RatingChanges the rating writer would pass
+    to its listeners, each with the next data version.
+
+    Args:
+        df_ratings (pd.Dataframe): The initial ratings, with timestamps.
+        data_version (int): The data version the initial ratings are at.
+    """
+
+    def __init__(self, df_ratings, data_version=1):
+        self.ratings = {(int(row.userId), int(row.movieId)): (float(row.rating), int(row.timestamp))
+                        for row in df_ratings.itertuples(index=False)}
+        self.data_version = data_version
+
+    def write(self, writes):
+        """
+        Applies writes to the ratings.
+
+        Args:
+            writes (list): (user_id, movie_id, rating, timestamp) tuples, with a None rating for a delete.
+
+        Returns:
+            list: The RatingChanges of the writes. Deletes of ratings that don't exist are left out.
+        """
+        changes = []
+        for user_id, movie_id, rating, timestamp in writes:
+            old_rating, old_timestamp = self.ratings.get((user_id, movie_id), (None, None))
+            if rating is None:
+                if old_rating is None:
+                    continue
+                del self.ratings[(user_id, movie_id)]
+            else:
+                self.ratings[(user_id, movie_id)] = (float(rating), timestamp)
+            self.data_version += 1
+            changes.append(RatingChange(user_id, movie_id, old_rating, old_timestamp,
+                                        None if rating is None else float(rating), timestamp, self.data_version))
+        return changes
+
+    def frame(self):
+        """Returns the ratings as a pd.Dataframe."""
+        return pd.DataFrame([(user_id, movie_id, rating, timestamp)
+                             for (user_id, movie_id), (rating, timestamp) in self.ratings.items()],
+                            columns=['userId', 'movieId', 'rating', 'timestamp'])
+
+def random_writes(rng, num_writes, num_users, movie_ids, now=1700000000):
+    """Returns random upserts and, for every fifth write, deletes, in the format of RatingLog.write."""
+    writes = []
+    for i in range(num_writes):
+        user_id, movie_id = int(rng.integers(1, num_users + 1)), int(rng.choice(movie_ids))
+        rating = None if i % 5 == 0 else float(rng.integers(1, 11) / 2)
+        writes.append((user_id, movie_id, rating, now - int(rng.integers(0, 400 * 86400))))
+    return writes
+
+@pytest.fixture
+def dataset():
+    # A small MovieLens-shaped dataset: cleaned movies, their sparse genre encoding and ratings
+    df_movies, df_ratings = make_dataset(num_users=40, num_movies=60, num_ratings=600, seed=7)
+    df_movies = pp.clean_movies(df_movies)
+    genre_encoding = pp.encode_genres(df_movies=df_movies, sparse=True)
+    return df_movies, df_ratings, genre_encoding
+
+@pytest.fixture
+def database(tmp_path, dataset):
+    # A SQLite database with the current schema, filled with the dataset
+    df_movies, df_ratings, _ = dataset
+    db_path = str(tmp_path / 'movies.db')
+    conn = sqlite3.connect(db_path)
+    try:
+        schema.apply_pragmas(conn)
+        schema.create_schema(conn)
+        columns = ['movieId', 'title', 'genres', 'year', 'normalized_year']
+        conn.executemany("INSERT INTO movies (movieId, title, genres, year, normalized_year) VALUES (?, ?, ?, ?, ?)",
+                         df_movies[columns].astype(object).where(df_movies[columns].notna(), None).itertuples(index=False, name=None))
+        conn.executemany("INSERT INTO ratings (userId, movieId, rating, timestamp) VALUES (?, ?, ?, ?)",
+                         df_ratings[['userId', 'movieId', 'rating', 'timestamp']].astype(object).itertuples(index=False, name=None))
+        conn.executemany("INSERT INTO users (user_id, username, password_hash, is_dataset_user) VALUES (?, ?, NULL, 1)",
+                         ((int(user_id), f"user{user_id}") for user_id in df_ratings['userId'].unique()))
+        conn.commit()
+    finally:
+        conn.close()
+    return db_path
+
+def run_in_child(func, *args):
+    """
+    Runs func in a forked process, which shares nothing with the test process but the files it writes, like
+    another app worker would. Fails the test if func raises.
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            func(*args)
+            code = 0
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0, "the child process failed"
+
+needs_fork = pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs os.fork")
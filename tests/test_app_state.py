@@ -0,0 +1,98 @@
+import importlib
+import sqlite3
+import sys
+
+import pandas as pd
+import pytest
+
+import recommender.snapshot as snapshot
+
+@pytest.fixture
+def app_module(tmp_path, database, monkeypatch):
+    # app.py reads its paths from the environment when it is imported, so it is imported afresh per test
+    monkeypatch.setenv('FLASK_SECRET_KEY', 'test')
+    monkeypatch.setenv('MOVIES_DB_PATH', database)
+    monkeypatch.setenv('ARTIFACTS_DIR', str(tmp_path / 'artifacts'))
+    module = importlib.reload(sys.modules['app']) if 'app' in sys.modules else importlib.import_module('app')
+    module.migrate_db()
+    yield module
+    module.rating_write_queue.close()
+    module.db_pool.close_all()
+    module.read_db_pool.close_all()
+
+def write_behind_the_journals(db_path):
+    # A write that doesn't go through the app, like an ingestion, so no journal carries it
+    conn = sqlite3.connect(db_path)
+    try:
+        user_id, movie_id = conn.execute("SELECT userId, movieId FROM ratings ORDER BY userId, movieId LIMIT 1").fetchone()
+        conn.execute("UPDATE ratings SET rating = 6 - rating WHERE userId = ? AND movieId = ?", (user_id, movie_id))
+        conn.execute("DELETE FROM ratings WHERE userId = ? AND movieId != ? AND rowid IN (SELECT rowid FROM ratings WHERE userId = ? LIMIT 2)",
+                     (user_id, movie_id, user_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def read_ratings(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return pd.read_sql_query("SELECT userId, movieId, rating, timestamp FROM ratings", conn)
+    finally:
+        conn.close()
+
+def test_stale_profile_store_is_rebuilt(app_module, database):
+    store = app_module.get_profile_store()
+    assert store.data_version == snapshot.database_version(database)
+
+    write_behind_the_journals(database)
+    # A restarted worker finds the saved store behind the database
+    app_module._profile_store = None
+    rebuilt = app_module.get_profile_store()
+
+    assert rebuilt is not store
+    assert rebuilt.data_version == snapshot.database_version(database)
+    assert rebuilt.verify(read_ratings(database)) == []
+
+def test_stale_popularity_index_is_rebuilt(app_module, database):
+    index = app_module.get_popularity_index()
+    assert index.data_version == snapshot.database_version(database)
+    assert app_module._load_popularity_index() is not None
+
+    write_behind_the_journals(database)
+    assert app_module._load_popularity_index() is None
+    app_module._popularity_index = None
+    # A request doesn't wait for the rebuild, it gets no index until the background build is done
+    assert app_module.get_popularity_index(wait=False) is None
+    app_module._popularity_index_build_thread.join()
+
+    rebuilt = app_module.get_popularity_index(wait=False)
+    assert rebuilt is not None and rebuilt is not index
+    assert rebuilt.data_version == snapshot.database_version(database)
+
+def test_rating_writes_reach_the_loaded_state(app_module, database):
+    store = app_module.get_profile_store()
+    index = app_module.get_popularity_index()
+    user_id, movie_id = 1, int(read_ratings(database)['movieId'].iloc[0])
+
+    app_module.add_user_rating(user_id, movie_id, 5, 1700000000)
+    app_module.delete_user_rating(user_id, movie_id)
+    app_module.add_user_rating(user_id, movie_id, 2, 1700000000)
+
+    version = snapshot.database_version(database)
+    assert store.data_version == version
+    assert index.data_version == version
+    assert store.verify(read_ratings(database)) == []
+
+@pytest.mark.parametrize('path', ['/metrics', '/cache_stats'])
+def test_monitoring_endpoints_require_the_metrics_token(app_module, monkeypatch, path):
+    client = app_module.app.test_client()
+    assert client.get(path).status_code == 503
+
+    # The token is read when app.py is imported, so the app is imported again with it set
+    app_module.rating_write_queue.close()
+    app_module.db_pool.close_all()
+    app_module.read_db_pool.close_all()
+    monkeypatch.setenv('METRICS_TOKEN', 'secret')
+    client = importlib.reload(app_module).app.test_client()
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get(path, headers={'Authorization': 'Bearer secret'}).status_code == 200
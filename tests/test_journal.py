@@ -0,0 +1,75 @@
+import pytest
+
+from conftest import run_in_child, needs_fork
+from recommender.journal import Journal
+
+@needs_fork
+def test_reads_lines_appended_by_other_processes(tmp_path):
+    path = str(tmp_path / 'updates.journal')
+    reader = Journal(path)
+    reader.seek_end()
+
+    def append(worker):
+        journal = Journal(path)
+        for i in range(50):
+            journal.append([f"{worker} {i}", f"{worker} {i} again"])
+
+    for worker in range(3):
+        run_in_child(append, worker)
+
+    lines = reader.read()
+    assert sorted(lines) == sorted(f"{worker} {i}{suffix}" for worker in range(3) for i in range(50) for suffix in ('', ' again'))
+    assert reader.read() == []
+
+def test_reader_behind_one_compaction_reads_every_line_once(tmp_path):
+    path = str(tmp_path / 'updates.journal')
+    reader, writer = Journal(path), Journal(path)
+    reader.seek_end()
+    writer.seek_end()
+
+    writer.append(['a', 'b'])
+    saved = []
+    assert writer.compact(lambda lines, position: saved.extend(lines))
+    writer.append(['c'])
+
+    assert saved == ['a', 'b']
+    assert reader.read() == ['a', 'b', 'c']
+    assert reader.read() == []
+
+def test_reader_behind_two_compactions_must_reload(tmp_path):
+    path = str(tmp_path / 'updates.journal')
+    reader, writer = Journal(path), Journal(path)
+    reader.seek_end()
+    writer.seek_end()
+
+    snapshot = {}
+    def save(lines, position):
+        snapshot['lines'] = snapshot.get('lines', []) + lines
+        snapshot['position'] = position
+
+    writer.append(['a'])
+    writer.compact(save)
+    writer.append(['b'])
+    writer.compact(save)
+    writer.append(['c'])
+
+    with pytest.raises(ValueError):
+        reader.read()
+    # Reloading the snapshot means reading on from the position it was saved at
+    reader.open(snapshot['position'])
+    assert snapshot['lines'] == ['a', 'b']
+    assert reader.read() == ['c']
+
+def test_min_size_leaves_a_small_journal_alone(tmp_path):
+    journal = Journal(str(tmp_path / 'updates.journal'))
+    journal.append(['a'])
+    assert not journal.compact(lambda lines, position: None, min_size=1024)
+    assert journal.read() == ['a']
+
+def test_position_of_a_replaced_journal_is_rejected(tmp_path):
+    path = str(tmp_path / 'updates.journal')
+    journal = Journal(path)
+    position = journal.seek_end()
+    Journal(path).compact(lambda lines, position: None)
+    with pytest.raises(ValueError):
+        Journal(path).open(position)
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import recommender.preprocessing as pp
+import recommender.model as model
+
+@pytest.fixture
+def edge_cases():
+    # Movie 3 has no genres and movie 4 is never rated. User 2 only rated the genreless movie, and user 3
+    # also rated a movie that isn't in the movie data.
+    df_movies = pd.DataFrame({'movieId': [1, 2, 3, 4],
+                              'title': ['A (1990)', 'B (2000)', 'C (2010)', 'D (1980)'],
+                              'normalized_year': [0.33, 0.67, 1.0, 0.0]})
+    df_genres = pd.DataFrame({'Action': [1, 0, 0, 0], 'Comedy': [1, 0, 0, 1], 'Drama': [0, 1, 0, 0]},
+                             index=pd.Index([1, 2, 3, 4], name='movieId'))
+    df_ratings = pd.DataFrame({'userId': [1, 1, 2, 3, 3],
+                               'movieId': [1, 2, 3, 1, 99],
+                               'rating': [4.0, 2.0, 5.0, 3.0, 1.0]})
+    return df_movies, df_genres, df_ratings
+
+def test_sparse_profiles_match_the_dense_profiles(edge_cases):
+    df_movies, df_genres, df_ratings = edge_cases
+    expected = model.create_user_profiles(df_ratings, df_movies, df_genres)
+    actual = model.create_user_profiles_sparse(df_ratings, df_movies, df_genres)
+
+    pd.testing.assert_frame_equal(actual, expected, check_names=False)
+    np.testing.assert_allclose(actual.loc[1].to_numpy(), [4 / 6, 4 / 6, 2 / 6])
+    np.testing.assert_array_equal(actual.loc[2].to_numpy(), [0, 0, 0])
+
+def test_sparse_profiles_match_with_a_sparse_genre_encoding(dataset):
+    df_movies, df_ratings, genre_encoding = dataset
+    expected = model.create_user_profiles(df_ratings, df_movies, pp.encode_genres(df_movies=df_movies))
+    actual = model.create_user_profiles_sparse(df_ratings, df_movies, genre_encoding)
+
+    pd.testing.assert_frame_equal(actual, expected, check_names=False)
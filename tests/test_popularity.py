@@ -0,0 +1,114 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import RatingLog, random_writes, run_in_child, needs_fork
+import recommender.popularity as popularity
+from recommender.journal import Journal
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / 'popularity.journal')
+
+def assert_matches_rebuild(index, dataset, df_ratings):
+    df_movies, _, genre_encoding = dataset
+    expected = popularity.build_popularity_index(df_movies, df_ratings, genre_encoding)
+    index.top(1)
+    np.testing.assert_allclose(index.rating_sums, expected.rating_sums)
+    np.testing.assert_array_equal(index.rating_counts, expected.rating_counts)
+    # Buckets that fell out of the recent window may hold leftovers that are never read, so only the live ones are compared
+    assert index.latest_bucket == expected.latest_bucket
+    np.testing.assert_array_equal(index.bucket_ids, expected.bucket_ids)
+    live = index.bucket_ids > index.latest_bucket - index.num_buckets
+    np.testing.assert_allclose(index.bucket_sums[live], expected.bucket_sums[live])
+    np.testing.assert_array_equal(index.bucket_counts[live], expected.bucket_counts[live])
+    assert index.top(10).equals(expected.top(10))
+
+def build(dataset, df_ratings, journal_path, data_version):
+    df_movies, _, genre_encoding = dataset
+    journal = Journal(journal_path)
+    journal.seek_end()
+    return popularity.build_popularity_index(df_movies, df_ratings, genre_encoding, data_version=data_version, journal=journal)
+
+@needs_fork
+def test_replays_changes_written_by_another_process(tmp_path, journal_path, dataset):
+    _, df_ratings, genre_encoding = dataset
+    index_path = str(tmp_path / 'popularity.npz')
+    log = RatingLog(df_ratings)
+    index = build(dataset, df_ratings, journal_path, log.data_version)
+    index.save(index_path)
+
+    changes = log.write(random_writes(np.random.default_rng(2), 100, 45, genre_encoding.movie_index))
+
+    def other_worker():
+        other = popularity.load_popularity_index(index_path, journal_path=journal_path)
+        other.apply_rating_changes(changes[:50])
+        # A worker whose index isn't loaded yet only journals its changes
+        popularity.journal_rating_changes(journal_path, changes[50:])
+
+    run_in_child(other_worker)
+
+    assert_matches_rebuild(index, dataset, log.frame())
+    assert index.data_version == log.data_version
+
+def test_compaction_while_a_reader_is_behind(tmp_path, journal_path, dataset):
+    _, df_ratings, genre_encoding = dataset
+    index_path = str(tmp_path / 'popularity.npz')
+    log = RatingLog(df_ratings)
+    writer = build(dataset, df_ratings, journal_path, log.data_version)
+    writer.compact(index_path)
+    reader = popularity.load_popularity_index(index_path, journal_path=journal_path)
+
+    rng = np.random.default_rng(3)
+    for _ in range(2):
+        writer.apply_rating_changes(log.write(random_writes(rng, 30, 45, genre_encoding.movie_index)))
+        assert writer.compact(index_path)
+    writer.apply_rating_changes(log.write(random_writes(rng, 30, 45, genre_encoding.movie_index)))
+
+    assert_matches_rebuild(reader, dataset, log.frame())
+    assert reader.data_version == log.data_version
+
+    # A restart loads the saved sums on their own and replays only what was journaled since
+    restarted = popularity.load_popularity_index(index_path, journal_path=journal_path)
+    assert_matches_rebuild(restarted, dataset, log.frame())
+
+def test_rebuild_keeps_writes_made_while_the_ratings_were_read(journal_path, dataset):
+    df_movies, df_ratings, genre_encoding = dataset
+    log = RatingLog(df_ratings)
+    rng = np.random.default_rng(4)
+
+    journal = Journal(journal_path)
+    journal.seek_end()
+    popularity.journal_rating_changes(journal_path, log.write(random_writes(rng, 20, 45, genre_encoding.movie_index)))
+    df_read, read_version = log.frame(), log.data_version
+    popularity.journal_rating_changes(journal_path, log.write(random_writes(rng, 20, 45, genre_encoding.movie_index)))
+
+    index = popularity.build_popularity_index(df_movies, df_read, genre_encoding, data_version=read_version, journal=journal)
+
+    assert index.base_version == read_version
+    assert index.data_version == log.data_version
+    assert_matches_rebuild(index, dataset, log.frame())
+
+def test_saved_index_is_rejected_for_other_windows(tmp_path, journal_path, dataset):
+    _, df_ratings, _ = dataset
+    index_path = str(tmp_path / 'popularity.npz')
+    build(dataset, df_ratings, journal_path, 1).save(index_path)
+    with pytest.raises(ValueError):
+        popularity.load_popularity_index(index_path, journal_path=journal_path, recent_days=30)
+
+def test_recent_window_ends_now(dataset):
+    df_movies, df_ratings, genre_encoding = dataset
+    now = int(time.time())
+    movie_ids = genre_encoding.movie_index[:3]
+    # Only the rating from last week is recent, the one from two years ago is only in the all-time window
+    df_recent = pd.DataFrame({'userId': [1, 2, 3], 'movieId': movie_ids,
+                              'rating': [4.0, 5.0, 3.0], 'timestamp': [now - 7 * 86400, now - 730 * 86400, now - 800 * 86400]})
+    index = popularity.build_popularity_index(df_movies, df_recent, genre_encoding)
+    assert index.top(10, window='recent')['movieId'].tolist() == [movie_ids[0]]
+    assert len(index.top(10, window='all')) == 3
+
+    # A dataset whose newest rating is years old has no recent movies at all
+    index = popularity.build_popularity_index(df_movies, df_recent.iloc[1:], genre_encoding)
+    assert index.top(10, window='recent').empty
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import RatingLog, random_writes, run_in_child, needs_fork
+from recommender.profile_store import ProfileStore, journal_rating_changes
+
+@pytest.fixture
+def store_factory(tmp_path, dataset):
+    _, _, genre_encoding = dataset
+    journal_path = str(tmp_path / 'profile_store.journal')
+
+    def make_store(journal=True):
+        return ProfileStore(genre_encoding.matrix, genre_encoding.movie_index, genre_encoding.vocabulary,
+                            journal_path=journal_path if journal else None)
+    return make_store
+
+def assert_matches_rebuild(store, store_factory, df_ratings):
+    expected = store_factory(journal=False)
+    expected.rebuild(df_ratings)
+    pd.testing.assert_frame_equal(store.profiles(), expected.profiles(), check_exact=False, atol=1e-9)
+    assert store.verify(df_ratings) == []
+
+def test_batched_changes_match_a_rebuild(store_factory, dataset):
+    _, df_ratings, genre_encoding = dataset
+    log = RatingLog(df_ratings)
+    store = store_factory()
+    store.rebuild(df_ratings, data_version=log.data_version)
+
+    rng = np.random.default_rng(1)
+    for _ in range(10):
+        store.apply_rating_changes(log.write(random_writes(rng, 20, 45, genre_encoding.movie_index)))
+
+    assert store.data_version == log.data_version
+    assert_matches_rebuild(store, store_factory, log.frame())
+
+@needs_fork
+def test_replays_changes_written_by_another_process(tmp_path, store_factory, dataset):
+    _, df_ratings, genre_encoding = dataset
+    snapshot_path = str(tmp_path / 'profile_store.npz')
+    log = RatingLog(df_ratings)
+    store = store_factory()
+    store.rebuild(df_ratings, data_version=log.data_version)
+    store.save(snapshot_path)
+
+    changes = log.write(random_writes(np.random.default_rng(2), 100, 45, genre_encoding.movie_index))
+
+    def other_worker():
+        other = store_factory()
+        other.load(snapshot_path)
+        other.apply_rating_changes(changes[:50])
+        # A worker whose store isn't loaded yet only journals its changes
+        journal_rating_changes(other.journal_path, changes[50:])
+
+    run_in_child(other_worker)
+
+    assert store.data_version < log.data_version
+    assert_matches_rebuild(store, store_factory, log.frame())
+    assert store.data_version == log.data_version
+
+def test_compaction_while_a_reader_is_behind(tmp_path, store_factory, dataset):
+    _, df_ratings, genre_encoding = dataset
+    snapshot_path = str(tmp_path / 'profile_store.npz')
+    log = RatingLog(df_ratings)
+    writer = store_factory()
+    writer.rebuild(df_ratings, data_version=log.data_version)
+    writer.compact(snapshot_path)
+    reader = store_factory()
+    reader.load(snapshot_path)
+
+    rng = np.random.default_rng(3)
+    # The reader doesn't read the journal in between, so it falls two compactions behind and must reload
+    for _ in range(2):
+        writer.apply_rating_changes(log.write(random_writes(rng, 30, 45, genre_encoding.movie_index)))
+        assert writer.compact(snapshot_path)
+    writer.apply_rating_changes(log.write(random_writes(rng, 30, 45, genre_encoding.movie_index)))
+
+    assert_matches_rebuild(reader, store_factory, log.frame())
+    assert reader.data_version == log.data_version
+
+    # A restart loads the last snapshot and replays only what was journaled since
+    restarted = store_factory()
+    restarted.load(snapshot_path)
+    assert_matches_rebuild(restarted, store_factory, log.frame())
+
+def test_rebuild_keeps_writes_made_while_the_ratings_were_read(store_factory, dataset):
+    _, df_ratings, genre_encoding = dataset
+    log = RatingLog(df_ratings)
+    rng = np.random.default_rng(4)
+    store = store_factory()
+    writer = store_factory()
+
+    # The rebuild takes its journal position, then the ratings are read while other writes commit: the ones
+    # that commit before the read are in the ratings and must not be applied twice, the ones after it must
+    # be replayed from the journal
+    store.journal_position()
+    journal_rating_changes(writer.journal_path, log.write(random_writes(rng, 20, 45, genre_encoding.movie_index)))
+    df_read, read_version = log.frame(), log.data_version
+    journal_rating_changes(writer.journal_path, log.write(random_writes(rng, 20, 45, genre_encoding.movie_index)))
+
+    store.rebuild(df_read, data_version=read_version)
+
+    assert store.base_version == read_version
+    assert store.data_version == log.data_version
+    assert_matches_rebuild(store, store_factory, log.frame())
+
+def test_stale_snapshot_is_detected_by_its_data_version(tmp_path, store_factory, dataset):
+    _, df_ratings, genre_encoding = dataset
+    snapshot_path = str(tmp_path / 'profile_store.npz')
+    log = RatingLog(df_ratings)
+    store = store_factory()
+    store.rebuild(df_ratings, data_version=log.data_version)
+    store.compact(snapshot_path)
+
+    # Writes that bypass the journal, like an ingestion, move the database past the snapshot
+    log.write(random_writes(np.random.default_rng(5), 10, 45, genre_encoding.movie_index))
+
+    loaded = store_factory()
+    loaded.load(snapshot_path)
+    assert loaded.data_version != log.data_version
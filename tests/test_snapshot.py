@@ -0,0 +1,69 @@
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+import recommender.snapshot as snapshot
+
+def memory_map_of(array):
+    # The np.memmap an array is a view of, or None if its data was copied
+    while array is not None and not isinstance(array, np.memmap):
+        array = getattr(array, 'base', None)
+    return array
+
+def test_numeric_columns_stay_memory_mapped(tmp_path, database):
+    df_movies, df_ratings, genre_encoding, _ = snapshot.load_versioned_data_from_db(database, str(tmp_path / 'cache'))
+
+    for name, df in (('ratings', df_ratings), ('movies', df_movies)):
+        for column in df.columns:
+            values = df[column].to_numpy()
+            if values.dtype.kind not in 'biuf':
+                continue
+            mapped = memory_map_of(values)
+            assert mapped is not None, f"{name}.{column} was copied out of its memory-mapped file"
+            assert mapped.filename.endswith(f"{name}.{column}.npy")
+            assert np.shares_memory(values, mapped)
+
+    for part in (genre_encoding.matrix.data, genre_encoding.matrix.indices, genre_encoding.matrix.indptr):
+        assert memory_map_of(part) is not None
+
+def test_snapshot_is_reused_until_the_data_changes(tmp_path, database):
+    cache_dir = str(tmp_path / 'cache')
+    _, df_ratings, _, data_version = snapshot.load_versioned_data_from_db(database, cache_dir)
+    _, cached_ratings, _, cached_version = snapshot.load_versioned_data_from_db(database, cache_dir)
+    assert cached_version == data_version
+    assert memory_map_of(cached_ratings['rating'].to_numpy()).filename == memory_map_of(df_ratings['rating'].to_numpy()).filename
+
+    conn = sqlite3.connect(database)
+    conn.execute("DELETE FROM ratings WHERE rowid = (SELECT MIN(rowid) FROM ratings)")
+    conn.commit()
+    conn.close()
+
+    _, changed_ratings, _, changed_version = snapshot.load_versioned_data_from_db(database, cache_dir)
+    assert changed_version > data_version
+    assert len(changed_ratings) == len(df_ratings) - 1
+    # The replaced snapshot's files stay readable through the old memory maps
+    assert len(df_ratings['rating'].to_numpy()) == len(changed_ratings) + 1
+
+def test_concurrent_builders_share_one_snapshot(tmp_path, database):
+    cache_dir = str(tmp_path / 'cache')
+    results, errors = [], []
+
+    def load():
+        try:
+            results.append(snapshot.load_versioned_data_from_db(database, cache_dir))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    expected = results[0][1]
+    for _, df_ratings, _, _ in results[1:]:
+        pd.testing.assert_frame_equal(df_ratings, expected)
+    assert sorted(path.name for path in (tmp_path / 'cache').iterdir()) == ['db', 'db.lock']